@@ -0,0 +1,22 @@
+'''
+ניקוי כתובת לשם הרחוב - משותף להכנת הדאטה (assets_data_prep, chunked_prep) ולשרת (api, InferencePipeline),
+כך שהכתובת בחיזוי עוברת בדיוק את הניקוי של האימון. בלי pandas, כדי שהשרת לא יטען אותה.
+'''
+import re
+import numpy as np
+
+
+def _is_missing(val):
+    return val is None or (isinstance(val, float) and val != val)
+
+
+def clean_address(val):
+    '''
+    מסירה את מספרי הבית. ערך חסר מוחזר כמו שהוא, וכתובת שהייתה רק מספר הופכת ל-NaN.
+    '''
+    if _is_missing(val):
+        return val
+    # מסיר ספרות
+    cleaned = re.sub(r'\d+', '', str(val)).strip()
+    # אם אחרי הניקוי לא נשאר כלום - כנראה היה רק מספר
+    return cleaned if cleaned else np.nan
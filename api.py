@@ -1,174 +1,241 @@
-from flask import Flask, request, render_template
-import pandas as pd
-import pickle
-from assets_data_prep import prepare_data, clean_address
+from flask import Flask, Blueprint, current_app, request, render_template, jsonify, abort, g, Response
+from werkzeug.exceptions import ServiceUnavailable
+import os
+import hmac
+import hashlib
+import json
+import time
+from inference_pipeline import predict_prices
+from model_registry import ModelRegistry
+from prediction_cache import PredictionCache, record_key
+from instrumentation import LatencyHistogram
+from bounded_executor import BoundedExecutor, ExecutorFull, TimeoutError
+from listing_schema import validate_listings, form_listing
+from address_cleaning import clean_address
+from suggest_index import SuggestIndex, FIELDS as SUGGEST_FIELDS, DEFAULT_LIMIT, MAX_LIMIT
 import numpy as np
 
-def safe_float(val):
-    try:
-        return float(val)
-    except (ValueError, TypeError):
-        return np.nan
+# רשימת המאפיינים כפי שנשלחת מהטופס
+ALL_FEATURES = ['מיזוג', 'משופצת', 'מרפסת', 'חניה', 'מעלית', 'סורגים',
+                'ריהוט', 'ממ"ד', 'חיות מחמד', 'מחסן', 'גישה לנכים']
+MAX_BATCH_SIZE = 10000
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BUSY_MESSAGE = "השרת עמוס כרגע, נסו שוב בעוד כמה שניות"
+
+bp = Blueprint("prediction", __name__)
+
+
+class Serving:
+    '''
+    המצב של אפליקציה אחת: גרסת המודל הפעילה, מטמון החיזויים, מדידות ה-latency, ה-executor של החיזוי
+    ואינדקס ההשלמה של הטופס. נשמר ב-app.extensions["serving"] ונגיש בבקשה דרך _serving().
+    '''
+
+    def __init__(self, registry, prediction_cache, request_latency, executor):
+        self.registry = registry
+        self.prediction_cache = prediction_cache
+        self.request_latency = request_latency
+        self.executor = executor
+        self._suggest_index = None
+
+    def suggest_index(self, bundle):
+        # נבנה מחדש רק כשגרסת המודל מתחלפת; ההחלפה היא השמה אחת, כמו ב-ModelRegistry
+        index = self._suggest_index
+        if index is None or index.version != bundle.version:
+            index = SuggestIndex(bundle.vocabularies, bundle.version)
+            self._suggest_index = index
+        return index
+
+
+def _serving():
+    return current_app.extensions["serving"]
+
+
+def _env(name, default, cast):
+    value = os.environ.get(name)
+    return cast(value) if value not in (None, "") else default
+
+
+def default_config():
+    # כל ההגדרות ניתנות לשינוי במשתני סביבה (בקונטיינר) או בפרמטר config של create_app
+    return {
+        "MODEL_DIR": os.environ.get("MODEL_DIR", "."),
+        # קובץ ייצוא (linear_scorer) בתוך MODEL_DIR - חיזוי ב-NumPy בלבד, בלי pandas/scikit-learn בשרת
+        "MODEL_EXPORT": os.environ.get("MODEL_EXPORT") or None,
+        "PREDICTION_CACHE_SIZE": _env("PREDICTION_CACHE_SIZE", 10000, int),
+        "PREDICTION_CACHE_TTL": _env("PREDICTION_CACHE_TTL", 3600, float),
+        "PREDICTION_WORKERS": _env("PREDICTION_WORKERS", None, int),
+        "PREDICTION_QUEUE": _env("PREDICTION_QUEUE", None, int),
+        "PREDICTION_TIMEOUT": _env("PREDICTION_TIMEOUT", 30.0, float),
+        "MAX_BATCH_SIZE": _env("MAX_BATCH_SIZE", MAX_BATCH_SIZE, int),
+    }
+
+
+def create_app(config=None):
+    '''
+    בונה את אפליקציית ה-Flask וטוענת את כל רכיבי המודל מיד, לפני שהאפליקציה מקבלת בקשות.
+    תחת gunicorn עם preload_app (gunicorn.conf.py) הטעינה קורית בתהליך האב לפני ה-fork,
+    והזיכרון של המודל משותף בין ה-workers (copy-on-write).
+    '''
+    # index.html נמצא בשורש הפרויקט כשאין תיקיית templates
+    templates = os.path.join(ROOT, "templates")
+    app = Flask(__name__, template_folder=templates if os.path.isdir(templates) else ROOT)
+    app.config.update(default_config())
+    app.config.update(config or {})
+
+    # טעינת כל רכיבי המודל פעם אחת בעליית השרת - משותף לכל הבקשות
+    loader = None
+    if app.config["MODEL_EXPORT"]:
+        from linear_scorer import load_exported
+        export = app.config["MODEL_EXPORT"]
+        loader = lambda directory: load_exported(os.path.join(directory, export))
+    registry = ModelRegistry(app.config["MODEL_DIR"], loader)
+    registry.reload()
+    registry.install_signal_handler()
+
+    # מטמון תוצאות לבקשות חוזרות (אותה דירה מתומחרת שוב) - מתרוקן כשגרסת המודל מתחלפת
+    prediction_cache = PredictionCache(maxsize=app.config["PREDICTION_CACHE_SIZE"],
+                                       ttl=app.config["PREDICTION_CACHE_TTL"])
+
+    # החיזוי רץ ב-pool מוגבל: בקשה שמגיעה כשהוא מלא מקבלת 503 מיד במקום להיתקע בתור
+    executor = BoundedExecutor(app.config["PREDICTION_WORKERS"], app.config["PREDICTION_QUEUE"],
+                               app.config["PREDICTION_TIMEOUT"])
+
+    serving = Serving(registry, prediction_cache, LatencyHistogram(), executor)
+    # האינדקס נבנה כאן ולא בבקשה הראשונה - תחת preload_app גם הוא משותף בין ה-workers
+    serving.suggest_index(registry.current())
+    app.extensions["serving"] = serving
+    app.register_blueprint(bp)
+    return app
 
-def safe_int(val):
+
+def offload(fn, *args):
+    '''
+    מריצה את fn ב-executor של החיזוי. pool מלא או חריגה מ-PREDICTION_TIMEOUT - 503 עם Retry-After.
+    '''
     try:
-        return int(val)
-    except (ValueError, TypeError):
-        return np.nan
+        return _serving().executor.run(fn, *args)
+    except (ExecutorFull, TimeoutError):
+        raise ServiceUnavailable(BUSY_MESSAGE, retry_after=1)
 
-app = Flask(__name__)
 
-with open("trained_model.pkl", "rb") as f:
-    model = pickle.load(f)
+@bp.before_app_request
+def _start_timer():
+    g.request_started = time.perf_counter()
 
-df = pd.read_csv("train.csv")
-addresses = sorted(df['address'].dropna().unique())
-neighborhoods = sorted(df['neighborhood'].dropna().unique())
 
-@app.route("/", methods=["GET", "POST"])
-def index():
-    form_data = {}
-    error = None
-    prediction = None
+@bp.after_app_request
+def _record_latency(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        _serving().request_latency.observe(time.perf_counter() - started, endpoint=endpoint,
+                                           method=request.method, status=response.status_code)
+    return response
 
-    if request.method == "POST":
-        form_data = request.form.to_dict(flat=False)
-        form_data = {k: v[0] if len(v) == 1 else v for k, v in form_data.items()}
 
-        field_errors = {}
+def listing_to_record(listing):
+    """
+    הופכת ListingRecord (טופס או רשומת JSON אחרי validate_listings) לרשומה שה-InferencePipeline מקבל.
+    """
+    address = listing.address
+    if address == "אחר":
+        address = listing.custom_address
+    # אם אין כתובת והוזנה שכונה – נשתמש בשכונה בתור כתובת
+    if not address:
+        if listing.neighborhood and listing.neighborhood != "אחר":
+            address = listing.neighborhood
+    address = clean_address(address)
 
-        form_data["property_type"] = form_data.get("property_type", "").strip()
-        form_data["address"] = form_data.get("address", "").strip()
-        form_data["neighborhood"] = form_data.get("neighborhood", "").strip()
+    neighborhood = listing.neighborhood
+    if neighborhood == "אחר":
+        neighborhood = listing.custom_neighborhood
 
-        try:
-            room_number_val = float(form_data.get("room_number", ""))
-            if not (1 <= room_number_val <= 10):
-                field_errors["room_number"] = "מספר החדרים חייב להיות בין 1 ל-10"
-        except ValueError:
-            field_errors["room_number"] = "יש להזין מספר חדרים תקין (1-10)"
+    data = {
+        "room_num": listing.room_number,
+        "floor": listing.floor,
+        "area": listing.area,
+        "property_type": listing.property_type or "דירה",
+        "total_floors": listing.total_floors,
+        "monthly_arnona": listing.monthly_arnona,
+        "building_tax": listing.building_tax,
+        "garden_area": listing.garden_area,
+        "description": ""
+    }
 
-        try:
-            floor_val = int(form_data.get("floor", ""))
-            if floor_val < 1:
-                field_errors["floor"] = "קומה מינימלית חייבת להיות 1"
-        except ValueError:
-            field_errors["floor"] = "יש להזין מספר קומה תקין"
+    if address and address != "רחוב לא ידוע":
+        data["address"] = address
+        data["neighborhood"] = "Unknown"
+    elif neighborhood:
+        data["address"] = "רחוב לא ידוע"
+        data["neighborhood"] = neighborhood
+    else:
+        data["address"] = "רחוב לא ידוע"
+        data["neighborhood"] = "Unknown"
 
-        try:
-            total_floors_val = int(form_data.get("total_floors", ""))
-            if total_floors_val < 1:
-                field_errors["total_floors"] = "סה\"כ קומות חייב להיות לפחות 1"
-        except ValueError:
-            field_errors["total_floors"] = "יש להזין מספר תקין"
-            total_floors_val = None
-        else:
-            try:
-                floor_val = int(form_data.get("floor", ""))
-                if "floor" not in field_errors and total_floors_val is not None and floor_val > total_floors_val:
-                    field_errors["total_floors"] = "סה\"כ קומות חייב להיות גדול או שווה למספר קומה"
-            except ValueError:
-                pass
+    for feature in ALL_FEATURES:
+        data[feature] = 1 if feature in listing.features else 0
 
+    data["has_parking"] = data["חניה"]
+    data["elevator"] = data["מעלית"]
+    data["has_safe_room"] = data["ממ\"ד"]
+    data["has_balcony"] = data["מרפסת"]
+    data["is_renovated"] = data["משופצת"]
+    data["is_furnished"] = data["ריהוט"]
+    # 0 = מרחק לא ידוע; הטרנספורמר משלים אותו מטבלת הרחובות שנבנתה באימון (street_distances.npy)
+    data["distance_from_center"] = 0
+    return data
 
-        try:
-            area_val = float(form_data.get("area", ""))
-            if area_val < 20:
-                field_errors["area"] = "שטח מינימלי חייב להיות 20 מ\"ר"
-        except ValueError:
-            field_errors["area"] = "יש להזין שטח תקין"
-
-        if not form_data["address"] and not form_data["neighborhood"]:
-            field_errors["address"] = "חובה להזין שכונה או כתובת"
-
-        if not form_data["property_type"]:
-            field_errors["property_type"] = "יש לבחור סוג נכס"
-            
+
+def _predict_one(bundle, data):
+    X = bundle.pipeline.transform(data)
+    return round(predict_prices(bundle.model, X)[0], 2)
+
+
+@bp.route("/", methods=["GET", "POST"])
+def index():
+    form_data = {}
+    error = None
+    prediction = None
+    serving = _serving()
+    bundle = serving.registry.current()
+
+    if request.method == "POST":
+        form_data = form_listing(request.form)
+        records, errors = validate_listings([form_data])
+        field_errors = errors[0]
         if field_errors:
             return render_template(
                 "index.html",
                 prediction=None,
                 form_data=form_data,
-                addresses=addresses,
-                neighborhoods=neighborhoods,
                 error=None,
                 field_errors=field_errors
             )
 
-        address = form_data.get("address", "").strip()
-        if address == "אחר":
-            address = form_data.get("custom_address", "").strip()
-        # אם אין כתובת והוזנה שכונה – נשתמש בשכונה בתור כתובת
-        if not address:
-            neighborhood = form_data.get("neighborhood", "").strip()
-            if neighborhood and neighborhood != "אחר":
-                address = neighborhood
-        address = clean_address(address)
-
-        neighborhood = form_data.get("neighborhood", "").strip()
-        if neighborhood == "אחר":
-            neighborhood = form_data.get("custom_neighborhood", "").strip()
-
-        raw_features = form_data.get("features", [])
-        if isinstance(raw_features, str):
-            features = [raw_features]
-        elif isinstance(raw_features, list):
-            features = raw_features
-        else:
-            features = []
-
-        data = {
-            "room_num": [safe_float(form_data.get("room_number"))],
-            "floor": [safe_int(form_data.get("floor"))],
-            "area": [safe_float(form_data.get("area"))],
-            "property_type": [form_data.get("property_type", "דירה")],
-            "features": [features],
-            "total_floors": [safe_int(form_data.get("total_floors"))],
-            "monthly_arnona": [float(form_data["monthly_arnona"] or 0)],
-            "building_tax": [float(form_data["building_tax"] or 0)],
-            "garden_area": [float(form_data["garden_area"] or 0)],
-            "description": [""]
-        }
-
-        if address and address != "רחוב לא ידוע":
-            data["address"] = [address]
-            data["neighborhood"] = ["Unknown"]
-        elif neighborhood:
-            data["address"] = ["רחוב לא ידוע"]
-            data["neighborhood"] = [neighborhood]
-        else:
-            data["address"] = ["רחוב לא ידוע"]
-            data["neighborhood"] = ["Unknown"]
-
-        all_features = ['מיזוג', 'משופצת', 'מרפסת', 'חניה', 'מעלית', 'סורגים',
-                        'ריהוט', 'ממ\"ד', 'חיות מחמד', 'מחסן', 'גישה לנכים']
-        for feature in all_features:
-            data[feature] = [1 if feature in features else 0]
-        data.pop("features")
-
-        data["has_parking"] = [data["חניה"][0]]
-        data["elevator"] = [data["מעלית"][0]]
-        data["has_safe_room"] = [data["ממ\"ד"][0]]
-        data["has_balcony"] = [data["מרפסת"][0]]
-        data["is_renovated"] = [data["משופצת"][0]]
-        data["is_furnished"] = [data["ריהוט"][0]]
-        data["distance_from_center"] = [0]
-
-        df_input = pd.DataFrame(data)
-
         try:
-            df_processed = prepare_data(df_input, dataset_type="test")
-            prediction = round(model.predict(df_processed)[0], 2)
+            data = listing_to_record(records[0])
+            key = record_key(data)
+            prediction = serving.prediction_cache.get(key, bundle.version)
+            if prediction is None:
+                prediction = offload(_predict_one, bundle, data)
+                serving.prediction_cache.put(key, bundle.version, prediction)
+        except ServiceUnavailable:
+            return render_template(
+                "index.html",
+                prediction=None,
+                form_data=form_data,
+                error=BUSY_MESSAGE,
+                field_errors={}
+            ), 503, {"Retry-After": "1"}
         except Exception as e:
             import traceback
             traceback.print_exc()
-            error = "שגיאה, אין מספיק ערכים לחיזוי"
+            error = "שגיאה: אין מספיק ערכים לחיזוי"
             return render_template(
                 "index.html",
                 prediction=None,
                 form_data=form_data,
-                addresses=addresses,
-                neighborhoods=neighborhoods,
                 error=error,
                 field_errors={}
             )
@@ -177,8 +244,6 @@ def index():
             "index.html",
             prediction=prediction,
             form_data=form_data,
-            addresses=addresses,
-            neighborhoods=neighborhoods,
             error=None,
             field_errors={}
         )
@@ -188,11 +253,175 @@ def index():
         "index.html",
         prediction=None,
         form_data=form_data,
-        addresses=addresses,
-        neighborhoods=neighborhoods,
         error=None,
         field_errors={}
     )
 
+
+def _read_listings():
+    """
+    גוף הבקשה: מערך JSON של רשומות, או NDJSON (רשומה אחת בכל שורה).
+    מחזירה (listings, parse_errors) - שורת NDJSON שבורה מסומנת כשגיאה ולא מפילה את כל הבקשה.
+    """
+    content_type = request.mimetype or ""
+    if content_type in ("application/x-ndjson", "application/jsonl", "application/ndjson"):
+        listings, parse_errors = [], {}
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                listing = json.loads(line)
+            except ValueError:
+                listing = None
+            if not isinstance(listing, dict):
+                parse_errors[len(listings)] = {"_row": "שורת JSON לא תקינה"}
+                listing = {}
+            listings.append(listing)
+        return listings, parse_errors
+
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get("listings", [payload])
+    if not isinstance(payload, list):
+        abort(400, description="Expected a JSON array of listings or NDJSON")
+    parse_errors = {i: {"_row": "רשומה חייבת להיות אובייקט JSON"}
+                    for i, listing in enumerate(payload) if not isinstance(listing, dict)}
+    return [listing if isinstance(listing, dict) else {} for listing in payload], parse_errors
+
+
+def _predict_batch(bundle, records):
+    '''
+    (prices, scorable) לכל הרשומות - קריאה אחת למודל על כל השורות שאפשר לחזות.
+    '''
+    X, scorable = bundle.pipeline.transform_batch(records)
+    prices = np.full(len(records), np.nan)
+    if scorable.any():
+        prices[scorable] = predict_prices(bundle.model, X[scorable], check_finite=False)
+    return prices, scorable
+
+
+@bp.route("/api/predict", methods=["POST"])
+def api_predict():
+    serving = _serving()
+    listings, parse_errors = _read_listings()
+    max_batch = current_app.config["MAX_BATCH_SIZE"]
+    if len(listings) > max_batch:
+        abort(413, description=f"Batch larger than {max_batch} listings")
+
+    listing_records, errors = validate_listings(listings)
+    for i, row_errors in parse_errors.items():
+        errors[i] = row_errors
+    valid_rows = [i for i, row_errors in enumerate(errors) if not row_errors]
+
+    bundle = serving.registry.current()
+    predictions = [None] * len(listings)
+    records = {i: listing_to_record(listing_records[i]) for i in valid_rows}
+    keys = {i: record_key(records[i]) for i in valid_rows}
+    for i in valid_rows:
+        predictions[i] = serving.prediction_cache.get(keys[i], bundle.version)
+    missing = [i for i in valid_rows if predictions[i] is None]
+    if missing:
+        # השורות שלא נמצאו במטמון נחזות ב-executor, לא ב-thread של הבקשה
+        prices, scorable = offload(_predict_batch, bundle, [records[i] for i in missing])
+        for i, price, ok in zip(missing, prices, scorable):
+            if ok and np.isfinite(price):
+                predictions[i] = round(float(price), 2)
+                serving.prediction_cache.put(keys[i], bundle.version, predictions[i])
+            else:
+                errors[i] = {"_row": "שגיאה, אין מספיק ערכים לחיזוי"}
+
+    return jsonify({
+        "model_version": bundle.version,
+        "predictions": predictions,
+        "errors": [{"row": i, "errors": row_errors} for i, row_errors in enumerate(errors) if row_errors],
+    })
+
+
+@bp.route("/api/suggest", methods=["GET"])
+def api_suggest():
+    '''
+    השלמה לשדות הכתובת והשכונה בטופס: ?field=address|neighborhood&q=<תחילת הטקסט>&limit=<עד 50>.
+    רשימות הטופס לא נשלחות יותר בתוך index.html - הדפדפן מבקש רק את ההצעות לטקסט שהוקלד.
+    '''
+    field = request.args.get("field", "")
+    if field not in SUGGEST_FIELDS:
+        abort(400, description=f"field must be one of {sorted(SUGGEST_FIELDS)}")
+    query = request.args.get("q", "")
+    limit = min(max(request.args.get("limit", DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+
+    serving = _serving()
+    bundle = serving.registry.current()
+    suggestions = serving.suggest_index(bundle).search(field, query, limit)
+    response = jsonify({"field": field, "q": query, "suggestions": suggestions})
+    # התשובה תלויה רק בגרסת המודל ובפרמטרים - הדפדפן שומר אותה, ואחרי שעה מאמת מול ה-ETag (304)
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    response.set_etag(hashlib.sha1(f"{bundle.version}\0{field}\0{limit}\0{query}".encode("utf-8")).hexdigest())
+    return response.make_conditional(request)
+
+
+@bp.route("/api/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(_serving().prediction_cache.stats())
+
+
+@bp.route("/healthz", methods=["GET"])
+def healthz():
+    # readiness: 200 רק כשרכיבי המודל טעונים בתהליך הזה
+    serving = _serving()
+    if not serving.registry.ready:
+        return jsonify({"status": "loading"}), 503
+    return jsonify({"status": "ok", "model_version": serving.registry.current().version,
+                    "pid": os.getpid(), "executor": serving.executor.stats()})
+
+
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    # פורמט הטקסט של Prometheus: latency לבקשות, מונים של מטמון החיזוי, ה-executor וגרסת המודל הפעילה
+    serving = _serving()
+    cache = serving.prediction_cache.stats()
+    executor = serving.executor.stats()
+    lines = [
+        serving.request_latency.render(),
+        "# HELP prediction_cache_hits_total Prediction cache hits.",
+        "# TYPE prediction_cache_hits_total counter",
+        f"prediction_cache_hits_total {cache['hits']}",
+        "# HELP prediction_cache_misses_total Prediction cache misses.",
+        "# TYPE prediction_cache_misses_total counter",
+        f"prediction_cache_misses_total {cache['misses']}",
+        "# HELP prediction_cache_size Entries in the prediction cache.",
+        "# TYPE prediction_cache_size gauge",
+        f"prediction_cache_size {cache['size']}",
+        "# HELP prediction_executor_in_flight Predictions running or queued in the executor.",
+        "# TYPE prediction_executor_in_flight gauge",
+        f"prediction_executor_in_flight {executor['in_flight']}",
+        "# HELP prediction_executor_rejected_total Requests rejected with 503 because the executor was full.",
+        "# TYPE prediction_executor_rejected_total counter",
+        f"prediction_executor_rejected_total {executor['rejected']}",
+        "# HELP model_info Active model version.",
+        "# TYPE model_info gauge",
+        f'model_info{{version="{serving.registry.current().version}"}} 1',
+    ]
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+@bp.route("/admin/reload", methods=["POST"])
+def reload_model():
+    # טעינה מחדש של המודל אחרי אימון, מוגן בטוקן מתוך משתנה הסביבה ADMIN_TOKEN.
+    # תחת gunicorn זה טוען רק את ה-worker שקיבל את הבקשה - לכל ה-workers: kill -HUP לתהליך האב
+    registry = _serving().registry
+    token = os.environ.get("ADMIN_TOKEN")
+    if not token or not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token):
+        abort(403)
+    try:
+        bundle = registry.reload()
+    except Exception as e:
+        # הגרסה הקודמת נשארת טעונה; הסיבה נרשמת גם בלוג של ה-worker ולא רק בתשובה
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e), "version": registry.current().version}), 500
+    return jsonify({"version": bundle.version})
+
 if __name__ == "__main__":
-    app.run(debug=True)
+    # שרת הפיתוח של Werkzeug. בפרודקשן: gunicorn -c gunicorn.conf.py wsgi:app
+    create_app().run(debug=True)
@@ -1,10 +1,20 @@
+import os
 import pandas as pd
 import numpy as np
 import re
 import json
 import pickle
-import requests
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from inference_pipeline import InferencePipeline
+from imputation import PeerMedian, ColumnMedian, Constant, PeerIndex, impute_with_fallbacks
+from instrumentation import instrumented, mark_stage
+from prep_cache import PrepCache, cache_key
+from category_encoder import CategoryEncoder, save_category_means, load_category_encoder
+from target_encoding import target_encode
+from feature_registry import FeaturePlan
+from distance_provider import get_default_provider, StreetDistanceTable, load_distance_table
+from imputation_stats import ImputationStats, load_imputation_stats, STATS_FILE
+from address_cleaning import clean_address
 
 
 def extract_street(address):
@@ -17,82 +27,86 @@ def extract_street(address):
     match = re.match(r'^(.+?)(?:\s+\d+.*)?$', str(address).strip())
     return match.group(1).strip() if match else address
 
-def process_floors(df):
+def extract_streets(addresses):
+    """
+    גרסה וקטורית של extract_street לעמודה שלמה.
+    """
+    stripped = addresses.astype(str).str.strip()
+    streets = stripped.str.extract(r'^(.+?)(?:\s+\d+.*)?$', expand=False).str.strip()
+    streets = streets.where(streets.notnull(), addresses)
+    return streets.where(addresses.notnull(), None)
+
+def _parse_floor_part(parts):
+    """
+    'קרקע' -> 0, מספר (כולל עשרוני) -> החלק השלם, כל השאר -> NaN.
+    """
+    numeric = parts.str.fullmatch(r'\d+\.?\d*|\.\d+')
+    values = np.trunc(pd.to_numeric(parts.where(numeric), errors='coerce'))
+    return values.mask(parts.str.contains("קרקע", regex=False), 0)
+
+def process_floors(df, street_medians=None):
     """
     פונקציה זו:
     1. מפצלת ערכים כמו '8 מתוך 10' ל־floor=8, total_floors=10.
     2. מטפלת ב'קרקע', ערכים עשרוניים, ערכים חריגים (למשל 810 במקום 8 מתוך 10).
     3. מעתיקה floor ל-total_floors אם total_floors חסר ויש floor.
     4. ממלאת חסרים לפי חציון ברחוב (ולא כתובת מלאה!).
+    street_medians - חציוני רחוב מחושבים מראש ({'floor': {...}, 'total_floors': {...}}), למשל מכל קובץ האימון.
     """
+    df = parse_floors(df)
+    return fill_floors_by_street(df, street_medians)
 
+def parse_floors(df):
+    """
+    שלבים 1-3 של process_floors - לכל שורה בנפרד, בלי סטטיסטיקות.
+    """
     # --- שלב 1: פיצול floor ו-total_floors מתוך מחרוזות ---
-    floors = []
-    totals = []
-    for val in df['floor'].astype(str):
-        if "מתוך" in val:
-            parts = val.split("מתוך")
-            floor_part = parts[0].strip()
-            total_part = parts[1].strip()
-            floor_val = 0 if "קרקע" in floor_part else int(float(floor_part)) if floor_part.replace('.', '', 1).isdigit() else np.nan
-            total_val = 0 if "קרקע" in total_part else int(float(total_part)) if total_part.replace('.', '', 1).isdigit() else np.nan
-        else:
-            floor_val = 0 if "קרקע" in val else int(float(val)) if val.replace('.', '', 1).isdigit() else np.nan
-            total_val = np.nan
-        floors.append(floor_val)
-        totals.append(total_val)
-    df['floor'] = floors
+    floor_str = df['floor'].astype(str)
+    has_total = floor_str.str.contains("מתוך", regex=False)
+    parts = floor_str.str.split("מתוך")
+    floors = _parse_floor_part(parts.str[0].str.strip().where(has_total, floor_str))
+    totals = _parse_floor_part(parts.str[1].fillna('').astype(str).str.strip())
+    df['floor'] = floors.values
     if 'total_floors' in df.columns:
-        missing_mask = df['total_floors'].isnull() | (df['total_floors'] == '')
-        df.loc[missing_mask, 'total_floors'] = pd.Series(totals)[missing_mask].values
+        missing_mask = (df['total_floors'].isnull() | (df['total_floors'] == '')).values
+        df.loc[missing_mask, 'total_floors'] = totals.values[missing_mask]
     else:
-        df['total_floors'] = totals
+        df['total_floors'] = totals.values
 
     # --- שלב 2: תיקון ערכים חריגים (קומה גדולה ממספר קומות, לדוג' floor=810, total_floors=10) ---
     mask = (
         df["floor"].notna() &
         df["total_floors"].notna() &
+        np.isfinite(df["total_floors"].astype(float)) &
         (df["floor"] > df["total_floors"])
     )
-    for idx in df[mask].index:
-        floor_val = int(df.at[idx, "floor"])
-        total_val = int(df.at[idx, "total_floors"])
-        # פיצול: הספרות האחרונות הן total_floors, היתר הן floor
-        floor_str = str(floor_val)
-        total_str = str(total_val)
-        if floor_str.endswith(total_str):
-            floor_only = floor_str[:len(floor_str) - len(total_str)]
-            try:
-                new_floor = int(floor_only)
-                df.at[idx, "floor"] = new_floor
-            except:
-                pass  # לא הצליח? ישאיר את הערך המקורי
+    if mask.any():
+        # הספרות האחרונות הן total_floors, היתר הן floor: 810 % 100 == 10 -> floor = 810 // 100
+        floor_val = df.loc[mask, "floor"].astype('int64')
+        total_val = df.loc[mask, "total_floors"].astype(float).astype('int64')
+        base = 10 ** total_val.astype(str).str.len().astype('int64')
+        concatenated = (total_val >= 0) & (floor_val % base == total_val)
+        df.loc[concatenated[concatenated].index, "floor"] = (floor_val // base)[concatenated]
 
     # --- שלב 3: אם total_floors חסר ויש ערך ב-floor, העתק ---
     mask_missing_total = df['total_floors'].isnull() & df['floor'].notnull()
     df.loc[mask_missing_total, 'total_floors'] = df.loc[mask_missing_total, 'floor']
+    return df
 
+def fill_floors_by_street(df, street_medians=None):
+    """
+    שלב 4 של process_floors: השלמת קומה חסרה לפי חציון הרחוב, ואז קומה > סה"כ קומות -> סה"כ קומות.
+    """
     # --- שלב 4: השלמת חסרים לפי שם רחוב בלבד ---
-    df['street_only'] = df['address'].apply(extract_street)
-
-    # השלמה ל-floor לפי חציון ברחוב
-    mask_floor_na = df['floor'].isnull() & df['street_only'].notnull()
-    for idx in df[mask_floor_na].index:
-        street = df.at[idx, 'street_only']
-        relevant = df[(df['street_only'] == street) & df['floor'].notnull()]
-        if not relevant.empty:
-            df.at[idx, 'floor'] = relevant['floor'].median()
-
-    # השלמה ל-total_floors לפי חציון ברחוב
-    mask_total_na = df['total_floors'].isnull() & df['street_only'].notnull()
-    for idx in df[mask_total_na].index:
-        street = df.at[idx, 'street_only']
-        relevant = df[(df['street_only'] == street) & df['total_floors'].notnull()]
-        if not relevant.empty:
-            df.at[idx, 'total_floors'] = relevant['total_floors'].median()
-
-    # הסרת העמודה הזמנית
-    df = df.drop(columns=['street_only'])
+    # חציון לכל רחוב מחושב פעם אחת ב-groupby וממופה חזרה לשורות החסרות
+    street_only = extract_streets(df['address'])
+    for col in ['floor', 'total_floors']:
+        if street_medians is not None:
+            street_median = street_only.map(street_medians[col])
+        else:
+            street_median = df[col].astype(float).groupby(street_only).transform('median')
+        mask_na = df[col].isnull() & street_only.notnull() & street_median.notnull()
+        df.loc[mask_na, col] = street_median[mask_na]
 
     problem_rows = df['floor'] > df['total_floors']
     df.loc[problem_rows, 'floor'] = df.loc[problem_rows, 'total_floors']
@@ -113,12 +127,13 @@ def extract_room_num(description):
         return float(match.group(1))
     return None
 
-def fix_room_num(df):
+def fix_room_num(df, room_index=None, room_median=None):
     '''
     הפונקציה מתקנת ערכי חדרים חסרים או אפסיים בשלבים:
      תחילה לפי תיאור הדירה, אחר כך לפי חציון בשכונה ובשטח דומה,
      ולבסוף לפי חציון כללי.
      שיטה מדויקת להשלמת מידע חסר באופן חכם.
+    room_index / room_median - PeerIndex וחציון כללי שחושבו מראש (במקום מתוך df עצמו).
     '''
     # שלב 1: תיקון לפי התיאור
     mask_zero = df['room_num'] == 0
@@ -126,127 +141,130 @@ def fix_room_num(df):
         df.loc[mask_zero, 'description'].apply(extract_room_num)
     )
     
-    # שלב 2: אם עדיין 0, תיקון לפי חציון שכונה ושטח (±5 מ"ר)
-    mask_zero = df['room_num'] == 0
-    for idx in df[mask_zero].index:
-        neighborhood = df.at[idx, 'neighborhood']
-        area = df.at[idx, 'area']
-        if pd.notnull(neighborhood) and pd.notnull(area):
-            relevant = df[
-                (df['neighborhood'] == neighborhood) &
-                (df['area'] >= area - 5) &
-                (df['area'] <= area + 5) &
-                (df['room_num'] > 0) &
-                df['room_num'].notnull()
-            ]
-            if not relevant.empty:
-                df.at[idx, 'room_num'] = relevant['room_num'].median()
-            else:
-                # אם אין דירות כאלה, אפשר לשים חציון שכונה כללית (לא חובה)
-                relevant = df[
-                    (df['neighborhood'] == neighborhood) &
-                    (df['room_num'] > 0) &
-                    df['room_num'].notnull()
-                ]
-                if not relevant.empty:
-                    df.at[idx, 'room_num'] = relevant['room_num'].median()
+    # שלב 2: אם עדיין 0, תיקון לפי חציון שכונה ושטח (±5 מ"ר), ואם אין - חציון השכונה
+    mask_zero = (df['room_num'] == 0) & df['neighborhood'].notnull() & df['area'].notnull()
+    if mask_zero.any() and room_index is not None:
+        df['room_num'] = np.nan_to_num(room_index.fill(df['room_num'], _index_columns(df), mask_zero), nan=0)
+    elif mask_zero.any():
+        df['room_num'] = impute_with_fallbacks(
+            df, 'room_num', mask_zero,
+            rules=[PeerMedian(group='neighborhood', area_window=5),
+                   PeerMedian(group='neighborhood')],
+            is_peer=lambda v: v > 0,
+            default=0)
     # שלב 3: אם עדיין חסר (0 או NaN) -> חציון כללי
     mask_zero = (df['room_num'] == 0) | (df['room_num'].isnull())
     if mask_zero.any():
-        general_median = df.loc[(df['room_num'] > 0) & df['room_num'].notnull(), 'room_num'].median()
+        general_median = room_median if room_median is not None else \
+            df.loc[(df['room_num'] > 0) & df['room_num'].notnull(), 'room_num'].median()
         df.loc[mask_zero, 'room_num'] = general_median
 
     return df
 
-def process_garden_area(df):
+def process_garden_area(df, garden_index=None):
     '''
     הפונקציה משלימה שטח גינה חסר.
      אם הדירה בקומה גבוהה – נקבע אפס. אחרת, מחושבת לפי חציון דירות דומות בשכונה ובשטח.
      מאפשר שמירה על עקביות והיגיון בנתוני הגינה.
+    garden_index - PeerIndex שחושב מראש (במקום מתוך df עצמו).
     '''
     mask_garden_na = df['garden_area'].isnull()
-    for idx in df[mask_garden_na].index:
-        floor = df.at[idx, 'floor'] if 'floor' in df.columns else np.nan
-        if pd.notnull(floor) and floor > 0:
-            df.at[idx, 'garden_area'] = 0
-        else:
-            neighborhood = df.at[idx, 'neighborhood']
-            area = df.at[idx, 'area']
-            relevant = df[
-                (df['neighborhood'] == neighborhood) &
-                (df['area'] == area) &
-                df['garden_area'].notnull()
-            ]
-            if not relevant.empty:
-                df.at[idx, 'garden_area'] = relevant['garden_area'].median()
-            else:
-                df.at[idx, 'garden_area'] = 0
+    if mask_garden_na.any():
+        floor = df['floor'] if 'floor' in df.columns else pd.Series(np.nan, index=df.index)
+        high_floor = (floor.notnull() & (floor > 0)).to_numpy()
+        if garden_index is not None:
+            values = garden_index.fill(df['garden_area'], _index_columns(df), mask_garden_na & ~high_floor)
+            values[mask_garden_na.to_numpy() & high_floor] = 0
+            df['garden_area'] = np.nan_to_num(values, nan=0)
+            return df
+        df['garden_area'] = impute_with_fallbacks(
+            df, 'garden_area', mask_garden_na,
+            rules=[Constant(0, where=high_floor),
+                   PeerMedian(group='neighborhood', area_window=0)],
+            is_peer=lambda v: ~np.isnan(v),
+            default=0)
     return df
 
-def process_tax_col(df, col_name):
+def process_tax_col(df, col_name, tax_index=None):
     """
     משלימה ערכים חסרים בעמודה כספית (כמו ארנונה או מס בניין).
     1. קובע 0 לוועד בית בבתי פרטי/קוטג'.
     2. מנסה להשלים לפי שטח דומה (±10%) ושאר קריטריונים.
     3. אם לא נמצא — משלים לפי חציון של אותה שכונה.
     4. אם עדיין לא נמצא — משלים לפי חציון כללי של הדאטה.
+    tax_index - PeerIndex שחושב מראש (build_tax_index) במקום מתוך df עצמו.
     """
     # ועד בית לבתי פרטי/קוטג' = 0
     if col_name == 'building_tax':
         df.loc[df['property_type'].astype(str).str.contains("בית פרטי|קוטג'", na=False), col_name] = 0
 
     mask_na_or_zero = df[col_name].isnull() | (df[col_name] == 0)
+    if mask_na_or_zero.any() and tax_index is not None:
+        df[col_name] = tax_index.fill(df[col_name], _index_columns(df), mask_na_or_zero)
+    elif mask_na_or_zero.any():
+        # שלב 1: לפי שטח דומה (±10%), שלב 2: לפי שכונה, שלב 3: לפי כלל הדאטה
+        df[col_name] = impute_with_fallbacks(
+            df, col_name, mask_na_or_zero,
+            rules=[PeerMedian(area_ratio=0.1),
+                   PeerMedian(group='neighborhood'),
+                   PeerMedian(),
+                   ColumnMedian()],
+            is_peer=lambda v: v > 0)
 
-    for idx in df[mask_na_or_zero].index:
-        area = df.at[idx, 'area']
-        neighborhood = df.at[idx, 'neighborhood']
-
-        relevant = pd.DataFrame()
-
-        # שלב 1: לפי שטח דומה (±10%)
-        if pd.notnull(area):
-            relevant = df[
-                (df['area'] >= area * 0.9) &
-                (df['area'] <= area * 1.1) &
-                df[col_name].notnull() &
-                (df[col_name] > 0)
-            ]
-
-        # שלב 2: לפי שכונה
-        if relevant.empty and pd.notnull(neighborhood):
-            relevant = df[
-                (df['neighborhood'] == neighborhood) &
-                df[col_name].notnull() &
-                (df[col_name] > 0)
-            ]
-
-        # שלב 3: אם עדיין אין — לפי כלל הדאטה
-        if relevant.empty:
-            relevant = df[
-                df[col_name].notnull() &
-                (df[col_name] > 0)
-            ]
-        if pd.isnull(df.at[idx, col_name]) or df.at[idx, col_name] == 0:
-            df.at[idx, col_name] = df[col_name].median()
-
-        # השלמה בפועל
-        if not relevant.empty:
-            df.at[idx, col_name] = relevant[col_name].median()
-            
     return df
     
-def fix_monthly_arnona_by_median(df, min_val=100, max_val=2000, area_tol=5):
+def _index_columns(df):
+    # עמודות הקבוצה והשטח לחיפוש ב-PeerIndex
+    return {'neighborhood': df['neighborhood'].to_numpy(dtype=object), 'area': df['area'].to_numpy(dtype=float)}
+
+def build_tax_index(df, col_name):
+    """
+    אינדקס להשלמת process_tax_col מסטטיסטיקות קבועות: שטח ±10%, שכונה, כלל הדאטה (ערכים חיוביים).
+    """
+    values = df[col_name].to_numpy(dtype=float)
+    return PeerIndex.build([PeerMedian(area_ratio=0.1), PeerMedian(group='neighborhood'), PeerMedian()],
+                           _index_columns(df), values, values > 0)
+
+def build_arnona_index(df, min_val=100, max_val=2000, area_tol=5):
+    """
+    אינדקס ארנונה תקינה (בין min_val ל-max_val) לפי שכונה, ממוין לפי שטח.
+    חציון ±area_tol מ"ר הוא חיפוש בינארי + חציון של קטע, עם fallback לשכונה ולכלל הדאטה.
+    """
+    values = df['monthly_arnona'].to_numpy(dtype=float)
+    return PeerIndex.build(
+        [PeerMedian(group='neighborhood', area_window=area_tol),
+         PeerMedian(group='neighborhood'),
+         PeerMedian()],
+        _index_columns(df), values, (values >= min_val) & (values <= max_val),
+        valid_range=(min_val, max_val))
+
+def load_arnona_index(path="arnona_index.pkl"):
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+def fix_monthly_arnona_by_median(df, min_val=100, max_val=2000, area_tol=5, arnona_index=None):
+    """
+    מחליפה ארנונה חריגה בחציון ארנונה תקינה באותה שכונה ובשטח דומה (±area_tol),
+    אחר כך בחציון השכונה ולבסוף בחציון העמודה.
+    arnona_index - אינדקס שנבנה באימון (build_arnona_index): אם ניתן, ההחלפה לפי סטטיסטיקות האימון.
+    """
     df = df.copy()
     mask = (df['monthly_arnona'] < min_val) | (df['monthly_arnona'] > max_val)
+    if not mask.any():
+        return df
 
-    for i in df[mask].index:
-        n, a = df.at[i, 'neighborhood'], df.at[i, 'area']
-        s = df.query(
-            "@n == neighborhood and @a - @area_tol <= area <= @a + @area_tol and @min_val <= monthly_arnona <= @max_val"
-        )['monthly_arnona']
-        if s.empty:
-            s = df.query("@n == neighborhood and @min_val <= monthly_arnona <= @max_val")['monthly_arnona']
-        df.at[i, 'monthly_arnona'] = s.median() if not s.empty else df['monthly_arnona'].median()
+    if arnona_index is not None:
+        df['monthly_arnona'] = arnona_index.fix_outliers(df['monthly_arnona'], _index_columns(df))
+    else:
+        df['monthly_arnona'] = impute_with_fallbacks(
+            df, 'monthly_arnona', mask,
+            rules=[PeerMedian(group='neighborhood', area_window=area_tol),
+                   PeerMedian(group='neighborhood'),
+                   ColumnMedian()],
+            is_peer=lambda v: (v >= min_val) & (v <= max_val))
 
     return df
 
@@ -269,7 +287,7 @@ def process_distance_from_center(df):
         df.loc[(df['neighborhood'] == 'גני צהלה') & (df['distance_from_center'].isnull()), 'distance_from_center'] = 7700
         df.loc[(df['neighborhood'] == 'כוכב הצפון') & (df['distance_from_center'].isnull()), 'distance_from_center'] = 4600
     return df
-def filter_extreme_distances(df, threshold=1.5):
+def filter_extreme_distances(df, threshold=1.5, neighborhood_stats=None):
     """
     מחליף ערכים קיצוניים בעמודת distance_from_center לפי סטייה מהחציון לשכונה.
     פרמטרים:
@@ -277,13 +295,14 @@ def filter_extreme_distances(df, threshold=1.5):
         טבלת הדירות הכוללת עמודות 'neighborhood' ו-'distance_from_center'
     threshold : float (ברירת מחדל 1.0)
         כמה סטיות תקן מעבר לחציון ייחשבו לחריגים (למשל: 1.5 = חציון + 1.5*std)
+    neighborhood_stats : DataFrame (ברירת מחדל None)
+        חציון וסטיית תקן לכל שכונה שחושבו מראש (distance_stats), במקום מתוך df עצמו
     מחזיר:
     df : DataFrame מתוקן
     """
     df = df.copy()
     # סטטיסטיקות לפי שכונה
-    stats = df.groupby('neighborhood')['distance_from_center'].agg(['median', 'std']).reset_index()
-    stats.columns = ['neighborhood', 'neigh_median', 'neigh_std']
+    stats = neighborhood_stats if neighborhood_stats is not None else distance_stats(df)
     # מיזוג עם הדאטה המקורי
     df = df.merge(stats, on='neighborhood', how='left')
     # תנאי לחריגה
@@ -295,54 +314,76 @@ def filter_extreme_distances(df, threshold=1.5):
     
     return df
 
-def get_distance_from_center(address, neighborhood, distance):
+def distance_stats(df):
+    stats = df.groupby('neighborhood')['distance_from_center'].agg(['median', 'std']).reset_index()
+    stats.columns = ['neighborhood', 'neigh_median', 'neigh_std']
+    return stats
+
+def get_distance_from_center(address, neighborhood, distance, provider=None):
     """
     משתמש במרחק קיים אם תקין (>=100).
-    משתמש ב-API אם יש מפתח ואם distance חסר או קטן מ-100.
+    אחרת פונה לספק המרחקים (distance_provider) - מטמון ואז API או טבלה מקומית.
     לא מחזיר None אם יש ערך קיים כלשהו.
     """
     # אם המרחק תקין – נחזיר אותו מיד
     if pd.notnull(distance) and distance >= 100:
         return distance
+    return fill_distances_from_provider([address], [neighborhood], [distance], provider)[0]
 
-    api_key = "Add API KEY"  # החלף במפתח אמיתי
-    if not api_key or api_key == "Add API KEY":
-        return distance  # לא דורס – משאיר את מה שהיה
-
-    # כתובת מקור
-    origin_raw = address if pd.notnull(address) else neighborhood
-    origin_address = f"{origin_raw}, תל אביב"
-
-    url = "https://routes.googleapis.com/directions/v2:computeRoutes"
-    headers = {
-        'Content-Type': 'application/json',
-        'X-Goog-Api-Key': api_key,
-        'X-Goog-FieldMask': 'routes.distanceMeters,routes.duration'
-    }
-    body = {
-        "origin": {"address": origin_address},
-        "destination": {"address": "כיכר דיזינגוף, תל אביב"},
-        "travelMode": "DRIVE",
-        "routingPreference": "TRAFFIC_AWARE"
+def fill_distances_from_provider(addresses, neighborhoods, distances, provider=None):
+    """
+    גרסת ה-batch של get_distance_from_center: כל הכתובות נשלחות לספק יחד,
+    כך שכל רחוב נבדק פעם אחת בלבד. מרחק שלא נמצא נשאר כפי שהיה.
+    """
+    distances = np.asarray(distances, dtype=float)
+    provider = provider if provider is not None else get_default_provider()
+    if provider is None:
+        return distances  # אין ספק מוגדר – לא דורס, משאיר את מה שהיה
+    found = provider.get_distances(addresses, neighborhoods)
+    return np.where(np.isnan(found), distances, found)
+
+def resolve_distances(df, distance_table=None):
+    '''
+    מרחק חסר -> 0, מרחק לא ידוע (<100) -> טבלת הרחובות אם ניתנה, אחרת ספק המרחקים,
+    ואז process_distance_from_center.
+    '''
+    df.loc[df['distance_from_center'].isnull(), 'distance_from_center'] = 0
+    needs_lookup = df['distance_from_center'] < 100
+    if needs_lookup.any():
+        fill = distance_table.fill if distance_table is not None else fill_distances_from_provider
+        df.loc[needs_lookup, 'distance_from_center'] = fill(
+            df.loc[needs_lookup, 'address'].tolist(),
+            df.loc[needs_lookup, 'neighborhood'].tolist(),
+            df.loc[needs_lookup, 'distance_from_center'])
+    return process_distance_from_center(df)
+
+def export_vocabularies(df, path="vocabularies.json"):
+    '''
+    רשימות הכתובות והשכונות לטופס (dropdowns), כפי שהופיעו בדאטה האימון.
+    נשמרות לצד המודל כדי שהשרת לא יצטרך לקרוא את train.csv בעלייה.
+    '''
+    vocabularies = {
+        'addresses': sorted(df['address'].dropna().astype(str).unique().tolist()),
+        'neighborhoods': sorted(df['neighborhood'].dropna().astype(str).unique().tolist()),
     }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(vocabularies, f, ensure_ascii=False)
+    return vocabularies
 
-    try:
-        response = requests.post(url, headers=headers, data=json.dumps(body))
-        if response.status_code == 200:
-            data = response.json()
-            return float(data['routes'][0]['distanceMeters'])
-        else:
-            return distance  # שמירה על ערך קודם אם הייתה שגיאה
-    except:
-        return distance  # שמירה על ערך קודם במקרה חריג
-
-def clean_address(val):
-        if pd.isna(val):
-            return val
-        # מסיר ספרות
-        cleaned = re.sub(r'\d+', '', str(val)).strip()
-        # אם אחרי הניקוי לא נשאר כלום - כנראה היה רק מספר
-        return cleaned if cleaned else np.nan
+def distance_coordinates():
+    '''
+    רחוב -> (lat, lon) אם ספק המרחקים עובד מקובץ קואורדינטות, אחרת None.
+    '''
+    provider = get_default_provider()
+    return getattr(provider.backend, 'coordinates', None) if provider is not None else None
+
+def build_distance_table(df):
+    '''
+    טבלת רחוב -> מרחק מהמרכז (חציון שורות האימון), עם חציון לשכונה כגיבוי.
+    אם ספק המרחקים עובד מקובץ קואורדינטות - נשמרות גם ה-lat/lon של הרחוב.
+    '''
+    return StreetDistanceTable.build(df['address'].tolist(), df['neighborhood'].tolist(),
+                                     df['distance_from_center'].to_numpy(dtype=float), distance_coordinates())
 
 def keep_only_text_in_address(df):
     '''
@@ -352,32 +393,95 @@ def keep_only_text_in_address(df):
     df['address'] = df['address'].apply(clean_address)
     return df
 
-def fill_missing_address_by_neighborhood(df):
+def fill_missing_address_by_neighborhood(df, mode_by_neighborhood=None, default_address=None):
     '''
     ערכים חסרים מחליף בערך השכיח ביותר באותה שכונה
+    mode_by_neighborhood / default_address - הערכים השכיחים שחושבו מראש (במקום מתוך df עצמו).
     '''
-    mode_by_neighborhood = (
-        df.dropna(subset=['address'])  
-        .groupby('neighborhood')['address']
-        .agg(lambda x: x.mode().iloc[0]))
+    if mode_by_neighborhood is None:
+        mode_by_neighborhood = (
+            df.dropna(subset=['address'])  
+            .groupby('neighborhood')['address']
+            .agg(lambda x: x.mode().iloc[0]))
     def fill_address(row):
         if pd.isna(row['address']):
-            return mode_by_neighborhood.get(row['neighborhood'], df['address'].mode().iloc[0])
+            return mode_by_neighborhood.get(
+                row['neighborhood'], default_address if default_address is not None else df['address'].mode().iloc[0])
         return row['address']
     df['address'] = df.apply(fill_address, axis=1)
     return df
 
-df = pd.read_csv('train.csv')  
+def clean_property_type(df):
+    '''
+    מחיקת סוגי נכס לא רלוונטיים וחסרים, ואיחוד שמות (פנטהאוז, דירת גן, דירה להשכרה).
+    '''
+    invalid_types = [
+        "מרתף/פרטר", "חניה", "סאבלט", "Квартира", "מחסן",
+        "באתר מופיע ערך שלא ברשימה הסגורה", "כללי", "החלפת דירות"
+    ]
+    df = df[~df['property_type'].isin(invalid_types)]
+    df = df[~df['property_type'].isnull()]
+    df = df[df['property_type'].astype(str).str.strip() != '']
+    df['property_type'] = df['property_type'].replace('דירה להשכרה', 'דירה')
+    # ניקוי ואיחוד ערכים בעמודת property_type
+    df['property_type'] = df['property_type'].str.strip()  # הסרת רווחים מיותרים    
+    # איחוד פנטהאוזים
+    df['property_type'] = df['property_type'].replace({
+        'גג/פנטהאוז': 'פנטהאוז',
+        'גג/ פנטהאוז': 'פנטהאוז',
+        'גג/פנטהאוז להשכרה': 'פנטהאוז'})
+    # איחוד דירות גן
+    df['property_type'] = df['property_type'].replace({
+        'דירת גן': 'דירת גן',
+        'דירת גן להשכרה': 'דירת גן'})
+    return df
+
+def add_derived_features(df, plan=None):
+    '''
+    פיצ'רים נגזרים - זהים באימון ובחיזוי. ההגדרות (קלטים ונוסחה) ב-feature_registry.py;
+    בלי plan מחושבים כל הפיצ'רים הרשומים.
+    '''
+    return (plan or FeaturePlan()).apply(df)
 
 # --- פונקציה ראשית: רק מזמנת את כל הפונקציות בסדר העבודה + מטפלת בשאר עמודות ישירות ---
-def prepare_data(df, dataset_type):
+@instrumented("prepare_data")
+def prepare_data(df, dataset_type, artifacts=None, cache_dir=None, features=None, output_dir="."):
+    '''
+    artifacts - ArtifactBundle טעון (model_registry) לשימוש במצב test במקום לקרוא את קבצי ה-pkl מהדיסק.
+    features - במצב train: שמות הפיצ'רים הנגזרים לחישוב (feature_registry), ברירת מחדל כולם.
+    במצב test הפיצ'רים נקבעים לפי train_columns.
+    cache_dir - במצב train: תיקיית PrepCache. אם אותן שורות כבר הוכנו עם אותה גרסת קוד,
+    הפלט נטען מהדיסק וקבצי ההכנה משוחזרים ל-output_dir בלי להריץ את השלבים.
+    output_dir - במצב train: התיקייה שאליה נכתבים קבצי ההכנה (encoder, scaler, pipeline וכו').
+    model_training.py מעביר תיקיית staging ומפרסם אותה עם ה-manifest רק אחרי שהאימון הצליח.
+    מדידת זמן/שורות/זיכרון לכל שלב (mark_stage): עם PREPARE_DATA_PROFILE=1 או בתוך
+    instrumentation.profile_stages().
+    '''
+    cache = PrepCache(cache_dir) if dataset_type == 'train' and cache_dir is not None else None
+    if cache is not None:
+        prep_key = cache_key(df, features)
+        cached = cache.load(prep_key, restore_to=output_dir)
+        if cached is not None:
+            mark_stage("cache_hit", cached)
+            return cached
+
     df = df.copy()
+    if dataset_type == 'train':
+        export_vocabularies(df, os.path.join(output_dir, "vocabularies.json"))
+    mark_stage("copy", df)
+
+    # בחיזוי - ההשלמות לפי טבלאות האימון (imputation_stats.npz) ולא לפי חציונים של השורות עצמן
+    stats = None
+    if dataset_type == 'test':
+        stats = artifacts.imputation_stats if artifacts is not None else load_imputation_stats()
+    tables = stats.tables if stats is not None else {}
 
     # טיפול בעמודת floor ו-total_floors
     # --- שלב 1: טיפול בעמודת floor ו-total_floors (פיצול מתוך מחרוזות) ---
     if 'floor' in df.columns:
-        df = process_floors(df)
+        df = process_floors(df, street_medians=stats.street_medians.to_dict() if stats is not None else None)
         # בעקבות שגיאה בין שתי שכונות ספציפיות אני מחליף בין העמודות לאחר בדיקה באתר והבנה שהערכים הוכנסו הפוך
+    mark_stage("process_floors", df)
        
     # המרת עמודות חשובות למספרים
     numeric_cols = [
@@ -386,28 +490,12 @@ def prepare_data(df, dataset_type):
     for col in numeric_cols:
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors='coerce')
+    mark_stage("to_numeric", df)
 
     # property_type - מחיקת סוגים לא רלוונטיים ומחיקת חסרים/ריקים
-    invalid_types = [
-        "מרתף/פרטר", "חניה", "סאבלט", "Квартира", "מחסן",
-        "באתר מופיע ערך שלא ברשימה הסגורה", "כללי", "החלפת דירות"
-    ]
     if 'property_type' in df.columns:
-        df = df[~df['property_type'].isin(invalid_types)]
-        df = df[~df['property_type'].isnull()]
-        df = df[df['property_type'].astype(str).str.strip() != '']
-        df['property_type'] = df['property_type'].replace('דירה להשכרה', 'דירה')
-        # ניקוי ואיחוד ערכים בעמודת property_type
-        df['property_type'] = df['property_type'].str.strip()  # הסרת רווחים מיותרים    
-        # איחוד פנטהאוזים
-        df['property_type'] = df['property_type'].replace({
-            'גג/פנטהאוז': 'פנטהאוז',
-            'גג/ פנטהאוז': 'פנטהאוז',
-            'גג/פנטהאוז להשכרה': 'פנטהאוז'})
-        # איחוד דירות גן
-        df['property_type'] = df['property_type'].replace({
-            'דירת גן': 'דירת גן',
-            'דירת גן להשכרה': 'דירת גן'})
+        df = clean_property_type(df)
+    mark_stage("property_type", df)
 
     # neighborhood - השלמת חסרים ל-'Unknown'
     if 'neighborhood' in df.columns:
@@ -415,25 +503,29 @@ def prepare_data(df, dataset_type):
 
     # room num- תיקון ערכים ששווים ל-0
     if 'room_num' in df.columns:
-        df = fix_room_num(df)
+        df = fix_room_num(df, room_index=tables.get('room_num'),
+                          room_median=tables['room_num'].overall if tables else None)
+    mark_stage("fix_room_num", df)
 
     # distance_from_center
     if 'distance_from_center' in df.columns:
-        df.loc[df['distance_from_center'].isnull(), 'distance_from_center'] = 0
-        df['distance_from_center'] = df.apply(
-            lambda row: get_distance_from_center(row['address'], row['neighborhood'], row['distance_from_center'])
-            if (pd.isnull(row['distance_from_center']) or row['distance_from_center'] < 100)
-            else row['distance_from_center'], axis=1   )
-        df = process_distance_from_center(df)
+        # בחיזוי - קודם טבלת הרחובות שנבנתה באימון (בלי רשת), ורק בלעדיה ספק המרחקים
+        distance_table = None
+        if dataset_type == 'test':
+            distance_table = artifacts.distance_table if artifacts is not None else load_distance_table()
+        df = resolve_distances(df, distance_table)
         df = filter_extreme_distances(df, threshold=1.5)        
+    mark_stage("distance_from_center", df)
     
     # garden_area
     if 'garden_area' in df.columns:
-        df = process_garden_area(df)
+        df = process_garden_area(df, garden_index=tables.get('garden_area'))
         df.loc[df['garden_area'] > 100, 'garden_area'] = df['garden_area'] / 10
+    mark_stage("process_garden_area", df)
 
     if 'area' in df.columns:
         df = df[df['area'] >= 20]
+    mark_stage("area_filter", df)
         
     # days_to_enter - חסרים ל-0
     if 'days_to_enter' in df.columns:
@@ -446,16 +538,22 @@ def prepare_data(df, dataset_type):
 
     # monthly_arnona - חציון לפי area (±10%)
     if 'monthly_arnona' in df.columns:
-        df = process_tax_col(df, 'monthly_arnona')
+        df = process_tax_col(df, 'monthly_arnona', tax_index=tables.get('monthly_arnona'))
         df['monthly_arnona'] = df['monthly_arnona'].fillna(df['monthly_arnona'].median())
-        df = fix_monthly_arnona_by_median(df)
+        # בחיזוי - החלפת ארנונה חריגה לפי סטטיסטיקות האימון ולא לפי שורה בודדת
+        arnona_index = None
+        if dataset_type == 'test':
+            arnona_index = artifacts.arnona_index if artifacts is not None else load_arnona_index()
+        df = fix_monthly_arnona_by_median(df, arnona_index=arnona_index)
+    mark_stage("monthly_arnona", df)
 
 
 
     # building_tax - חציון לפי area (±10%)
     if 'building_tax' in df.columns:
-        df = process_tax_col(df, 'building_tax')
+        df = process_tax_col(df, 'building_tax', tax_index=tables.get('building_tax'))
         df['building_tax'] = df['building_tax'].fillna(df['building_tax'].median())
+    mark_stage("building_tax", df)
 
 
     # num_of_images - מחיקה ( עמודה לא רלוונטית לחיזוי מחיר שכד)
@@ -475,11 +573,16 @@ def prepare_data(df, dataset_type):
         df = df[df['price'] >= 1000] # מחיר לא הגיוני לשכר דירה בתל אביב ולכן נמחק את השורה כי זה יפגע באמינות
         df = df[df['price'] <= 25000]  # שורות עם מחיר לא הגיוני לשכירות, כנראה דירה למכירה
         df = df[(df['price'] > df['price'].quantile(0.01)) & (df['price'] < df['price'].quantile(0.99))] #מוריד קצוות אחוזונים
+    mark_stage("price_filter", df)
     
     
     df = df.sort_values(['neighborhood']).reset_index(drop=True)
     df = keep_only_text_in_address(df)
-    df = fill_missing_address_by_neighborhood(df)
+    if stats is not None:
+        df = fill_missing_address_by_neighborhood(df, stats.address_modes(), stats.default_address)
+    else:
+        df = fill_missing_address_by_neighborhood(df)
+    mark_stage("address", df)
     
     # המרת עמודות חשובות למספרים
     numeric_cols = [
@@ -489,25 +592,18 @@ def prepare_data(df, dataset_type):
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors='coerce')
 
-    # מספר חדרים למ"ר 
-    df['room_density'] = df['room_num'] / (df['area'])
-    # ציון 0–4 שמעיד על כמה הדירה איכותית פונקציונלית    
-    df['luxury_score'] = (df['has_parking'] + df['elevator'] + df['has_safe_room'] + df['has_balcony'])
-    #דירות עם יותר חדרים על אותו שטח לרוב פחות יוקרתיות – תיתן למודל יכולת להבדיל.    
-    df['room_num_x_area'] = df['room_num'] * df['area']
-    # משקל מרפסת יחסית לגובה – ככל שהדירה גבוהה יותר, לרוב מרפסת חשובה יותר
-    df["balcony_per_floor"] = df["has_balcony"] / (df["floor"] + 1) 
-    # שילוב של שיפוץ וריהוט – מצביע על מוכנות גבוהה למגורים
-    df["renovated_furnished"] = ((df["is_renovated"] == 1) & (df["is_furnished"] == 1)).astype(int)  
-    # נכס קטן – מתאים להשכרה ליחידים או זוגות   
-    df["is_mini_property"] = ((df["area"] < 50) & (df["room_num"] <= 2)).astype(int) 
-    # שילוב של שטח הדירה עם הארנונה – מייצג עלות כוללת למ"ר
-    df['area_x_monthly_arnona'] = df['area'] * df['monthly_arnona']
-    # שילוב של קומה עם הארנונה – עשוי לייצג בניינים יוקרתיים יותר
-    df['floor_x_monthly_arnona'] = df['floor'] * df['monthly_arnona']
-    # בדיקת מיקום מרכזי לנכס
-    df["central_location"] = (df["distance_from_center"] < 3000).astype(int)
-    df['log_area'] = np.log1p(df['area'])  # בטוח גם אם area = 0
+    # אותה תוכנית פיצ'רים באימון ובחיזוי: בחיזוי - בדיוק הפיצ'רים שב-train_columns
+    if dataset_type == 'test':
+        if artifacts is not None:
+            train_columns = artifacts.train_columns
+        else:
+            with open("train_columns.pkl", "rb") as f:
+                train_columns = pickle.load(f)
+        plan = FeaturePlan.for_columns(train_columns)
+    else:
+        plan = FeaturePlan(features)
+    df = add_derived_features(df, plan)
+    mark_stage("derived_features", df)
     
 
 
@@ -516,13 +612,17 @@ def prepare_data(df, dataset_type):
     onehot_col = 'property_type'
     
     if dataset_type == 'train':
-        category_means = {}
-    
-        # Target Encoding רגיל לשכונה וכתובת
-        for col in target_encoded_cols:
-            means = df.groupby(col)['price'].mean()
-            category_means[col] = means.to_dict()
-            df[col + '_encoded'] = df[col].map(category_means[col])
+        arnona_index = build_arnona_index(df)
+        arnona_index.save(os.path.join(output_dir, "arnona_index.pkl"))
+        distance_table = build_distance_table(df)
+        distance_table.save(os.path.join(output_dir, "street_distances.npy"))
+        imputation_stats = ImputationStats.build(df)
+        imputation_stats.save(os.path.join(output_dir, STATS_FILE))
+
+        # Target Encoding לשכונה וכתובת: out-of-fold ומוחלק (target_encoding.py);
+        # category_means הוא הקידוד על כל הדאטה, לחיזוי
+        df['neighborhood_encoded'], df['address_encoded'], category_means = target_encode(
+            df['neighborhood'], df['address'], df['price'])
     
         # One-Hot Encoding לסוג נכס
         encoder = OneHotEncoder(handle_unknown='ignore', sparse_output=False)
@@ -530,64 +630,68 @@ def prepare_data(df, dataset_type):
         onehot_df = pd.DataFrame(onehot_encoded, columns=encoder.get_feature_names_out([onehot_col]), index=df.index)
         df = pd.concat([df.drop(columns=[onehot_col]), onehot_df], axis=1)
     
-        # שמירת הקידודים וה-encoder
-        with open("category_means.pkl", "wb") as f:
-            pickle.dump(category_means, f)
-        with open("onehot_encoder.pkl", "wb") as f:
+        # שמירת הקידודים (מילונים + מערך ל-mmap) וה-encoder
+        save_category_means(category_means, output_dir)
+        with open(os.path.join(output_dir, "onehot_encoder.pkl"), "wb") as f:
             pickle.dump(encoder, f)
     
     elif dataset_type == 'test':
-        with open("category_means.pkl", "rb") as f:
-            category_means = pickle.load(f)
-        # קידוד שכונה רגיל עם fallback
-        df['neighborhood_encoded'] = df['neighborhood'].map(category_means['neighborhood'])
-        fallback_neigh = np.mean(list(category_means['neighborhood'].values()))
-        df['neighborhood_encoded'] = df['neighborhood_encoded'].fillna(fallback_neigh)
-
-        # קידוד כתובת עם fallback לפי שכונה
-        def encode_address(row):
-            addr = row['address']
-            neigh = row['neighborhood']
-            if addr in category_means['address']:
-                return category_means['address'][addr]
-            elif neigh in category_means['neighborhood']:
-                return category_means['neighborhood'][neigh]
-            else:
-                return fallback_neigh
-
-        df['address_encoded'] = df.apply(encode_address, axis=1)
+        category_encoder = artifacts.category_encoder if artifacts is not None else load_category_encoder()
+        if category_encoder is None:
+            # מודל ישן בלי category_encoder.npy - נבנה מהמילונים
+            with open("category_means.pkl", "rb") as f:
+                category_encoder = CategoryEncoder.from_means(pickle.load(f))
+        # קידוד שכונה עם fallback לממוצע הכללי, וכתובת עם fallback לפי שכונה - וקטורי, לפי קודים
+        df['neighborhood_encoded'], df['address_encoded'] = category_encoder.encode(
+            df['neighborhood'].to_numpy(dtype=object), df['address'].to_numpy(dtype=object))
         # One-Hot Encoding ל-test
-        with open("onehot_encoder.pkl", "rb") as f:
-            encoder = pickle.load(f)
+        if artifacts is not None:
+            encoder = artifacts.onehot_encoder
+        else:
+            with open("onehot_encoder.pkl", "rb") as f:
+                encoder = pickle.load(f)
         onehot_encoded = encoder.transform(df[[onehot_col]])
         onehot_df = pd.DataFrame(onehot_encoded, columns=encoder.get_feature_names_out([onehot_col]), index=df.index)
         df = pd.concat([df.drop(columns=[onehot_col]), onehot_df], axis=1)
 
     # מחיקת העמודות המקוריות
     df.drop(columns=target_encoded_cols + [onehot_col], inplace=True, errors='ignore')
+    mark_stage("encoding", df)
 
     # === פיצול ונרמול ===
     if dataset_type == 'train':
         feature_cols = df.drop(columns='price').columns
         scaler = StandardScaler()
         X_scaled = scaler.fit_transform(df[feature_cols])
-        with open("train_columns.pkl", "wb") as f:
+        with open(os.path.join(output_dir, "train_columns.pkl"), "wb") as f:
             pickle.dump(feature_cols, f)
-        with open("scaler.pkl", "wb") as f:
+        with open(os.path.join(output_dir, "scaler.pkl"), "wb") as f:
             pickle.dump(scaler, f)
+        # טרנספורמר מקומפל לחיזוי - אותם קידודים ונרמול, בלי להריץ את prepare_data לכל בקשה
+        InferencePipeline.from_fitted(feature_cols, scaler, encoder, category_means,
+                                      fill_values=df[feature_cols].median().to_dict(),
+                                      arnona_index=arnona_index, distance_table=distance_table,
+                                      imputation_stats=imputation_stats).save(
+                                          os.path.join(output_dir, "inference_pipeline.pkl"))
         df_scaled = pd.DataFrame(X_scaled, columns=feature_cols, index=df.index)
         df_scaled["price"] = df["price"].values
+        mark_stage("scaling", df_scaled)
+        if cache is not None:
+            cache.save(prep_key, df_scaled, artifacts_from=output_dir)
+            mark_stage("cache_save", df_scaled)
         return df_scaled
 
     elif dataset_type == 'test':
-        with open("train_columns.pkl", "rb") as f:
-            train_columns = pickle.load(f)
-        with open("scaler.pkl", "rb") as f:
-            scaler = pickle.load(f)
+        if artifacts is not None:
+            scaler = artifacts.scaler
+        else:
+            with open("scaler.pkl", "rb") as f:
+                scaler = pickle.load(f)
         for col in train_columns:
             if col not in df.columns:
                 df[col] = 0
         df = df[train_columns]
         X_scaled = scaler.transform(df)
         df_scaled = pd.DataFrame(X_scaled, columns=train_columns, index=df.index)
+        mark_stage("scaling", df_scaled)
         return df_scaled
\ No newline at end of file
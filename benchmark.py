@@ -0,0 +1,217 @@
+'''
+בנצ'מרק ל-prepare_data, לאימון ול-API.
+
+    python benchmark.py                                  # 1k + 10k שורות
+    python benchmark.py --sizes 1k,10k,100k,1m --skip-fit
+    python benchmark.py --output results.json --baseline baseline.json
+
+התוצאות נשמרות כ-JSON (שניות לשלב, אחוזוני latency במילישניות).
+עם --baseline כל מדידה מושווית לקובץ תוצאות קודם, ומדידה איטית מ-tolerance פעמים
+מסומנת כרגרסיה (exit code 1).
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import warnings
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import sklearn
+from synthetic_data import generate, generate_listings
+from instrumentation import profile_stages
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+
+def parse_sizes(text):
+    return [SIZES[s.strip().lower()] if s.strip().lower() in SIZES else int(s) for s in text.split(",")]
+
+
+def timed(fn, repeat=1):
+    '''
+    מריצה את fn כמה פעמים ומחזירה (הזמן הטוב ביותר בשניות, התוצאה האחרונה).
+    '''
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def stage_times(report):
+    '''
+    זמני השלבים של prepare_data מתוך profile_stages - הזמן הטוב ביותר לכל שלב בין הריצות.
+    '''
+    stages = {}
+    for run in report.runs:
+        for stage in run["stages"]:
+            stages[stage["name"]] = min(stages.get(stage["name"], stage["seconds"]), stage["seconds"])
+    return stages
+
+
+def fit_model(X, y):
+    from sklearn.linear_model import ElasticNetCV
+    # אותה הגדרה כמו ב-model_training.py
+    model = ElasticNetCV(l1_ratio=0.1, alphas=[0.01, 0.1, 1, 10], cv=10, max_iter=10000, random_state=42)
+    return model.fit(X, y)
+
+
+def bench_data(n, repeat=1, skip_fit=False, seed=0):
+    import assets_data_prep as adp
+
+    results = {}
+    results["generate"], df = timed(lambda: generate(n, seed))
+
+    # prepare_data כותב את קבצי ה-pkl לתיקייה הנוכחית - מריצים בתיקייה זמנית
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp(prefix="bench_")
+    try:
+        os.chdir(directory)
+        # זמן לכל שלב בתוך prepare_data, לפי נקודות המדידה (mark_stage) שבפונקציה עצמה
+        with profile_stages(trace_memory=False) as report:
+            results["prepare_data_train"], prepared = timed(lambda: adp.prepare_data(df, 'train'), repeat)
+        results["stages_train"] = stage_times(report)
+        with profile_stages(trace_memory=False) as report:
+            results["prepare_data_test"], _ = timed(
+                lambda: adp.prepare_data(df.drop(columns='price'), 'test'), repeat)
+        results["stages_test"] = stage_times(report)
+        if not skip_fit:
+            # בדאטה הסינתטי נשארות שורות בודדות בלי קומה (רחוב בלי אף קומה ידועה) - לא נכנסות לאימון
+            prepared = prepared.dropna()
+            X, y = prepared.drop(columns='price'), prepared['price']
+            results["fit"], _ = timed(lambda: fit_model(X, y))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def percentiles(samples):
+    ms = np.asarray(samples) * 1000
+    return {"p50_ms": float(np.percentile(ms, 50)), "p90_ms": float(np.percentile(ms, 90)),
+            "p99_ms": float(np.percentile(ms, 99)), "mean_ms": float(ms.mean()), "count": len(ms)}
+
+
+def bench_flask(requests=200, batch_size=100, seed=0):
+    '''
+    latency מקצה לקצה דרך ה-test client של Flask (בלי רשת), על רשומות שונות זו מזו
+    כדי למדוד חיזוי אמיתי ולא פגיעות במטמון.
+    '''
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        from api import create_app
+        app = create_app()
+        prediction_cache = app.extensions["serving"].prediction_cache
+        client = app.test_client()
+        listings = generate_listings(requests + batch_size, seed)
+
+        def measure(send):
+            prediction_cache.clear()
+            samples = []
+            for listing in listings[:requests]:
+                start = time.perf_counter()
+                response = send(listing)
+                samples.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{response.status_code}: {response.get_data(as_text=True)[:200]}")
+            return percentiles(samples)
+
+        results = {
+            "form_post": measure(lambda listing: client.post("/", data=listing)),
+            "api_predict_single": measure(lambda listing: client.post("/api/predict", json=listing)),
+        }
+        batch = listings[requests:]
+        prediction_cache.clear()
+        results[f"api_predict_batch_{batch_size}"] = {
+            "seconds": timed(lambda: client.post("/api/predict", json=batch), 5)[0]}
+        return results
+    finally:
+        os.chdir(cwd)
+
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "/"))
+        elif isinstance(value, float):
+            flat[name] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    '''
+    מדפיסה השוואה מול baseline ומחזירה את רשימת המדידות שהאטו מעבר ל-tolerance.
+    '''
+    current, previous = flatten(results["results"]), flatten(baseline["results"])
+    regressions = []
+    print(f"{'measurement':70} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name in sorted(current.keys() & previous.keys()):
+        if previous[name] <= 0:
+            continue
+        ratio = current[name] / previous[name]
+        marker = ""
+        if ratio > tolerance:
+            regressions.append(name)
+            marker = "  <-- regression"
+        print(f"{name:70} {previous[name]:10.4f} {current[name]:10.4f} {ratio:7.2f}{marker}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark prepare_data, model training and the Flask API")
+    parser.add_argument("--sizes", default="1k,10k", help="comma separated row counts, e.g. 1k,10k,100k,1m")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage, the best one is kept")
+    parser.add_argument("--skip-fit", action="store_true", help="do not time ElasticNetCV")
+    parser.add_argument("--skip-flask", action="store_true", help="do not time the Flask endpoints")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint for latency percentiles")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="slowdown ratio counted as a regression")
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings("ignore")
+    results = {}
+    for n in parse_sizes(args.sizes):
+        print(f"rows={n} ...", flush=True)
+        results[str(n)] = bench_data(n, args.repeat, args.skip_fit)
+    if not args.skip_flask:
+        print("flask ...", flush=True)
+        results["flask"] = bench_flask(args.requests)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "sklearn": sklearn.__version__,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over x{args.tolerance}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+
+class ExecutorFull(Exception):
+    '''
+    כל ה-workers עסוקים והתור מלא - הבקשה נדחית מיד (503) במקום לחכות.
+    '''
+
+
+class BoundedExecutor:
+    '''
+    ThreadPoolExecutor עם גבול על מספר המשימות שרצות או ממתינות (max_workers + queue_size).
+    החיזוי רץ כאן ולא ב-thread של הבקשה, כך שבקשה איטית (batch גדול) תופסת worker אחד
+    ושאר הבקשות - /healthz, /metrics, מטמון - ממשיכות להיענות. כשהגבול מלא submit זורקת ExecutorFull.
+
+    ה-threads נוצרים בתהליך שמשתמש בהם: אחרי fork (gunicorn עם preload_app) נוצר pool חדש,
+    כי threads של תהליך האב לא עוברים לתהליך הבן.
+    '''
+
+    def __init__(self, max_workers=None, queue_size=None, timeout=None):
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.queue_size = self.max_workers * 2 if queue_size is None else queue_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self.in_flight = 0
+        self.rejected = 0
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="predict")
+                self._pid = os.getpid()
+                self.in_flight = 0
+            return self._pool
+
+    def _release(self, future=None):
+        with self._lock:
+            self.in_flight -= 1
+
+    def submit(self, fn, *args, **kwargs):
+        pool = self._executor()
+        with self._lock:
+            if self.in_flight >= self.max_workers + self.queue_size:
+                self.rejected += 1
+                raise ExecutorFull()
+            self.in_flight += 1
+        try:
+            future = pool.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        '''
+        submit וחיכוי לתוצאה. אחרי timeout שניות נזרקת TimeoutError (המשימה עצמה ממשיכה לרוץ עד סופה).
+        '''
+        return self.submit(fn, *args, **kwargs).result(timeout=self.timeout)
+
+    def stats(self):
+        return {"max_workers": self.max_workers, "queue_size": self.queue_size,
+                "in_flight": self.in_flight, "rejected": self.rejected}
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.shutdown(wait=wait)
+            self._pool = None
+
+
+__all__ = ["BoundedExecutor", "ExecutorFull", "TimeoutError"]
@@ -0,0 +1,96 @@
+import pickle
+import numpy as np
+
+NEIGHBORHOOD, ADDRESS, FALLBACK = 0, 1, 2
+ENCODER_FILE = "category_encoder.npy"
+
+
+class CategoryEncoder:
+    '''
+    ה-target encoding של שכונה וכתובת כמערך NumPy מובנה אחד: (key, kind, mean), ממוין לפי kind ואז key.
+    הקוד של קטגוריה הוא המיקום שלה במערך - נמצא ב-searchsorted על החלק של ה-kind, בלי מילון בזיכרון.
+    כתובת שלא הופיעה באימון מקבלת את הממוצע של השכונה לפי הקוד של השכונה, ושכונה לא מוכרת -
+    את ה-prior הכללי של ה-target encoding (שורה אחת עם kind=FALLBACK).
+    הקובץ (.npy) נטען ב-mmap ומשותף בין תהליכי השרת.
+    '''
+
+    def __init__(self, records):
+        self.records = records
+        kinds = np.asarray(records['kind'])
+        bounds = np.searchsorted(kinds, [NEIGHBORHOOD, ADDRESS, FALLBACK, FALLBACK + 1])
+        # חלקים של המערך (views) - ב-mmap לא מועתקים לזיכרון
+        self._keys = {kind: records['key'][bounds[i]:bounds[i + 1]] for i, kind in enumerate([NEIGHBORHOOD, ADDRESS])}
+        self._means = {kind: records['mean'][bounds[i]:bounds[i + 1]] for i, kind in enumerate([NEIGHBORHOOD, ADDRESS])}
+        self.fallback = float(records['mean'][bounds[2]]) if bounds[3] > bounds[2] else np.nan
+
+    @classmethod
+    def from_means(cls, category_means):
+        '''
+        מהמילונים של category_means.pkl. ה-fallback הוא category_means['prior'] - ממוצע המחיר הכללי
+        שאליו מוחלקות השכונות (target_encoding.py). ב-category_means ישן בלי prior - np.mean על ערכי המילון.
+        '''
+        neighborhoods = category_means['neighborhood']
+        addresses = category_means['address']
+        prior = category_means.get('prior')
+        if prior is None:
+            prior = np.mean(list(neighborhoods.values()))
+        rows = sorted([(str(k), NEIGHBORHOOD, float(v)) for k, v in neighborhoods.items()]
+                      + [(str(k), ADDRESS, float(v)) for k, v in addresses.items()], key=lambda r: (r[1], r[0]))
+        rows.append(("", FALLBACK, float(prior)))
+        width = max([len(key) for key, _, _ in rows] + [1])
+        records = np.array(rows, dtype=[('key', f'U{width}'), ('kind', 'u1'), ('mean', 'f8')])
+        return cls(records)
+
+    def save(self, path=ENCODER_FILE):
+        np.save(path, np.asarray(self.records))
+
+    @classmethod
+    def load(cls, path=ENCODER_FILE, mmap=True):
+        return cls(np.load(path, mmap_mode='r' if mmap else None))
+
+    def codes(self, values, kind):
+        '''
+        קוד (מיקום בחלק של kind) לכל ערך, או -1 אם הערך לא הופיע באימון.
+        '''
+        keys = self._keys[kind]
+        values = np.array([v if isinstance(v, str) else "" for v in values], dtype=str)
+        if not len(keys) or not len(values):
+            return np.full(len(values), -1)
+        positions = np.minimum(np.searchsorted(keys, values), len(keys) - 1)
+        return np.where(keys[positions] == values, positions, -1)
+
+    def encode(self, neighborhoods, addresses):
+        '''
+        (neighborhood_encoded, address_encoded) לכל השורות בבת אחת.
+        '''
+        neighborhood_codes = self.codes(neighborhoods, NEIGHBORHOOD)
+        address_codes = self.codes(addresses, ADDRESS)
+        neighborhood_means = np.where(neighborhood_codes >= 0, self._means[NEIGHBORHOOD][neighborhood_codes],
+                                      self.fallback)
+        address_means = np.where(address_codes >= 0, self._means[ADDRESS][address_codes], neighborhood_means)
+        return neighborhood_means, address_means
+
+    def to_dict(self):
+        # המבנה של category_means.pkl
+        return {'neighborhood': dict(zip(self._keys[NEIGHBORHOOD].tolist(), self._means[NEIGHBORHOOD].tolist())),
+                'address': dict(zip(self._keys[ADDRESS].tolist(), self._means[ADDRESS].tolist())),
+                'prior': self.fallback}
+
+
+def save_category_means(category_means, directory="."):
+    '''
+    שומרת את ה-target encoding בשני הפורמטים - category_means.pkl (מילונים) ו-category_encoder.npy -
+    כדי ששניהם יתאימו תמיד לאותה גרסה.
+    '''
+    with open(f"{directory}/category_means.pkl", "wb") as f:
+        pickle.dump(category_means, f)
+    encoder = CategoryEncoder.from_means(category_means)
+    encoder.save(f"{directory}/{ENCODER_FILE}")
+    return encoder
+
+
+def load_category_encoder(path=ENCODER_FILE):
+    try:
+        return CategoryEncoder.load(path)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,428 @@
+'''
+הכנת דאטה לאימון בשני מעברים על הקובץ, chunk אחרי chunk, לקבצים שלא נכנסים לזיכרון.
+
+    python chunked_prep.py train.csv --chunksize 200000 --output feature_store
+
+מעבר 1 (collect_statistics) - אוסף מכל ה-chunks את הסטטיסטיקות שההשלמות וה-target encoding צריכים:
+חציוני קומות לרחוב, אינדקסים ממוינים (PeerIndex) לחדרים/גינה/ארנונה/ועד בית, חציון וסטיית תקן
+של מרחק לשכונה, גבולות האחוזונים של המחיר, הכתובת השכיחה בכל שכונה וממוצעי המחיר.
+מכל chunk נשמרים רק מערכים מספריים וקודים שלמים (_Codes) של רחוב/שכונה/כתובת/סוג נכס - לא מחרוזות.
+
+מעבר 2 (prepare_data_chunked) - כל chunk עובר את אותם שלבים של prepare_data, עם הסטטיסטיקות
+ממעבר 1 במקום סטטיסטיקות של ה-chunk, ונכתב ל-FeatureStore (עמודה לקובץ .npy).
+טבלת המרחקים וטבלאות ההשלמה נבנות בסוף מקודי השכונה/הכתובת של השורות הסופיות ומהעמודות המספריות.
+ה-scaler נלמד ב-partial_fit ואחר כך העמודות מנורמלות במקומן.
+קבצי ההכנה נשמרים ב-<output>/artifacts ולא בתיקייה הנוכחית: model_training.py --store מפרסם אותם
+יחד עם המודל וה-manifest, רק אחרי שהאימון הצליח.
+
+ההבדלים מ-prepare_data על כל הקובץ בבת אחת:
+- ההשלמות מחושבות מהערכים הנצפים בלבד. ב-prepare_data ערך שהושלם מצטרף לעמיתים של השורות הבאות.
+- השורות נשארות בסדר הקובץ ולא ממוינות לפי שכונה.
+סינון השורות, גבולות המחיר, הכתובות השכיחות ו-target encoding זהים.
+'''
+import os
+import sys
+import json
+import pickle
+import argparse
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from imputation import PeerIndex, PeerMedian
+from inference_pipeline import InferencePipeline
+from feature_store import FeatureStore, FeatureStoreWriter, artifacts_directory
+from distance_provider import StreetDistanceTable
+from imputation_stats import ImputationStats, STATS_FILE
+from category_encoder import save_category_means
+from target_encoding import target_encode
+from address_cleaning import clean_address
+from assets_data_prep import (
+    parse_floors, process_floors, extract_streets, extract_room_num, clean_property_type, fix_room_num,
+    resolve_distances, distance_stats, filter_extreme_distances, process_garden_area, process_tax_col,
+    build_tax_index, build_arnona_index, fix_monthly_arnona_by_median, keep_only_text_in_address,
+    fill_missing_address_by_neighborhood, add_derived_features, distance_coordinates, _index_columns)
+
+NUMERIC_COLS = ['floor', 'area', 'total_floors', 'monthly_arnona', 'building_tax',
+                'garden_area', 'distance_from_center']
+TAX_COLS = ['monthly_arnona', 'building_tax']
+# העמודות המספריות של השורות הסופיות שנשמרות מכל chunk - לטבלת המרחקים ולטבלאות ההשלמה
+STATS_INPUTS = ['distance_from_center', 'area', 'room_num', 'floor', 'total_floors',
+                'monthly_arnona', 'building_tax', 'garden_area']
+# העמודות של השורות המקוצרות ממעבר 1 שנכנסות לאינדקסי ההשלמה
+PEER_INPUTS = ['area', 'room_num', 'garden_area', 'monthly_arnona', 'building_tax', 'distance_from_center', 'area_ok']
+
+
+class _Codes:
+    '''
+    קידוד מחרוזות (שכונה/רחוב/כתובת) למספרים שלמים, כדי לשמור עמודה של int32 במקום אובייקטים.
+    '''
+
+    def __init__(self):
+        self.index = {}
+        self.labels = []
+
+    def encode(self, values):
+        values = pd.Series(values, dtype=object)
+        for value in pd.unique(values.dropna()):
+            if value not in self.index:
+                self.index[value] = len(self.labels)
+                self.labels.append(value)
+        return values.map(self.index).fillna(-1).to_numpy(dtype=np.int32)
+
+    def decode(self, codes):
+        labels = np.array(self.labels + [None], dtype=object)
+        return labels[np.where(codes < 0, len(self.labels), codes)]
+
+
+def new_codes():
+    return {'street': _Codes(), 'neighborhood': _Codes(), 'address': _Codes(), 'property_type': _Codes()}
+
+
+def read_chunks(path, chunksize):
+    return pd.read_csv(path, chunksize=chunksize)
+
+
+class TrainingStatistics:
+    '''
+    כל מה שמעבר 2 צריך כדי לעבד chunk בלי לראות את שאר הקובץ.
+    '''
+
+    def __init__(self, street_medians, room_index, room_median, garden_index, distance_stats,
+                 tax_indexes, tax_medians, arnona_index, price_bounds, address_modes, default_address,
+                 category_means, encoder, rows, vocabularies, target_encoded=None):
+        self.street_medians = street_medians
+        self.room_index = room_index
+        self.room_median = room_median
+        self.garden_index = garden_index
+        self.distance_stats = distance_stats
+        self.tax_indexes = tax_indexes
+        self.tax_medians = tax_medians
+        self.arnona_index = arnona_index
+        self.price_bounds = price_bounds
+        self.address_modes = address_modes
+        self.default_address = default_address
+        self.category_means = category_means
+        # הקידוד out-of-fold של השורות הסופיות, לפי הסדר - נחתך לכל chunk במעבר 2
+        self.target_encoded = target_encoded
+        self.encoder = encoder
+        self.rows = rows
+        self.vocabularies = vocabularies
+
+
+def _to_numeric(df):
+    for col in NUMERIC_COLS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+
+def _mode(values):
+    # כמו Series.mode().iloc[0]: הערך השכיח, ובתיקו - הקטן ביותר
+    counts = pd.Series(values).value_counts()
+    return min(counts.index[counts == counts.iloc[0]])
+
+
+def scan_chunk(chunk, codes, vocabularies):
+    '''
+    מה שמעבר 1 שומר מ-chunk אחד: (קומות ורחוב לכל השורות, שורה מקוצרת לכל דירה אחרי ניקוי סוג הנכס).
+    codes - מילון של _Codes לרחוב/שכונה/כתובת, vocabularies - קבוצות הכתובות והשכונות לטופס.
+    '''
+    vocabularies['addresses'].update(chunk['address'].dropna().astype(str))
+    vocabularies['neighborhoods'].update(chunk['neighborhood'].dropna().astype(str))
+
+    # קומות - חציון לרחוב מחושב על כל השורות, לפני כל סינון (כמו process_floors)
+    df = parse_floors(chunk.copy())
+    floor_part = pd.DataFrame({
+        'street': codes['street'].encode(extract_streets(df['address'])),
+        'floor': df['floor'].astype(float).to_numpy(),
+        'total_floors': df['total_floors'].astype(float).to_numpy()})
+
+    df = clean_property_type(_to_numeric(df))
+    df['neighborhood'] = df['neighborhood'].fillna('Unknown')
+    mask_zero = df['room_num'] == 0
+    df.loc[mask_zero, 'room_num'] = df.loc[mask_zero, 'description'].apply(extract_room_num)
+    df = resolve_distances(df)
+    df.loc[df['property_type'].astype(str).str.contains("בית פרטי|קוטג'", na=False), 'building_tax'] = 0
+    area_ok = (df['area'] >= 20).to_numpy()
+    price = df['price'].to_numpy(dtype=float)
+    row_part = pd.DataFrame({
+        'street': codes['street'].encode(extract_streets(df['address'])),
+        'neighborhood': codes['neighborhood'].encode(df['neighborhood']),
+        'address': codes['address'].encode(df['address'].apply(clean_address)),
+        'property_type': codes['property_type'].encode(df['property_type']),
+        'area': df['area'].to_numpy(dtype=float),
+        'room_num': df['room_num'].to_numpy(dtype=float),
+        'garden_area': df['garden_area'].to_numpy(dtype=float),
+        'distance_from_center': df['distance_from_center'].to_numpy(dtype=float),
+        'monthly_arnona': df['monthly_arnona'].to_numpy(dtype=float),
+        'building_tax': df['building_tax'].to_numpy(dtype=float),
+        'price': price,
+        'area_ok': area_ok,
+        'price_ok': area_ok & ~np.isnan(price) & (price >= 1000) & (price <= 25000)})
+    return floor_part, row_part
+
+
+def collect_parts(path, chunksize=100_000):
+    '''
+    מעבר 1 על הקובץ: (floors, rows, codes, vocabularies) - העמודות המקוצרות של כל ה-chunks.
+    '''
+    codes = new_codes()
+    vocabularies = {'addresses': set(), 'neighborhoods': set()}
+    floor_parts, row_parts = [], []
+    for chunk in read_chunks(path, chunksize):
+        floor_part, row_part = scan_chunk(chunk, codes, vocabularies)
+        floor_parts.append(floor_part)
+        row_parts.append(row_part)
+    return (pd.concat(floor_parts, ignore_index=True), pd.concat(row_parts, ignore_index=True),
+            codes, vocabularies)
+
+
+def peer_statistics(rows):
+    '''
+    האינדקסים הממוינים (PeerIndex) של ההשלמות, מהשורות המקוצרות (neighborhood כטקסט).
+    '''
+    columns = _index_columns(rows)
+    room = rows['room_num'].to_numpy()
+    garden = rows['garden_area'].to_numpy()
+    taxed = rows[rows['area_ok']]
+    return {
+        'room_index': PeerIndex.build([PeerMedian(group='neighborhood', area_window=5),
+                                       PeerMedian(group='neighborhood')], columns, room, room > 0),
+        'room_median': float(np.median(room[room > 0])),
+        'garden_index': PeerIndex.build([PeerMedian(group='neighborhood', area_window=0)],
+                                        columns, garden, ~np.isnan(garden)),
+        'tax_indexes': {col: build_tax_index(taxed, col) for col in TAX_COLS},
+        'tax_medians': {col: taxed[col].median() for col in TAX_COLS},
+        'arnona_index': build_arnona_index(taxed),
+    }
+
+
+def merge_peer_statistics(indexes, rows):
+    '''
+    מוסיפה שורות מקוצרות חדשות לאינדקסים של peer_statistics (PeerIndex.merge, במקום), עם אותם
+    ערכים ועמיתים כמו בבנייה - כך שהתוצאה זהה לבנייה מחדש על כל השורות.
+    '''
+    columns = _index_columns(rows)
+    room = rows['room_num'].to_numpy(dtype=float)
+    garden = rows['garden_area'].to_numpy(dtype=float)
+    indexes['room_index'].merge(columns, room, room > 0)
+    indexes['garden_index'].merge(columns, garden, ~np.isnan(garden))
+    taxed = rows[rows['area_ok']]
+    taxed_columns = _index_columns(taxed)
+    for col in TAX_COLS:
+        values = taxed[col].to_numpy(dtype=float)
+        indexes['tax_indexes'][col].merge(taxed_columns, values, values > 0)
+    arnona = taxed['monthly_arnona'].to_numpy(dtype=float)
+    low, high = indexes['arnona_index'].valid_range
+    indexes['arnona_index'].merge(taxed_columns, arnona, (arnona >= low) & (arnona <= high))
+    return indexes
+
+
+def fill_final_addresses(final, address_modes, default_address):
+    final['address'] = final['address'].where(
+        final['address'].notnull(), final['neighborhood'].map(address_modes).fillna(default_address))
+    return final
+
+
+def address_modes_from_codes(neighborhoods, addresses, codes):
+    '''
+    (address_modes, default_address) מקודי השכונה והכתובת: הכתובת השכיחה בכל שכונה ובכל השורות,
+    ובתיקו - הקטנה ביותר (כמו _mode). הספירה על הקודים, והפענוח רק של התוצאה.
+    '''
+    known = (addresses >= 0) & (neighborhoods >= 0)
+    pairs = pd.DataFrame({'neighborhood': neighborhoods[known], 'address': addresses[known]})
+    counts = pairs.groupby(['neighborhood', 'address']).size().reset_index(name='count')
+    counts['label'] = codes['address'].decode(counts['address'].to_numpy())
+    counts = counts.sort_values(['neighborhood', 'count', 'label'], ascending=[True, False, True])
+    counts = counts.drop_duplicates('neighborhood')
+    address_modes = pd.Series(counts['label'].to_numpy(), name='address',
+                              index=pd.Index(codes['neighborhood'].decode(counts['neighborhood'].to_numpy()),
+                                             name='neighborhood')).sort_index()
+    overall = pd.Series(addresses[addresses >= 0]).value_counts()
+    default_address = _mode(codes['address'].decode(overall.index[overall == overall.iloc[0]].to_numpy()))
+    return address_modes, default_address
+
+
+def statistics_from_parts(floors, rows, codes, vocabularies):
+    floors = floors[floors['street'] >= 0]
+    street_medians = {}
+    for col in ['floor', 'total_floors']:
+        medians = floors.groupby('street')[col].median().dropna()
+        street_medians[col] = dict(zip(codes['street'].decode(medians.index.to_numpy()), medians.to_numpy()))
+
+    # האינדקסים ממופתחים לפי שם השכונה - הפענוח נותן הפניות לאותן תוויות, לא מחרוזת לכל שורה
+    peers = pd.DataFrame({'neighborhood': codes['neighborhood'].decode(rows['neighborhood'].to_numpy()),
+                          **{col: rows[col].to_numpy() for col in PEER_INPUTS}})
+
+    # סינון המחיר כמו ב-prepare_data: טווח קבוע ואז אחוזונים 1 ו-99 של מה שנשאר
+    price = rows['price'].to_numpy()
+    priced = rows['price_ok'].to_numpy()
+    low, high = np.quantile(price[priced], 0.01), np.quantile(price[priced], 0.99)
+    selected = np.flatnonzero(priced & (price > low) & (price < high))
+
+    neighborhoods = rows['neighborhood'].to_numpy()[selected]
+    addresses = rows['address'].to_numpy()[selected]
+    address_modes, default_address = address_modes_from_codes(neighborhoods, addresses, codes)
+    final = fill_final_addresses(pd.DataFrame({'neighborhood': codes['neighborhood'].decode(neighborhoods),
+                                               'address': codes['address'].decode(addresses)}),
+                                 address_modes, default_address)
+
+    neighborhood_encoded, address_encoded, category_means = target_encode(
+        final['neighborhood'], final['address'], price[selected])
+    property_types = codes['property_type'].decode(np.unique(rows['property_type'].to_numpy()[selected]))
+    encoder = OneHotEncoder(handle_unknown='ignore', sparse_output=False)
+    encoder.fit(pd.DataFrame({'property_type': sorted(property_types)}))
+
+    return TrainingStatistics(
+        street_medians=street_medians,
+        distance_stats=distance_stats(peers),
+        price_bounds=(low, high),
+        address_modes=address_modes,
+        default_address=default_address,
+        category_means=category_means,
+        target_encoded={'neighborhood': neighborhood_encoded, 'address': address_encoded},
+        encoder=encoder,
+        rows=len(selected),
+        vocabularies={key: sorted(values) for key, values in vocabularies.items()},
+        **peer_statistics(peers))
+
+
+def collect_statistics(path, chunksize=100_000):
+    '''
+    מעבר 1 על הקובץ. מחזירה TrainingStatistics.
+    '''
+    return statistics_from_parts(*collect_parts(path, chunksize))
+
+
+def clean_chunk(chunk, stats):
+    '''
+    השלבים של prepare_data עד ה-encoding, לפי הסטטיסטיקות של כל הקובץ.
+    '''
+    df = process_floors(chunk.copy(), street_medians=stats.street_medians)
+    df = clean_property_type(_to_numeric(df))
+    df['neighborhood'] = df['neighborhood'].fillna('Unknown')
+    df = fix_room_num(df, room_index=stats.room_index, room_median=stats.room_median)
+    df = resolve_distances(df)
+    df = filter_extreme_distances(df, threshold=1.5, neighborhood_stats=stats.distance_stats)
+    df = process_garden_area(df, garden_index=stats.garden_index)
+    df.loc[df['garden_area'] > 100, 'garden_area'] = df['garden_area'] / 10
+    df = df[df['area'] >= 20]
+    df = df.drop(columns=['days_to_enter', 'num_of_payments'], errors='ignore')
+
+    for col in TAX_COLS:
+        df = process_tax_col(df, col, tax_index=stats.tax_indexes[col])
+        df[col] = df[col].fillna(stats.tax_medians[col])
+    df = fix_monthly_arnona_by_median(df, arnona_index=stats.arnona_index)
+    df = df.drop(columns=['num_of_images', 'description'], errors='ignore')
+
+    low, high = stats.price_bounds
+    df = df[df['price'].notnull() & (df['price'] >= 1000) & (df['price'] <= 25000)]
+    df = df[(df['price'] > low) & (df['price'] < high)]
+
+    df = keep_only_text_in_address(df.reset_index(drop=True))
+    df = fill_missing_address_by_neighborhood(df, stats.address_modes, stats.default_address)
+    return add_derived_features(df)
+
+
+def encode_chunk(df, stats, offset=None, category_encoder=None):
+    '''
+    offset - המיקום של ה-chunk בשורות הסופיות, לקידוד out-of-fold מ-stats.target_encoded.
+    category_encoder - קידוד קיים עם ה-fallback של החיזוי (שורות חדשות ב-incremental_prep).
+    '''
+    if category_encoder is not None:
+        df['neighborhood_encoded'], df['address_encoded'] = category_encoder.encode(
+            df['neighborhood'].to_numpy(dtype=object), df['address'].to_numpy(dtype=object))
+    elif offset is not None and stats.target_encoded is not None:
+        for col in ['neighborhood', 'address']:
+            df[col + '_encoded'] = stats.target_encoded[col][offset:offset + len(df)]
+    else:
+        for col in ['neighborhood', 'address']:
+            df[col + '_encoded'] = df[col].map(stats.category_means[col])
+    onehot = stats.encoder.transform(df[['property_type']])
+    onehot_df = pd.DataFrame(onehot, columns=stats.encoder.get_feature_names_out(['property_type']), index=df.index)
+    df = pd.concat([df.drop(columns=['property_type']), onehot_df], axis=1)
+    return df.drop(columns=['neighborhood', 'address'])
+
+
+def prepare_data_chunked(path, output="feature_store", chunksize=100_000, stats=None):
+    '''
+    שני המעברים. שומרת את הפיצ'רים המנורמלים (והמחיר) ב-FeatureStore בתיקייה output, ואת אותם קבצים
+    כמו prepare_data(dataset_type='train') ב-<output>/artifacts. מחזירה את ה-FeatureStore.
+    stats - תוצאת מעבר 1 שכבר חושבה (incremental_prep), כדי לא לקרוא את הקובץ פעמיים.
+    '''
+    if stats is None:
+        stats = collect_statistics(path, chunksize)
+
+    scaler = StandardScaler()
+    writer, feature_cols = None, None
+    # קודי השכונה והכתובת ועמודות STATS_INPUTS של השורות הסופיות, chunk אחרי chunk
+    table_codes = {'neighborhood': _Codes(), 'address': _Codes()}
+    table_inputs = []
+    offset = 0
+    for chunk in read_chunks(path, chunksize):
+        df = clean_chunk(chunk, stats)
+        table_inputs.append({**{col: table_codes[col].encode(df[col]) for col in table_codes},
+                             **{col: df[col].to_numpy(dtype=float) for col in STATS_INPUTS}})
+        df = encode_chunk(df, stats, offset)
+        offset += len(df)
+        if writer is None:
+            feature_cols = df.drop(columns='price').columns
+            writer = FeatureStoreWriter(output, list(feature_cols) + ['price'], stats.rows,
+                                        meta={"source": str(path), "chunksize": chunksize})
+        if len(df):
+            scaler.partial_fit(df[feature_cols])
+            writer.append(df)
+    store = writer.close()
+
+    # ערכי השלמה לטרנספורמר (חציון כל פיצ'ר) ואז נרמול העמודות במקומן, אחת אחרי השנייה
+    fill_values = {col: float(np.nanmedian(store.column(col))) for col in feature_cols}
+    writable = FeatureStore.open(store.directory, mmap_mode='r+')
+    for col, mean, scale in zip(feature_cols, scaler.mean_, scaler.scale_):
+        column = writable.column(col)
+        column -= mean
+        column /= scale
+        column.flush()
+    del writable
+
+    final = {col: np.concatenate([part[col] for part in table_inputs]) for col in table_inputs[0]}
+    del table_inputs
+    labels = {col: np.array(table_codes[col].labels, dtype=object) for col in table_codes}
+    distance_table = StreetDistanceTable.from_codes(
+        labels['address'], final['address'], labels['neighborhood'], final['neighborhood'],
+        final['distance_from_center'], distance_coordinates())
+    imputation_stats = ImputationStats.from_codes(labels['neighborhood'], final['neighborhood'],
+                                                  labels['address'], final['address'], final)
+    artifacts = artifacts_directory(store.directory)
+    os.makedirs(artifacts, exist_ok=True)
+    with open(os.path.join(artifacts, "vocabularies.json"), "w", encoding="utf-8") as f:
+        json.dump(stats.vocabularies, f, ensure_ascii=False)
+    stats.arnona_index.save(os.path.join(artifacts, "arnona_index.pkl"))
+    distance_table.save(os.path.join(artifacts, "street_distances.npy"))
+    imputation_stats.save(os.path.join(artifacts, STATS_FILE))
+    save_category_means(stats.category_means, artifacts)
+    with open(os.path.join(artifacts, "onehot_encoder.pkl"), "wb") as f:
+        pickle.dump(stats.encoder, f)
+    with open(os.path.join(artifacts, "train_columns.pkl"), "wb") as f:
+        pickle.dump(feature_cols, f)
+    with open(os.path.join(artifacts, "scaler.pkl"), "wb") as f:
+        pickle.dump(scaler, f)
+    InferencePipeline.from_fitted(feature_cols, scaler, stats.encoder, stats.category_means,
+                                  fill_values=fill_values, arnona_index=stats.arnona_index,
+                                  distance_table=distance_table, imputation_stats=imputation_stats).save(
+                                      os.path.join(artifacts, "inference_pipeline.pkl"))
+    return FeatureStore.open(store.directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Two-pass chunked training data preparation")
+    parser.add_argument("path", nargs="?", default="train.csv")
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    parser.add_argument("--output", default="feature_store")
+    args = parser.parse_args(argv)
+    store = prepare_data_chunked(args.path, args.output, args.chunksize)
+    print(f"{store.rows} rows x {len(store.columns) - 1} features -> {store.directory}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,407 @@
+import os
+import re
+import csv
+import json
+import math
+import time
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+ROUTES_API_URL = "https://routes.googleapis.com/directions/v2:computeRoutes"
+DESTINATION_ADDRESS = "כיכר דיזינגוף, תל אביב"
+DIZENGOFF_SQUARE = (32.07775, 34.77402)  # (lat, lon)
+CACHE_PATH = "distance_cache.sqlite"
+# כמה זמן מפתח שלא קיבל מרחק לא נשלח שוב ל-backend (שניות)
+NEGATIVE_TTL = 24 * 3600
+
+
+def _is_missing(val):
+    return val is None or (isinstance(val, float) and val != val)
+
+
+def normalize_location(address, neighborhood):
+    '''
+    מפתח אחיד לחיפוש: הכתובת אם קיימת, אחרת השכונה (כמו ב-get_distance_from_center),
+    בלי רווחים כפולים ועם גרש אחיד, כדי ש"דיזנגוף  " ו"דיזנגוף" יחלקו רשומה אחת במטמון.
+    '''
+    origin = address if not _is_missing(address) else neighborhood
+    if _is_missing(origin):
+        return None
+    origin = re.sub(r"\s+", " ", str(origin)).strip()
+    origin = origin.replace("׳", "'").replace("’", "'").replace("״", '"')
+    return origin or None
+
+
+def _digest(mapping):
+    # תוכן טבלה (מפתח -> ערך) כ-hash קצר, במקום לכלול את כולה בתיאור של הספק
+    content = json.dumps(sorted(mapping.items()), ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:12]
+
+
+def haversine_meters(lat1, lon1, lat2, lon2):
+    r = 6371000.0
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * r * math.asin(math.sqrt(a))
+
+
+class DistanceCache:
+    '''
+    מטמון מרחקים על הדיסק (SQLite), לפי מפתח מנורמל.
+    משותף בין תהליכים ובין ריצות, כך שכל רחוב משולם ב-API פעם אחת בלבד.
+    מפתח שה-backend לא מצא לו מרחק נשמר בטבלת misses עם זמן, ולא נשלח שוב עד שעברו negative_ttl
+    שניות - כתובת שלא קיימת לא עולה קריאה ל-API בכל ריצה, ותקלה זמנית עדיין מתנקה בסוף.
+    '''
+
+    def __init__(self, path=CACHE_PATH, negative_ttl=NEGATIVE_TTL):
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS distances ("
+            "key TEXT PRIMARY KEY, distance REAL NOT NULL, source TEXT, updated_at REAL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS misses (key TEXT PRIMARY KEY, source TEXT, updated_at REAL NOT NULL)")
+        self._conn.commit()
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, distance FROM distances WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                found.update(rows.fetchall())
+        return found
+
+    def get_misses(self, keys):
+        '''
+        המפתחות מתוך keys שה-backend לא מצא להם מרחק בתוך ה-negative_ttl האחרון.
+        '''
+        misses = set()
+        keys = list(keys)
+        since = time.time() - self.negative_ttl
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key FROM misses WHERE updated_at >= ? AND key IN ({','.join('?' * len(chunk))})",
+                    [since] + chunk)
+                misses.update(key for key, in rows.fetchall())
+        return misses
+
+    def put_misses(self, keys, source):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO misses (key, source, updated_at) VALUES (?, ?, ?)",
+                [(key, source, now) for key in keys])
+            self._conn.commit()
+
+    def put_many(self, distances, source):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO distances (key, distance, source, updated_at) VALUES (?, ?, ?, ?)",
+                [(key, float(value), source, now) for key, value in distances.items()])
+            self._conn.commit()
+
+
+class RoutesApiBackend:
+    '''
+    מרחק נסיעה מ-Google Routes API.
+    Session אחד עם pool של חיבורים, timeout, ו-retry עם backoff על 429/5xx.
+    '''
+    name = "routes_api"
+
+    def __init__(self, api_key, timeout=(3.05, 10), retries=3, backoff_factor=0.5, pool_size=8):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["POST"])
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'X-Goog-Api-Key': api_key,
+            'X-Goog-FieldMask': 'routes.distanceMeters,routes.duration'
+        })
+
+    def config(self):
+        return {"destination": DESTINATION_ADDRESS, "travel_mode": "DRIVE", "routing": "TRAFFIC_AWARE"}
+
+    def fetch(self, key):
+        body = {
+            "origin": {"address": f"{key}, תל אביב"},
+            "destination": {"address": DESTINATION_ADDRESS},
+            "travelMode": "DRIVE",
+            "routingPreference": "TRAFFIC_AWARE"
+        }
+        try:
+            response = self.session.post(ROUTES_API_URL, data=json.dumps(body), timeout=self.timeout)
+            if response.status_code == 200:
+                return float(response.json()['routes'][0]['distanceMeters'])
+        except (requests.RequestException, KeyError, IndexError, ValueError):
+            pass
+        return None
+
+
+class TableBackend:
+    '''
+    טבלה קבועה של מפתח -> מרחק במטרים. עובד בלי רשת (לבדיקות ולסביבות סגורות).
+    '''
+    name = "table"
+
+    def __init__(self, distances):
+        self.distances = {normalize_location(key, None): float(value) for key, value in distances.items()}
+
+    def config(self):
+        return {"distances": _digest(self.distances)}
+
+    def fetch(self, key):
+        return self.distances.get(key)
+
+
+class HaversineBackend:
+    '''
+    מרחק אווירי לכיכר דיזנגוף מתוך קובץ קואורדינטות מקומי (CSV עם העמודות name, lat, lon).
+    קירוב למרחק הנסיעה, בלי רשת.
+    '''
+    name = "haversine"
+
+    def __init__(self, coordinates, center=DIZENGOFF_SQUARE):
+        self.center = center
+        self.coordinates = {normalize_location(name, None): (float(lat), float(lon))
+                            for name, (lat, lon) in coordinates.items()}
+
+    @classmethod
+    def from_csv(cls, path, center=DIZENGOFF_SQUARE):
+        with open(path, encoding="utf-8") as f:
+            return cls({row["name"]: (row["lat"], row["lon"]) for row in csv.DictReader(f)}, center)
+
+    def config(self):
+        return {"coordinates": _digest(self.coordinates), "center": list(self.center)}
+
+    def fetch(self, key):
+        point = self.coordinates.get(key)
+        if point is None:
+            return None
+        return haversine_meters(point[0], point[1], *self.center)
+
+
+class DistanceProvider:
+    '''
+    שכבת מרחקים: נרמול ומניעת כפילויות, מטמון על הדיסק, ורק אז פנייה ל-backend
+    במקביל (thread pool חסום), עבור המפתחות שלא נמצאו.
+    '''
+
+    def __init__(self, backend, cache=None, max_workers=8):
+        self.backend = backend
+        self.cache = cache
+        self.max_workers = max_workers
+
+    def lookup(self, keys):
+        '''
+        keys - מפתחות מנורמלים. מחזירה מילון מפתח -> מרחק (מפתח שלא נמצא לא יופיע).
+        '''
+        unique = {key for key in keys if key is not None}
+        found = self.cache.get_many(unique) if self.cache is not None else {}
+        missing = unique - found.keys()
+        if self.cache is not None and missing:
+            # מפתחות שנכשלו לאחרונה לא נשלחים שוב
+            missing -= self.cache.get_misses(missing)
+        missing = sorted(missing)
+        if missing:
+            if self.max_workers > 1 and len(missing) > 1:
+                with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                    fetched = dict(zip(missing, pool.map(self.backend.fetch, missing)))
+            else:
+                fetched = {key: self.backend.fetch(key) for key in missing}
+            unresolved = [key for key, value in fetched.items() if value is None]
+            fetched = {key: value for key, value in fetched.items() if value is not None}
+            if self.cache is not None:
+                if fetched:
+                    self.cache.put_many(fetched, self.backend.name)
+                if unresolved:
+                    self.cache.put_misses(unresolved, self.backend.name)
+            found.update(fetched)
+        return found
+
+    def config(self):
+        '''
+        מה שקובע את המרחקים שהספק מחזיר: ה-backend והגדרותיו, וקובץ המטמון.
+        '''
+        return {"backend": self.backend.name, **self.backend.config(),
+                "cache": self.cache.path if self.cache is not None else None}
+
+    def get_distances(self, addresses, neighborhoods):
+        '''
+        מרחק לכל שורה; NaN כשאין תשובה (ואז נשמר הערך הקודם אצל הקורא).
+        '''
+        keys = [normalize_location(a, n) for a, n in zip(addresses, neighborhoods)]
+        found = self.lookup(keys)
+        return np.array([found.get(key, np.nan) if key is not None else np.nan for key in keys], dtype=float)
+
+
+STREET, NEIGHBORHOOD = 0, 1
+
+
+def street_key(address):
+    '''
+    מפתח רחוב: בלי מספרי בית ורווחים כפולים (כמו clean_address), עם גרש אחיד.
+    '''
+    if _is_missing(address):
+        return None
+    return normalize_location(re.sub(r"\d+", "", str(address)), None)
+
+
+def _factorize(values):
+    # (תוויות, קוד לכל שורה) - 1- לערך חסר
+    index, codes = {}, []
+    for value in values:
+        codes.append(-1 if _is_missing(value) else index.setdefault(value, len(index)))
+    return list(index), np.array(codes, dtype=int)
+
+
+def _group_medians(codes, values):
+    '''
+    (קודים, חציונים) - חציון הערכים של כל קוד, במיון אחד לפי (קוד, ערך).
+    '''
+    order = np.lexsort((values, codes))
+    codes, values = codes[order], values[order]
+    unique, starts, counts = np.unique(codes, return_index=True, return_counts=True)
+    return unique.tolist(), ((values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2).tolist()
+
+
+class StreetDistanceTable:
+    '''
+    טבלת מרחקים שנבנית פעם אחת מדאטה האימון: רחוב -> (lat, lon, מרחק מכיכר דיזנגוף),
+    ושכונה -> מרחק חציוני כגיבוי לרחוב שלא הופיע באימון.
+    נשמרת כמערך NumPy מובנה אחד (.npy) שנטען ב-mmap ומשותף בין תהליכי השרת;
+    בטעינה נבנה מילון מפתח -> שורה, כך שחיפוש הוא O(1) ולא נוגע ברשת.
+    '''
+    name = "street_table"
+
+    def __init__(self, records):
+        self.records = records
+        self._index = {(key, kind): i for i, (key, kind) in
+                       enumerate(zip(records['key'].tolist(), records['kind'].tolist()))}
+
+    @classmethod
+    def build(cls, streets, neighborhoods, distances, coordinates=None, min_distance=100):
+        '''
+        מרחק לרחוב/שכונה = חציון המרחקים התקינים (>= min_distance) בשורות האימון.
+        coordinates - מילון אופציונלי רחוב -> (lat, lon), למשל מקובץ הקואורדינטות של HaversineBackend.
+        '''
+        street_labels, street_codes = _factorize(streets)
+        neighborhood_labels, neighborhood_codes = _factorize(neighborhoods)
+        return cls.from_codes(street_labels, street_codes, neighborhood_labels, neighborhood_codes, distances,
+                              coordinates, min_distance)
+
+    @classmethod
+    def from_codes(cls, street_labels, street_codes, neighborhood_labels, neighborhood_codes, distances,
+                   coordinates=None, min_distance=100):
+        '''
+        כמו build, מקודים שלמים לכל שורה (-1 לחסר) ורשימת התוויות שלהם - בלי מחרוזת לכל שורה.
+        המפתח (street_key / normalize_location) מחושב פעם אחת לכל תווית.
+        '''
+        distances = np.asarray(distances, dtype=float)
+        valid = ~np.isnan(distances) & (distances >= min_distance)
+        groups = {}
+        for kind, labels, codes, key in ((STREET, street_labels, street_codes, street_key),
+                                         (NEIGHBORHOOD, neighborhood_labels, neighborhood_codes,
+                                          lambda label: normalize_location(label, None))):
+            keys = [key(label) for label in labels]
+            names = sorted({k for k in keys if k is not None})
+            position = {name: i for i, name in enumerate(names)}
+            # קוד התווית -> קוד המפתח, ו-1- לתווית בלי מפתח
+            remap = np.array([position.get(k, -1) for k in keys] + [-1], dtype=int)
+            rows = remap[np.where(np.asarray(codes) < 0, len(keys), codes)]
+            keep = valid & (rows >= 0)
+            for code, median in zip(*_group_medians(rows[keep], distances[keep])):
+                groups[(names[code], kind)] = median
+
+        coordinates = {normalize_location(k, None): v for k, v in (coordinates or {}).items()}
+        width = max([len(key) for key, _ in groups] + [1])
+        records = np.zeros(len(groups), dtype=[('key', f'U{width}'), ('kind', 'u1'),
+                                               ('lat', 'f8'), ('lon', 'f8'), ('distance', 'f8')])
+        for i, ((key, kind), median) in enumerate(sorted(groups.items())):
+            lat, lon = coordinates.get(key, (np.nan, np.nan)) if kind == STREET else (np.nan, np.nan)
+            records[i] = (key, kind, lat, lon, median)
+        return cls(records)
+
+    def save(self, path="street_distances.npy"):
+        np.save(path, np.asarray(self.records))
+
+    @classmethod
+    def load(cls, path="street_distances.npy", mmap=True):
+        return cls(np.load(path, mmap_mode='r' if mmap else None))
+
+    def lookup(self, address, neighborhood):
+        row = self._index.get((street_key(address), STREET))
+        if row is None:
+            row = self._index.get((normalize_location(neighborhood, None), NEIGHBORHOOD))
+        return float(self.records['distance'][row]) if row is not None else np.nan
+
+    def lookup_many(self, addresses, neighborhoods):
+        return np.array([self.lookup(a, n) for a, n in zip(addresses, neighborhoods)], dtype=float)
+
+    def fill(self, addresses, neighborhoods, distances):
+        '''
+        כמו fill_distances_from_provider: מחזירה את המרחק מהטבלה, או את הערך הקיים אם אין התאמה.
+        '''
+        found = self.lookup_many(addresses, neighborhoods)
+        return np.where(np.isnan(found), np.asarray(distances, dtype=float), found)
+
+    def fetch(self, key):
+        # ממשק backend של DistanceProvider: המפתח הוא רחוב, או שכונה כשאין כתובת
+        value = self.lookup(key, key)
+        return None if np.isnan(value) else value
+
+
+def load_distance_table(path="street_distances.npy"):
+    try:
+        return StreetDistanceTable.load(path)
+    except FileNotFoundError:
+        return None
+
+
+_default_provider = None
+_default_lock = threading.Lock()
+
+
+def get_default_provider():
+    '''
+    ספק ברירת המחדל לפי משתני סביבה:
+      ROUTES_API_KEY        -> Google Routes API עם מטמון SQLite (DISTANCE_CACHE_PATH)
+      DISTANCE_COORDS_FILE  -> מרחק אווירי מקובץ קואורדינטות מקומי
+    בלי אף אחד מהם מחזירה None, והמרחקים הקיימים נשארים כפי שהם.
+    '''
+    global _default_provider
+    with _default_lock:
+        if _default_provider is None:
+            api_key = os.environ.get("ROUTES_API_KEY")
+            coords_file = os.environ.get("DISTANCE_COORDS_FILE")
+            cache_path = os.environ.get("DISTANCE_CACHE_PATH", CACHE_PATH)
+            if api_key:
+                _default_provider = DistanceProvider(RoutesApiBackend(api_key), DistanceCache(cache_path))
+            elif coords_file:
+                _default_provider = DistanceProvider(HaversineBackend.from_csv(coords_file), max_workers=1)
+        return _default_provider
+
+
+def set_default_provider(provider):
+    global _default_provider
+    with _default_lock:
+        _default_provider = provider
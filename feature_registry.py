@@ -0,0 +1,165 @@
+'''
+רישום הפיצ'רים הנגזרים: כל פיצ'ר מצהיר על השם שלו, על עמודות הקלט ועל הנוסחה.
+
+    @derived("room_density", "room_num", "area")
+    def _room_density(out, room_num, area):
+        np.divide(room_num, area, out=out)
+
+הנוסחה מקבלת את עמודת הפלט (out) ואת הקלטים כמערכי float, וכותבת ישירות לתוכה
+(ufunc עם out=) - בלי Series זמני לכל פיצ'ר. FeaturePlan מחשב רשימת פיצ'רים במעבר אחד
+למטריצה אחת שהוקצתה מראש: ב-prepare_data (אימון וחיזוי), ב-chunked_prep ובתוך ה-X של InferencePipeline.
+סדר העמודות הוא סדר הרישום, והוא גם הסדר ב-train_columns.
+
+לניסוי בלי פיצ'ר: prepare_data(df, 'train', features=[...]) או model_training.py --disable-features.
+בחיזוי התוכנית נגזרת מ-train_columns (FeaturePlan.for_columns), כך שמחושב בדיוק מה שהמודל אומן עליו.
+'''
+import numpy as np
+
+DERIVED_FEATURES = {}
+
+
+class DerivedFeature:
+
+    def __init__(self, name, inputs, formula):
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.formula = formula
+
+    def __repr__(self):
+        return f"DerivedFeature({self.name!r}, inputs={self.inputs})"
+
+
+def derived(name, *inputs):
+    def register(formula):
+        DERIVED_FEATURES[name] = DerivedFeature(name, inputs, formula)
+        return formula
+    return register
+
+
+# מספר חדרים למ"ר
+@derived("room_density", "room_num", "area")
+def _room_density(out, room_num, area):
+    np.divide(room_num, area, out=out)
+
+
+# ציון 0–4 שמעיד על כמה הדירה איכותית פונקציונלית
+@derived("luxury_score", "has_parking", "elevator", "has_safe_room", "has_balcony")
+def _luxury_score(out, has_parking, elevator, has_safe_room, has_balcony):
+    np.add(has_parking, elevator, out=out)
+    out += has_safe_room
+    out += has_balcony
+
+
+# דירות עם יותר חדרים על אותו שטח לרוב פחות יוקרתיות – תיתן למודל יכולת להבדיל.
+@derived("room_num_x_area", "room_num", "area")
+def _room_num_x_area(out, room_num, area):
+    np.multiply(room_num, area, out=out)
+
+
+# משקל מרפסת יחסית לגובה – ככל שהדירה גבוהה יותר, לרוב מרפסת חשובה יותר
+@derived("balcony_per_floor", "has_balcony", "floor")
+def _balcony_per_floor(out, has_balcony, floor):
+    np.add(floor, 1, out=out)
+    np.divide(has_balcony, out, out=out)
+
+
+# שילוב של שיפוץ וריהוט – מצביע על מוכנות גבוהה למגורים
+@derived("renovated_furnished", "is_renovated", "is_furnished")
+def _renovated_furnished(out, is_renovated, is_furnished):
+    out[:] = (is_renovated == 1) & (is_furnished == 1)
+
+
+# נכס קטן – מתאים להשכרה ליחידים או זוגות
+@derived("is_mini_property", "area", "room_num")
+def _is_mini_property(out, area, room_num):
+    out[:] = (area < 50) & (room_num <= 2)
+
+
+# שילוב של שטח הדירה עם הארנונה – מייצג עלות כוללת למ"ר
+@derived("area_x_monthly_arnona", "area", "monthly_arnona")
+def _area_x_monthly_arnona(out, area, monthly_arnona):
+    np.multiply(area, monthly_arnona, out=out)
+
+
+# שילוב של קומה עם הארנונה – עשוי לייצג בניינים יוקרתיים יותר
+@derived("floor_x_monthly_arnona", "floor", "monthly_arnona")
+def _floor_x_monthly_arnona(out, floor, monthly_arnona):
+    np.multiply(floor, monthly_arnona, out=out)
+
+
+# בדיקת מיקום מרכזי לנכס
+@derived("central_location", "distance_from_center")
+def _central_location(out, distance_from_center):
+    np.less(distance_from_center, 3000, out=out)
+
+
+# בטוח גם אם area = 0
+@derived("log_area", "area")
+def _log_area(out, area):
+    np.log1p(area, out=out)
+
+
+def _as_float(values):
+    if hasattr(values, "to_numpy"):
+        return values.to_numpy(dtype=float, na_value=np.nan)
+    return np.asarray(values, dtype=float)
+
+
+class FeaturePlan:
+    '''
+    רשימה קבועה של פיצ'רים נגזרים, מחושבת על כל השורות בבת אחת.
+    כל עמודת קלט מומרת ל-float פעם אחת, גם אם כמה פיצ'רים משתמשים בה.
+    '''
+
+    def __init__(self, names=None):
+        names = list(DERIVED_FEATURES) if names is None else list(names)
+        unknown = [name for name in names if name not in DERIVED_FEATURES]
+        if unknown:
+            raise ValueError(f"Unknown derived features: {unknown}")
+        # תמיד בסדר הרישום, כדי שסדר העמודות לא יהיה תלוי בסדר שבו הועברו השמות
+        self.features = [f for name, f in DERIVED_FEATURES.items() if name in set(names)]
+
+    @classmethod
+    def for_columns(cls, columns):
+        '''
+        הפיצ'רים הנגזרים שמופיעים בעמודות האימון (train_columns / feature_columns).
+        '''
+        columns = set(columns)
+        return cls([name for name in DERIVED_FEATURES if name in columns])
+
+    @classmethod
+    def without(cls, disabled):
+        return cls([name for name in DERIVED_FEATURES if name not in set(disabled)])
+
+    @property
+    def names(self):
+        return [f.name for f in self.features]
+
+    @property
+    def inputs(self):
+        return list(dict.fromkeys(i for f in self.features for i in f.inputs))
+
+    def evaluate(self, columns, out=None, positions=None, dtype=np.float64):
+        '''
+        columns - DataFrame או מילון שם -> מערך. מחזירה מטריצה (שורות x פיצ'רים).
+        out/positions - מטריצה קיימת ומספרי העמודות שלה לכל פיצ'ר (ה-X של InferencePipeline),
+        כך שהפיצ'רים נכתבים ישר למקומם הסופי.
+        '''
+        arrays = {name: _as_float(columns[name]) for name in self.inputs}
+        if out is None:
+            n = len(next(iter(arrays.values()))) if arrays else 0
+            # column-major: כל פיצ'ר הוא בלוק רציף בזיכרון
+            out = np.empty((n, len(self.features)), dtype=dtype, order='F')
+            positions = range(len(self.features))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for feature, j in zip(self.features, positions):
+                feature.formula(out[:, j], *[arrays[name] for name in feature.inputs])
+        return out
+
+    def apply(self, df, dtype=np.float64):
+        '''
+        מוסיפה את הפיצ'רים כעמודות ל-df (במקום add_derived_features הידני).
+        '''
+        if self.features:
+            df[self.names] = self.evaluate(df, dtype=dtype)
+        return df
@@ -0,0 +1,118 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from datetime import datetime, timezone
+
+STORE_META = "store.json"
+STORE_INDEX = "index.npy"
+# קבצי ההכנה שנבנו יחד עם המטריצה (encoder, scaler, pipeline וכו') - model_training.py מפרסם אותם
+# יחד עם המודל שאומן על ה-store, ולא לפני
+STORE_ARTIFACTS = "artifacts"
+
+
+def artifacts_directory(directory):
+    return os.path.join(directory, STORE_ARTIFACTS)
+
+
+class FeatureStoreWriter:
+    '''
+    כותבת מטריצת פיצ'רים לתיקייה, עמודה לכל קובץ .npy, בחלקים (chunk אחרי chunk).
+    מספר השורות ידוע מראש, כך שכל קובץ מוקצה פעם אחת ב-open_memmap ונכתב במקומו -
+    בלי להחזיק את כל המטריצה בזיכרון.
+    '''
+
+    def __init__(self, directory, columns, rows, meta=None):
+        self.directory = directory
+        self.columns = list(columns)
+        self.rows = rows
+        self.meta = dict(meta or {})
+        self.offset = 0
+        os.makedirs(directory, exist_ok=True)
+        # קבצי ההכנה של מטריצה קודמת באותה תיקייה כבר לא מתאימים לה
+        shutil.rmtree(artifacts_directory(directory), ignore_errors=True)
+        self._arrays = [np.lib.format.open_memmap(os.path.join(directory, _column_file(i)), mode='w+',
+                                                  dtype=np.float64, shape=(rows,))
+                        for i in range(len(self.columns))]
+
+    def append(self, df):
+        n = len(df)
+        if self.offset + n > self.rows:
+            raise ValueError(f"Feature store expects {self.rows} rows, got at least {self.offset + n}")
+        for array, column in zip(self._arrays, self.columns):
+            array[self.offset:self.offset + n] = df[column].to_numpy(dtype=np.float64)
+        self.offset += n
+
+    def close(self):
+        if self.offset != self.rows:
+            raise ValueError(f"Feature store expects {self.rows} rows, got {self.offset}")
+        for array in self._arrays:
+            array.flush()
+        self._arrays = []
+        meta = dict(self.meta, columns=self.columns, rows=self.rows,
+                    created_at=datetime.now(timezone.utc).isoformat(timespec="seconds"))
+        with open(os.path.join(self.directory, STORE_META), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2, ensure_ascii=False)
+        return FeatureStore.open(self.directory)
+
+
+class FeatureStore:
+    '''
+    מטריצת פיצ'רים שמורה (FeatureStoreWriter), נטענת ב-mmap - עמודה נקראת מהדיסק רק כשניגשים אליה.
+    '''
+
+    def __init__(self, directory, meta, arrays, index=None):
+        self.directory = directory
+        self.meta = meta
+        self.columns = list(meta["columns"])
+        self.rows = meta["rows"]
+        self.index = index
+        self._arrays = dict(zip(self.columns, arrays))
+
+    @classmethod
+    def open(cls, directory, mmap_mode='r'):
+        with open(os.path.join(directory, STORE_META), encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = [np.load(os.path.join(directory, _column_file(i)), mmap_mode=mmap_mode)
+                  for i in range(len(meta["columns"]))]
+        index_path = os.path.join(directory, STORE_INDEX)
+        index = np.load(index_path) if os.path.exists(index_path) else None
+        return cls(directory, meta, arrays, index)
+
+    @classmethod
+    def write(cls, directory, df, meta=None):
+        '''
+        שומרת DataFrame מספרי שלם (למשל הפלט של prepare_data) כולל האינדקס שלו.
+        '''
+        writer = FeatureStoreWriter(directory, df.columns, len(df), meta)
+        writer.append(df)
+        np.save(os.path.join(directory, STORE_INDEX), df.index.to_numpy())
+        return writer.close()
+
+    def column(self, name):
+        return self._arrays[name]
+
+    def matrix(self, columns=None, start=0, stop=None):
+        columns = self.columns if columns is None else list(columns)
+        return np.column_stack([self._arrays[c][start:stop] for c in columns])
+
+    def to_frame(self, columns=None):
+        '''
+        DataFrame רגיל בזיכרון - העמודות מועתקות מהקבצים.
+        כדי לקרוא רק חלק מהשורות או מהעמודות: matrix / iter_batches.
+        '''
+        columns = self.columns if columns is None else list(columns)
+        return pd.DataFrame({c: np.asarray(self._arrays[c]) for c in columns}, columns=columns, index=self.index)
+
+    def iter_batches(self, batch_size, columns=None):
+        '''
+        מחזירה מטריצות של עד batch_size שורות, לפי הסדר.
+        '''
+        for start in range(0, self.rows, batch_size):
+            yield self.matrix(columns, start, min(start + batch_size, self.rows))
+
+
+def _column_file(i):
+    # שמות העמודות כוללים עברית ו-'/' (property_type_סטודיו/לופט) - הקבצים ממוספרים
+    return f"{i:03d}.npy"
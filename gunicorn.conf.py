@@ -0,0 +1,31 @@
+'''
+הגדרות gunicorn לשרת החיזוי:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+כל ערך ניתן לשינוי במשתנה סביבה (בקונטיינר), למשל WEB_CONCURRENCY=8 GUNICORN_THREADS=4.
+
+preload_app טוען את המודל בתהליך האב לפני ה-fork, כך שהזיכרון שלו משותף בין ה-workers
+(copy-on-write) וה-workers עולים מוכנים. מודל חדש: kill -HUP לתהליך האב - ה-workers מוחלפים
+בהדרגה, וכל worker חדש טוען את הגרסה מה-manifest אם היא שונה מזו שנטענה באב (post_worker_init).
+'''
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# gthread: כמה threads לכל worker - בקשות קלות (/healthz, מטמון) לא ממתינות מאחורי חיזוי איטי
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+# worker מוחלף אחרי מספר בקשות, כדי שזיכרון שדולף (אם בכלל) לא יצטבר
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+accesslog = "-"
+
+
+def post_worker_init(worker):
+    worker.wsgi.extensions["serving"].registry.reload_if_changed()
@@ -0,0 +1,291 @@
+import bisect
+import pickle
+import numpy as np
+
+
+def _median_of_sorted(values):
+    n = len(values)
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2
+
+
+def _is_null(val):
+    return val is None or (isinstance(val, float) and val != val)
+
+
+def _notnull_mask(values):
+    return np.array([not _is_null(v) for v in values], dtype=bool)
+
+
+class PeerMedian:
+    '''
+    שלב בשרשרת ההשלמה: חציון של "עמיתים" - דירות באותה קבוצה (למשל אותה שכונה),
+    ואם הוגדר חלון - רק דירות ששטחן בטווח סביב שטח הדירה:
+      area_window=5      -> area-5 <= area <= area+5
+      area_ratio=0.1     -> area*0.9 <= area <= area*1.1
+      area_window=0      -> אותו שטח בדיוק
+    group=None -> כלל הדאטה.
+    '''
+
+    def __init__(self, group=None, area_window=None, area_ratio=None):
+        self.group = group
+        self.area_window = area_window
+        self.area_ratio = area_ratio
+        self.index = {}
+
+    @property
+    def windowed(self):
+        return self.area_window is not None or self.area_ratio is not None
+
+    def bounds(self, area):
+        if self.area_ratio is not None:
+            return area * (1 - self.area_ratio), area * (1 + self.area_ratio)
+        return area - self.area_window, area + self.area_window
+
+    def build(self, groups, areas, values, peer_mask):
+        '''
+        לכל קבוצה: רשימת שטחים ממוינת וערכים מקבילים (לשלב עם חלון),
+        או רשימת ערכים ממוינת (בלי חלון).
+        '''
+        self.index = {}
+        return self.merge(groups, areas, values, peer_mask)
+
+    def merge(self, groups, areas, values, peer_mask):
+        '''
+        מוסיפה שורות לאינדקס הקיים, כאילו נבנה מחדש על השורות הקודמות ואחריהן החדשות: השורות החדשות
+        של כל קבוצה ממוינות וממוזגות לרשימות הקיימות ב-searchsorted, בלי למיין שוב את כל ההיסטוריה.
+        '''
+        mask = peer_mask & _notnull_mask(groups)
+        if self.windowed:
+            mask &= ~np.isnan(areas)
+        rows = np.flatnonzero(mask)
+        rows = rows[np.argsort(areas[rows] if self.windowed else values[rows], kind='stable')]
+        added = {}
+        for group, area, value in zip(groups[rows].tolist(), areas[rows].tolist(), values[rows].tolist()):
+            keys, vals = added.setdefault(group, ([], []))
+            keys.append(area)
+            vals.append(value)
+        for group, (keys, vals) in added.items():
+            entry = self.index.get(group)
+            if entry is None:
+                self.index[group] = (keys, vals)
+                continue
+            # side='right' - שורה חדשה נכנסת אחרי הקיימות עם אותו מפתח, כמו במיון יציב של כל השורות
+            old_keys, old_vals = np.asarray(entry[0], dtype=float), np.asarray(entry[1], dtype=float)
+            positions = (np.searchsorted(old_keys, keys, side='right') if self.windowed
+                         else np.searchsorted(old_vals, vals, side='right'))
+            self.index[group] = (np.insert(old_keys, positions, keys).tolist(),
+                                 np.insert(old_vals, positions, vals).tolist())
+        return self
+
+    def lookup(self, group, area):
+        if _is_null(group) or (self.windowed and np.isnan(area)):
+            return np.nan
+        entry = self.index.get(group)
+        if entry is None:
+            return np.nan
+        keys, values = entry
+        if not self.windowed:
+            return _median_of_sorted(values) if values else np.nan
+        low, high = self.bounds(area)
+        lo = bisect.bisect_left(keys, low)
+        hi = bisect.bisect_right(keys, high)
+        if hi <= lo:
+            return np.nan
+        return _median_of_sorted(sorted(values[lo:hi]))
+
+    def params(self):
+        return {"group": self.group, "area_window": self.area_window, "area_ratio": self.area_ratio}
+
+    def to_arrays(self):
+        '''
+        האינדקס כמערכים, לשמירה בלי pickle (linear_scorer): הקבוצות, offsets, שטחים וערכים רצופים.
+        '''
+        groups = list(self.index)
+        sizes = [len(self.index[group][1]) for group in groups]
+        return {
+            "groups": np.array([str(group) for group in groups], dtype=str),
+            "offsets": np.cumsum([0] + sizes),
+            "keys": np.array([k for group in groups for k in self.index[group][0]], dtype=float),
+            "values": np.array([v for group in groups for v in self.index[group][1]], dtype=float),
+        }
+
+    @classmethod
+    def from_arrays(cls, params, arrays):
+        rule = cls(**params)
+        offsets = arrays["offsets"].tolist()
+        keys, values = arrays["keys"].tolist(), arrays["values"].tolist()
+        for i, group in enumerate(arrays["groups"].tolist()):
+            # בלי group כל הדאטה היא קבוצה אחת עם המפתח 0 (כמו ב-PeerIndex.lookup)
+            rule.index[group if rule.group is not None else 0] = (keys[offsets[i]:offsets[i + 1]],
+                                                                  values[offsets[i]:offsets[i + 1]])
+        return rule
+
+    def insert(self, group, area, value):
+        if _is_null(group) or (self.windowed and np.isnan(area)):
+            return
+        keys, values = self.index.setdefault(group, ([], []))
+        if self.windowed:
+            pos = bisect.bisect_right(keys, area)
+            keys.insert(pos, area)
+            values.insert(pos, value)
+        else:
+            bisect.insort(values, value)
+
+
+class ColumnMedian:
+    '''
+    שלב אחרון בשרשרת: חציון כל העמודה כפי שהיא ברגע ההשלמה (כמו df[col].median() בתוך לולאה),
+    כולל ערכים חריגים וערכים שכבר הושלמו.
+    '''
+
+    def build(self, values):
+        self.values = sorted(values[~np.isnan(values)].tolist())
+        return self
+
+    def lookup(self, group=None, area=None):
+        return _median_of_sorted(self.values) if self.values else np.nan
+
+    def replace(self, old, new):
+        if not np.isnan(old):
+            del self.values[bisect.bisect_left(self.values, old)]
+        if not np.isnan(new):
+            bisect.insort(self.values, new)
+
+
+class Constant:
+    '''
+    שלב בשרשרת ההשלמה: ערך קבוע לשורות שעומדות בתנאי (where - מסכה בוליאנית על כל השורות).
+    '''
+
+    def __init__(self, value, where):
+        self.value = value
+        self.where = np.asarray(where, dtype=bool)
+
+
+class PeerIndex:
+    '''
+    שרשרת שלבי PeerMedian שנבנתה פעם אחת על אוכלוסיית האימון ונשמרת לדיסק,
+    כדי שבזמן החיזוי אפשר יהיה להשלים ערך לפי סטטיסטיקות האימון ולא לפי DataFrame של שורה אחת.
+    valid_range - טווח הערכים התקינים; ערך מחוץ לטווח נחשב חריג ומוחלף.
+    '''
+
+    def __init__(self, rules, valid_range=None):
+        self.rules = rules
+        self.valid_range = valid_range
+
+    @classmethod
+    def build(cls, rules, columns, values, peer_mask, valid_range=None):
+        '''
+        columns - מילון של עמודות הקבוצה ועמודת השטח ('area') כמערכים.
+        '''
+        for rule in rules:
+            rule.index = {}
+        return cls(rules, valid_range).merge(columns, values, peer_mask)
+
+    def merge(self, columns, values, peer_mask):
+        '''
+        מוסיפה שורות לכל השלבים (PeerMedian.merge) - אותו אינדקס כמו build על כל השורות יחד.
+        '''
+        areas = np.asarray(columns['area'], dtype=float)
+        values = np.asarray(values, dtype=float)
+        for rule in self.rules:
+            groups = (np.asarray(columns[rule.group], dtype=object) if rule.group is not None
+                      else np.zeros(len(values), dtype=object))
+            rule.merge(groups, areas, values, peer_mask)
+        return self
+
+    def lookup(self, row):
+        '''
+        row - מילון עם ערכי הקבוצה והשטח של דירה אחת.
+        '''
+        for rule in self.rules:
+            value = rule.lookup(row.get(rule.group, 0) if rule.group is not None else 0, row.get('area', np.nan))
+            if not np.isnan(value):
+                return value
+        return np.nan
+
+    def fill(self, values, columns, targets):
+        '''
+        מחליפה את השורות המסומנות ב-targets בחציון העמיתים מהאימון (NaN אם אין). מחזירה מערך חדש.
+        '''
+        values = np.array(values, dtype=float)
+        for i in np.flatnonzero(np.asarray(targets, dtype=bool)):
+            row = {name: column[i] for name, column in columns.items()}
+            values[i] = self.lookup(row)
+        return values
+
+    def fix_outliers(self, values, columns):
+        '''
+        מחליפה ערכים מחוץ ל-valid_range בחציון העמיתים מהאימון. מחזירה מערך חדש.
+        '''
+        values = np.asarray(values, dtype=float)
+        low, high = self.valid_range
+        return self.fill(values, columns, (values < low) | (values > high))
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    def to_arrays(self):
+        '''
+        (params, arrays): ההגדרות כ-JSON והאינדקס של כל שלב כמערכים ("<שלב>_<שם>").
+        '''
+        params = {"valid_range": list(self.valid_range) if self.valid_range is not None else None,
+                  "rules": [rule.params() for rule in self.rules]}
+        arrays = {f"{i}_{name}": values for i, rule in enumerate(self.rules)
+                  for name, values in rule.to_arrays().items()}
+        return params, arrays
+
+    @classmethod
+    def from_arrays(cls, params, arrays):
+        rules = [PeerMedian.from_arrays(rule, {name: arrays[f"{i}_{name}"]
+                                               for name in ("groups", "offsets", "keys", "values")})
+                 for i, rule in enumerate(params["rules"])]
+        valid_range = tuple(params["valid_range"]) if params["valid_range"] is not None else None
+        return cls(rules, valid_range)
+
+
+def impute_with_fallbacks(df, col, targets, rules, is_peer, default=np.nan, area_col='area'):
+    '''
+    משלימה את השורות המסומנות ב-targets לפי שרשרת rules - השלב הראשון שמחזיר ערך קובע.
+    is_peer - פונקציה וקטורית שמחליטה אילו ערכים משמשים כעמיתים (למשל ערך חיובי).
+    השורות מושלמות לפי סדרן, וערך שהושלם מצטרף לעמיתים של השורות הבאות,
+    בדיוק כמו בלולאות המקוריות שכתבו חזרה ל-df תוך כדי ריצה.
+    מחזירה מערך חדש של העמודה.
+    '''
+    values = df[col].to_numpy(dtype=float, copy=True)
+    areas = df[area_col].to_numpy(dtype=float) if area_col in df.columns else np.full(len(df), np.nan)
+    peer_mask = is_peer(values)
+    group_values = {None: np.zeros(len(df), dtype=object)}
+    peer_rules = [rule for rule in rules if isinstance(rule, PeerMedian)]
+    column_rules = [rule for rule in rules if isinstance(rule, ColumnMedian)]
+    for rule in peer_rules:
+        if rule.group not in group_values:
+            group_values[rule.group] = df[rule.group].to_numpy(dtype=object)
+        rule.build(group_values[rule.group], areas, values, peer_mask)
+    for rule in column_rules:
+        rule.build(values)
+
+    for i in np.flatnonzero(np.asarray(targets, dtype=bool)):
+        value = np.nan
+        for rule in rules:
+            if isinstance(rule, Constant):
+                value = rule.value if rule.where[i] else np.nan
+            elif isinstance(rule, ColumnMedian):
+                value = rule.lookup()
+            else:
+                value = rule.lookup(group_values[rule.group][i], areas[i])
+            if not np.isnan(value):
+                break
+        else:
+            value = default
+        for rule in column_rules:
+            rule.replace(values[i], value)
+        values[i] = value
+        if is_peer(np.float64(value)):
+            for rule in peer_rules:
+                rule.insert(group_values[rule.group][i], areas[i], value)
+
+    return values
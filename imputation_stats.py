@@ -0,0 +1,316 @@
+'''
+טבלאות הסטטיסטיקה של ההשלמות, מחושבות פעם אחת על אוכלוסיית האימון ונשמרות ל-imputation_stats.npz:
+    BucketMedians  - חציון לשכונה x דלי שטח (ברוחב AREA_BUCKET מ"ר), עם חציון השכונה והחציון הכללי
+                     כגיבוי - לחדרים, ארנונה, ועד בית ושטח גינה
+    StreetMedians  - חציון קומה ומספר קומות לרחוב
+    address_modes  - הכתובת השכיחה בכל שכונה, ו-default_address כשהשכונה לא מוכרת
+
+בזמן החיזוי (InferencePipeline ו-prepare_data(dataset_type='test')) ההשלמה היא חיפוש בטבלה - קוד השכונה
+ממילון ומספר הדלי בחלוקה - במקום חציון או שכיח על DataFrame של שורה אחת, שאין בו עמיתים.
+BucketMedians.fill מקבל את אותם פרמטרים כמו PeerIndex.fill, כך שאפשר להעביר אותו ל-fix_room_num,
+process_garden_area ו-process_tax_col במקום האינדקס.
+'''
+import json
+import numpy as np
+
+STATS_FILE = "imputation_stats.npz"
+AREA_BUCKET = 10
+MAX_AREA = 500
+BUCKET_COLUMNS = ['room_num', 'monthly_arnona', 'building_tax', 'garden_area']
+FLOOR_COLUMNS = ['floor', 'total_floors']
+
+
+def _keys(values):
+    return np.array([v if isinstance(v, str) else "" for v in values], dtype=str)
+
+
+def _codes(keys, values):
+    # מיקום כל ערך במערך הממוין keys, או -1 אם לא הופיע באימון (כמו CategoryEncoder.codes)
+    values = _keys(values)
+    if not len(keys) or not len(values):
+        return np.full(len(values), -1)
+    positions = np.minimum(np.searchsorted(keys, values), len(keys) - 1)
+    return np.where(keys[positions] == values, positions, -1)
+
+
+def _label_codes(values):
+    '''
+    (labels, codes) של עמודת טקסט: התוויות הייחודיות וקוד לכל שורה, -1 לערך שאינו מחרוזת.
+    '''
+    keys = _keys(values)
+    labels, codes = np.unique(keys, return_inverse=True)
+    return labels, np.where(keys != "", codes.reshape(-1), -1)
+
+
+def _group_codes(labels, codes, mask):
+    '''
+    (groups, group_codes, mask): התוויות שמופיעות בשורות mask (ממוינות), המיקום של כל שורה כזו
+    ב-groups, וה-mask בלי השורות שאין להן תווית. labels - התווית של כל קוד, codes - -1 לחסר.
+    '''
+    labels = _keys(labels)
+    codes = np.asarray(codes)
+    mask = np.asarray(mask, dtype=bool) & (codes >= 0)
+    mask[mask] = labels[codes[mask]] != ""
+    used = np.unique(codes[mask])
+    groups, positions = np.unique(labels[used], return_inverse=True)
+    remap = np.full(len(labels), -1)
+    remap[used] = positions.reshape(-1)
+    return groups, remap[codes[mask]], mask
+
+
+class KeyIndex:
+    '''
+    מפתח -> מיקום במערך keys, במילון שנבנה בשימוש הראשון: קוד לשורה בודדת ב-O(1) בלי המרה למערך מחרוזות.
+    '''
+
+    def __init__(self, keys):
+        self.keys = keys
+        self._positions = None
+
+    def codes(self, values):
+        positions = self._positions
+        if positions is None:
+            positions = self._positions = {key: i for i, key in enumerate(self.keys.tolist())}
+        return np.array([positions.get(v, -1) if isinstance(v, str) else -1 for v in values], dtype=int)
+
+
+def _sorted_medians(codes, values, size):
+    '''
+    חציון לכל קוד בטווח [0, size) - מיון אחד לפי (קוד, ערך) ואז האיבר/ים האמצעיים של כל קטע.
+    '''
+    medians = np.full(size, np.nan)
+    if not len(values):
+        return medians
+    order = np.lexsort((values, codes))
+    codes, values = codes[order], values[order]
+    unique, starts, counts = np.unique(codes, return_index=True, return_counts=True)
+    medians[unique] = (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2
+    return medians
+
+
+class BucketMedians:
+    '''
+    חציוני עמודה אחת: medians[שכונה, דלי], group_medians[שכונה] ו-overall.
+    הדלי של שטח a הוא a // bucket_width; שטח מעל MAX_AREA נכנס לדלי האחרון.
+    '''
+
+    def __init__(self, groups, medians, group_medians, overall, bucket_width=AREA_BUCKET):
+        self.groups = groups
+        self.group_index = KeyIndex(groups)
+        self.medians = medians
+        self.group_medians = group_medians
+        self.overall = float(overall)
+        self.bucket_width = bucket_width
+
+    @classmethod
+    def build(cls, neighborhoods, areas, values, peer_mask, bucket_width=AREA_BUCKET):
+        '''
+        peer_mask - הערכים שמשמשים כעמיתים (למשל ערך חיובי), כמו ב-PeerIndex.build.
+        '''
+        labels, codes = _label_codes(neighborhoods)
+        return cls.from_codes(labels, codes, areas, values, peer_mask, bucket_width)
+
+    @classmethod
+    def from_codes(cls, labels, codes, areas, values, peer_mask, bucket_width=AREA_BUCKET):
+        '''
+        כמו build, עם קוד שכונה לכל שורה (-1 לחסר) ו-labels - שם השכונה של כל קוד.
+        '''
+        values = np.asarray(values, dtype=float)
+        areas = np.asarray(areas, dtype=float)
+        groups, codes, mask = _group_codes(labels, codes, np.asarray(peer_mask, dtype=bool) & ~np.isnan(values))
+        values, areas = values[mask], areas[mask]
+
+        n_buckets = MAX_AREA // bucket_width + 1
+        with_area = ~np.isnan(areas)
+        buckets = np.clip(areas[with_area] // bucket_width, 0, n_buckets - 1).astype(int)
+        cells = _sorted_medians(codes[with_area] * n_buckets + buckets, values[with_area], len(groups) * n_buckets)
+        overall = _sorted_medians(np.zeros(len(values), dtype=int), values, 1)[0]
+        return cls(groups, cells.reshape(len(groups), n_buckets), _sorted_medians(codes, values, len(groups)),
+                   overall, bucket_width)
+
+    def lookup(self, neighborhoods, areas):
+        '''
+        חציון לכל שורה: התא של השכונה והדלי, אחרת חציון השכונה, אחרת החציון הכללי.
+        '''
+        codes = self.group_index.codes(neighborhoods)
+        areas = np.asarray(areas, dtype=float)
+        result = np.full(len(codes), self.overall)
+        known = codes >= 0
+        result[known] = self.group_medians[codes[known]]
+        cell = known & ~np.isnan(areas)
+        if cell.any():
+            buckets = np.clip(areas[cell] // self.bucket_width, 0, self.medians.shape[1] - 1).astype(int)
+            medians = self.medians[codes[cell], buckets]
+            result[cell] = np.where(np.isnan(medians), result[cell], medians)
+        return result
+
+    def fill(self, values, columns, targets):
+        '''
+        כמו PeerIndex.fill: מחליפה את השורות המסומנות ב-targets בערך מהטבלה. מחזירה מערך חדש.
+        '''
+        values = np.array(values, dtype=float)
+        rows = np.flatnonzero(targets)
+        if len(rows):
+            neighborhoods = columns['neighborhood']
+            values[rows] = self.lookup([neighborhoods[i] for i in rows], np.asarray(columns['area'], dtype=float)[rows])
+        return values
+
+    def to_arrays(self):
+        return {"groups": self.groups, "medians": self.medians, "group_medians": self.group_medians,
+                "overall": np.array(self.overall), "bucket_width": np.array(self.bucket_width)}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays["groups"], arrays["medians"], arrays["group_medians"], float(arrays["overall"]),
+                   int(arrays["bucket_width"]))
+
+
+class StreetMedians:
+    '''
+    חציון קומה ומספר קומות לכל רחוב: streets ממוין ומערך חציונים מקביל לכל עמודה.
+    '''
+
+    def __init__(self, streets, medians):
+        self.streets = streets
+        self.street_index = KeyIndex(streets)
+        self.medians = medians
+
+    @classmethod
+    def build(cls, streets, columns):
+        labels, codes = _label_codes(streets)
+        return cls.from_codes(labels, codes, columns)
+
+    @classmethod
+    def from_codes(cls, labels, codes, columns):
+        names, codes, known = _group_codes(labels, codes, np.ones(len(codes), dtype=bool))
+        medians = {}
+        for col in FLOOR_COLUMNS:
+            values = np.asarray(columns[col], dtype=float)[known]
+            has_value = ~np.isnan(values)
+            medians[col] = _sorted_medians(codes[has_value], values[has_value], len(names))
+        return cls(names, medians)
+
+    def lookup(self, streets, col):
+        codes = self.street_index.codes(streets)
+        return np.where(codes >= 0, self.medians[col][np.maximum(codes, 0)], np.nan)
+
+    def to_dict(self):
+        # המבנה ש-process_floors מקבל (street_medians): עמודה -> {רחוב: חציון}
+        return {col: {street: value for street, value in zip(self.streets.tolist(), medians.tolist())
+                      if not np.isnan(value)}
+                for col, medians in self.medians.items()}
+
+
+class ImputationStats:
+    '''
+    כל טבלאות ההשלמה של גרסת מודל אחת.
+    '''
+
+    def __init__(self, tables, street_medians, mode_neighborhoods, mode_addresses, default_address):
+        self.tables = tables
+        self.street_medians = street_medians
+        self.mode_neighborhoods = mode_neighborhoods
+        self.mode_index = KeyIndex(mode_neighborhoods)
+        self.mode_addresses = mode_addresses
+        self.default_address = default_address
+
+    @classmethod
+    def build(cls, df):
+        '''
+        df - דאטת האימון אחרי ההשלמות והסינונים של prepare_data (עמודות neighborhood ו-address כטקסט).
+        '''
+        neighborhood_labels, neighborhood_codes = _label_codes(df['neighborhood'].to_numpy(dtype=object))
+        address_labels, address_codes = _label_codes(df['address'].to_numpy(dtype=object))
+        columns = {col: df[col].to_numpy(dtype=float) for col in ['area'] + BUCKET_COLUMNS + FLOOR_COLUMNS}
+        return cls.from_codes(neighborhood_labels, neighborhood_codes, address_labels, address_codes, columns)
+
+    @classmethod
+    def from_codes(cls, neighborhood_labels, neighborhood_codes, address_labels, address_codes, columns):
+        '''
+        כמו build, מקודים שלמים לשכונה ולכתובת (-1 לחסר) עם התוויות שלהם ומערכים של העמודות המספריות -
+        בלי מחרוזת לכל שורה (chunked_prep).
+        '''
+        areas = np.asarray(columns['area'], dtype=float)
+        peers = {
+            'room_num': lambda v: v > 0,
+            'monthly_arnona': lambda v: v > 0,
+            'building_tax': lambda v: v > 0,
+            'garden_area': lambda v: ~np.isnan(v),
+        }
+        tables = {}
+        for col in BUCKET_COLUMNS:
+            values = np.asarray(columns[col], dtype=float)
+            tables[col] = BucketMedians.from_codes(neighborhood_labels, neighborhood_codes, areas, values,
+                                                   peers[col](values))
+        street_medians = StreetMedians.from_codes(address_labels, address_codes, columns)
+
+        # הכתובת השכיחה - בתיקו הקטנה ביותר, כמו Series.mode().iloc[0] ב-fill_missing_address_by_neighborhood
+        addresses, codes, known = _group_codes(address_labels, address_codes, np.ones(len(address_codes), dtype=bool))
+        counts = np.bincount(codes, minlength=len(addresses))
+        default_address = str(addresses[np.argmax(counts)]) if len(addresses) else ""
+        row_addresses = np.full(len(known), -1)
+        row_addresses[known] = codes
+        neighborhoods, codes, paired = _group_codes(neighborhood_labels, neighborhood_codes, known)
+        pairs, pair_counts = np.unique(codes * len(addresses) + row_addresses[paired], return_counts=True)
+        pair_neighborhoods, pair_addresses = np.divmod(pairs, max(len(addresses), 1))
+        order = np.lexsort((pair_addresses, -pair_counts, pair_neighborhoods))
+        first = order[np.r_[True, np.diff(pair_neighborhoods[order]) != 0]] if len(order) else order
+        return cls(tables, street_medians, _keys(neighborhoods[pair_neighborhoods[first]].tolist()),
+                   _keys(addresses[pair_addresses[first]].tolist()), default_address)
+
+    def address_modes(self):
+        return dict(zip(self.mode_neighborhoods.tolist(), self.mode_addresses.tolist()))
+
+    def modal_addresses(self, neighborhoods):
+        '''
+        הכתובת השכיחה בשכונה של כל שורה, או default_address.
+        '''
+        codes = self.mode_index.codes(neighborhoods)
+        result = np.full(len(codes), self.default_address, dtype=object)
+        known = codes >= 0
+        result[known] = self.mode_addresses[codes[known]]
+        return result
+
+    def to_arrays(self):
+        '''
+        (meta, arrays): ההגדרות כ-JSON וכל הטבלאות כמערכים ("<עמודה>_<שם>"), בלי pickle.
+        '''
+        arrays = {f"{col}_{name}": values for col, table in self.tables.items()
+                  for name, values in table.to_arrays().items()}
+        arrays["street_names"] = self.street_medians.streets
+        arrays.update({f"street_{col}": medians for col, medians in self.street_medians.medians.items()})
+        arrays["mode_neighborhoods"] = self.mode_neighborhoods
+        arrays["mode_addresses"] = self.mode_addresses
+        meta = {"columns": list(self.tables), "default_address": self.default_address}
+        return meta, arrays
+
+    @classmethod
+    def from_arrays(cls, meta, arrays):
+        tables = {col: BucketMedians.from_arrays({name: arrays[f"{col}_{name}"] for name in
+                                                  ("groups", "medians", "group_medians", "overall", "bucket_width")})
+                  for col in meta["columns"]}
+        street_medians = StreetMedians(arrays["street_names"], {col: arrays[f"street_{col}"] for col in FLOOR_COLUMNS})
+        return cls(tables, street_medians, arrays["mode_neighborhoods"], arrays["mode_addresses"],
+                   meta["default_address"])
+
+    def save(self, path=STATS_FILE):
+        meta, arrays = self.to_arrays()
+        with open(path, "wb") as f:
+            np.savez(f, meta=np.array(json.dumps(meta, ensure_ascii=False)), **arrays)
+
+    @classmethod
+    def load(cls, path=STATS_FILE):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            arrays = {name: data[name] for name in data.files if name != "meta"}
+        return cls.from_arrays(meta, arrays)
+
+
+def load_imputation_stats(path=STATS_FILE):
+    '''
+    None אם אין קובץ (מודל שאומן לפני שהטבלאות נשמרו) - ואז ההשלמה נשארת כמו קודם.
+    '''
+    try:
+        return ImputationStats.load(path)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,380 @@
+'''
+הכנה מצטברת: דירות חדשות עוברות את אותם שלבים כמו ב-chunked_prep, בלי לעבור שוב על כל ההיסטוריה.
+
+    python incremental_prep.py init train.csv --output feature_store      # הכנה מלאה + prep_state.pkl
+    python incremental_prep.py add new.csv --output delta_store --update-artifacts
+    python model_training.py --incremental --store delta_store --warm-start
+
+PrepState מחזיק את הסטטיסטיקות הקבוצתיות במבנים שמתעדכנים:
+- SortedGroups - מערך ממוין לכל קבוצה: קומות לרחוב, מרחק לשכונה, המחירים (לאחוזונים).
+  ערכים חדשים ממוזגים ב-searchsorted, והחציון מדויק - לא קירוב.
+- סכום ומספר המחירים לכל שכונה/כתובת וספירת השכונות בכל כתובת (target encoding מוחלק),
+  וספירת הכתובות בכל שכונה (הכתובת השכיחה).
+- אינדקסי ההשלמה (PeerIndex) עצמם: הערכים החדשים של כל קבוצה ממוזגים לרשימות הממוינות
+  ב-searchsorted (PeerIndex.merge), כמו ב-SortedGroups, וחציוני החדרים והמסים ב-SortedGroups.
+  השורות של מעבר 1 לא נשמרות, ועדכון לא עובר שוב על כל ההיסטוריה.
+ה-OneHotEncoder וה-scaler נשארים מההכנה המלאה, כך שהשורות החדשות נכנסות לאותו מרחב פיצ'רים.
+שורות ישנות לא מוכנות מחדש: שורה שהכתובת שלה הושלמה מהכתובת השכיחה נשארת עם ההשלמה של אז,
+ולכן ממוצע הכתובת יכול להיות שונה מעט מהכנה מלאה - השכונות שהכתובת השכיחה שלהן התחלפה מסומנות.
+
+כל עדכון מחזיר ShiftReport: אילו קבוצות זזו מעבר ל-tolerance (שינוי יחסי) ואילו שורות שכבר הוכנו
+(לפי מיקומן ב-FeatureStore) תלויות בהן ולכן צריך להכין אותן מחדש, או להריץ הכנה מלאה.
+'''
+import os
+import sys
+import json
+import pickle
+import argparse
+from collections import Counter
+import numpy as np
+import pandas as pd
+from feature_store import FeatureStore, artifacts_directory
+from category_encoder import CategoryEncoder, save_category_means
+from inference_pipeline import InferencePipeline
+from distance_provider import load_distance_table
+from target_encoding import smoothed_category_means
+from chunked_prep import (TAX_COLS, new_codes, TrainingStatistics, scan_chunk, collect_parts, statistics_from_parts,
+                          peer_statistics, merge_peer_statistics, fill_final_addresses, clean_chunk, encode_chunk,
+                          prepare_data_chunked)
+
+STATE_FILE = "prep_state.pkl"
+TARGET_COLS = ['neighborhood', 'address']
+# האינדקסים מ-peer_statistics שנשמרים ב-PrepState וממוזגים בכל עדכון
+PEER_INDEXES = ['room_index', 'garden_index', 'tax_indexes', 'arnona_index']
+
+
+class SortedGroups:
+    '''
+    מערך ממוין של ערכים לכל מפתח. ערכים חסרים לא נשמרים (כמו ב-groupby().median()).
+    '''
+
+    def __init__(self):
+        self.groups = {}
+
+    def add(self, keys, values):
+        '''
+        ממזגת ערכים חדשים ומחזירה את קבוצת המפתחות שהשתנו.
+        '''
+        frame = pd.DataFrame({'key': np.asarray(keys, dtype=object), 'value': np.asarray(values, dtype=float)})
+        frame = frame.dropna()
+        for key, values in frame.groupby('key')['value']:
+            new = np.sort(values.to_numpy())
+            old = self.groups.get(key)
+            self.groups[key] = new if old is None else np.insert(old, np.searchsorted(old, new), new)
+        return set(frame['key'])
+
+    def median(self, key):
+        return float(np.median(self.groups[key]))
+
+    def quantile(self, key, q):
+        # ברירת המחדל של np.quantile (linear) - כמו Series.quantile
+        return float(np.quantile(self.groups[key], q))
+
+    def std(self, key):
+        values = self.groups[key]
+        return float(np.std(values, ddof=1)) if len(values) > 1 else np.nan
+
+    def medians(self):
+        return {key: self.median(key) for key in self.groups}
+
+
+class GroupedMeans:
+    '''
+    סכום ומספר לכל מפתח - עדכון מדויק של ה-target encoding בלי לשמור את המחירים עצמם.
+    '''
+
+    def __init__(self):
+        self.sums = {}
+        self.counts = {}
+
+    def add(self, keys, values):
+        frame = pd.DataFrame({'key': np.asarray(keys, dtype=object), 'value': np.asarray(values, dtype=float)})
+        grouped = frame.groupby('key')['value']
+        for key, total in grouped.sum().items():
+            self.sums[key] = self.sums.get(key, 0.0) + total
+        for key, count in grouped.count().items():
+            self.counts[key] = self.counts.get(key, 0) + int(count)
+
+
+class ShiftReport:
+    '''
+    shifted - לכל סטטיסטיקה, המפתחות שזזו. stale_rows - מיקומי השורות שהוכנו לפני העדכון ותלויות בהם.
+    '''
+
+    def __init__(self, shifted, stale_rows, price_bounds_shifted, new_property_types, rows_added):
+        self.shifted = shifted
+        self.stale_rows = stale_rows
+        self.price_bounds_shifted = price_bounds_shifted
+        self.new_property_types = new_property_types
+        self.rows_added = rows_added
+
+    @property
+    def needs_full_prepare(self):
+        # גבולות המחיר או קטגוריה חדשה משנים את כל הדאטה / את העמודות - לא רק קבוצה אחת
+        return self.price_bounds_shifted or bool(self.new_property_types)
+
+    def to_dict(self):
+        return {
+            "rows_added": self.rows_added,
+            "shifted": {name: sorted(map(str, keys)) for name, keys in self.shifted.items()},
+            "stale_rows": len(self.stale_rows),
+            "price_bounds_shifted": self.price_bounds_shifted,
+            "new_property_types": sorted(self.new_property_types),
+            "needs_full_prepare": self.needs_full_prepare,
+        }
+
+
+def _counter_mode(counts):
+    # כמו _mode ב-chunked_prep: הערך השכיח, ובתיקו - הקטן ביותר
+    top = max(counts.values())
+    return min(key for key, count in counts.items() if count == top)
+
+
+def _decode(part, codes, columns):
+    part = part.copy()
+    for col in columns:
+        part[col] = codes[col].decode(part[col].to_numpy())
+    return part
+
+
+def _relative_shift(before, after, tolerance):
+    '''
+    מפתחות שהערך שלהם השתנה ביותר מ-tolerance (יחסית), או שלא היה להם ערך קודם.
+    '''
+    shifted = set()
+    for key, value in after.items():
+        old = before.get(key)
+        if old is None or np.isnan(old):
+            if not np.isnan(value):
+                shifted.add(key)
+        elif abs(value - old) > tolerance * max(abs(old), 1e-9):
+            shifted.add(key)
+    return shifted
+
+
+class PrepState:
+    '''
+    המצב שנשמר בין הכנות מצטברות (prep_state.pkl).
+    '''
+
+    def __init__(self, peer_indexes, peer_values, floor_groups, distance_groups, prices, target_means,
+                 address_counts, address_neighborhoods, stats, scaler, fill_values, prepared_keys):
+        self.price_bounds = None
+        self.address_modes = None
+        self.default_address = None
+        # None עד המיזוג הראשון, שבונה אותם (peer_statistics) מהשורות של ההכנה המלאה
+        self.peer_indexes = peer_indexes
+        # הערכים לחציון הכללי: חדרים חיוביים, ארנונה וועד בית של דירות מעל 20 מ"ר
+        self.peer_values = peer_values
+        self.floor_groups = floor_groups
+        self.distance_groups = distance_groups
+        self.prices = prices
+        self.target_means = target_means
+        self.address_counts = address_counts
+        self.address_neighborhoods = address_neighborhoods
+        self.stats = stats
+        self.scaler = scaler
+        self.fill_values = fill_values
+        self.prepared_keys = prepared_keys
+
+    @classmethod
+    def from_parts(cls, floors, rows, codes, stats, scaler, fill_values):
+        floors = _decode(floors, codes, ['street'])
+        rows = _decode(rows, codes, ['street', 'neighborhood', 'address', 'property_type'])
+        state = cls(peer_indexes=None, peer_values=SortedGroups(),
+                    floor_groups={'floor': SortedGroups(), 'total_floors': SortedGroups()},
+                    distance_groups=SortedGroups(), prices=SortedGroups(),
+                    target_means={col: GroupedMeans() for col in TARGET_COLS}, address_counts={},
+                    address_neighborhoods={},
+                    stats=stats, scaler=scaler, fill_values=fill_values,
+                    prepared_keys=pd.DataFrame(columns=['street', 'neighborhood', 'address']))
+        state._merge(floors, rows)
+        return state
+
+    def _merge(self, floors, rows):
+        '''
+        מוסיפה את העמודות המקוצרות (מפוענחות) של שורות חדשות לכל המבנים.
+        מחזירה את השורות הסופיות (אחרי סינון המחיר והשלמת הכתובת), לפי הסדר.
+        '''
+        for col, groups in self.floor_groups.items():
+            groups.add(floors['street'], floors[col])
+        if self.peer_indexes is None:
+            statistics = peer_statistics(rows)
+            self.peer_indexes = {name: statistics[name] for name in PEER_INDEXES}
+        else:
+            merge_peer_statistics(self.peer_indexes, rows)
+        room = rows['room_num'].to_numpy(dtype=float)
+        self.peer_values.add(['room_num'] * int((room > 0).sum()), room[room > 0])
+        taxed = rows[rows['area_ok']]
+        for col in TAX_COLS:
+            self.peer_values.add([col] * len(taxed), taxed[col])
+        self.distance_groups.add(rows['neighborhood'], rows['distance_from_center'])
+
+        priced = rows[rows['price_ok']]
+        self.prices.add(['all'] * len(priced), priced['price'])
+        low, high = self.prices.quantile('all', 0.01), self.prices.quantile('all', 0.99)
+        final = priced[(priced['price'] > low) & (priced['price'] < high)].copy()
+
+        known = final.dropna(subset=['address'])
+        for neighborhood, address in zip(known['neighborhood'], known['address']):
+            self.address_counts.setdefault(neighborhood, Counter())[address] += 1
+        self.price_bounds = (low, high)
+        self.address_modes = pd.Series({n: _counter_mode(c) for n, c in self.address_counts.items()})
+        self.default_address = _counter_mode(sum(self.address_counts.values(), Counter()))
+        final = fill_final_addresses(final, self.address_modes, self.default_address)
+        for col in TARGET_COLS:
+            self.target_means[col].add(final[col], final['price'])
+        for address, neighborhood in zip(final['address'], final['neighborhood']):
+            self.address_neighborhoods.setdefault(address, Counter())[neighborhood] += 1
+
+        self.prepared_keys = pd.concat([self.prepared_keys, final[['street', 'neighborhood', 'address']]],
+                                       ignore_index=True)
+        return final
+
+    def _statistics(self):
+        distance = pd.DataFrame({'neighborhood': list(self.distance_groups.groups)})
+        distance['neigh_median'] = [self.distance_groups.median(n) for n in distance['neighborhood']]
+        distance['neigh_std'] = [self.distance_groups.std(n) for n in distance['neighborhood']]
+        medians = {key: self.peer_values.median(key) if key in self.peer_values.groups else np.nan
+                   for key in ['room_num'] + TAX_COLS}
+        return TrainingStatistics(
+            street_medians={col: groups.medians() for col, groups in self.floor_groups.items()},
+            distance_stats=distance,
+            price_bounds=self.price_bounds,
+            address_modes=self.address_modes,
+            default_address=self.default_address,
+            category_means=smoothed_category_means(
+                self.target_means['neighborhood'].sums, self.target_means['neighborhood'].counts,
+                self.target_means['address'].sums, self.target_means['address'].counts,
+                self.address_neighborhoods),
+            encoder=self.stats.encoder,
+            rows=len(self.prepared_keys),
+            vocabularies=self.stats.vocabularies,
+            room_median=medians['room_num'],
+            tax_medians={col: medians[col] for col in TAX_COLS},
+            **self.peer_indexes)
+
+    def add(self, df, tolerance=0.05):
+        '''
+        מכינה רק את השורות של df. מחזירה (DataFrame מנורמל עם price, ShiftReport).
+        '''
+        before, prepared_before = self.stats, len(self.prepared_keys)
+        codes = new_codes()
+        vocabularies = {'addresses': set(), 'neighborhoods': set()}
+        floors, rows = scan_chunk(df, codes, vocabularies)
+        rows = _decode(rows, codes, ['street', 'neighborhood', 'address', 'property_type'])
+        self._merge(_decode(floors, codes, ['street']), rows)
+        self.stats = self._statistics()
+        self.stats.vocabularies = {key: sorted(set(before.vocabularies[key]) | vocabularies[key])
+                                   for key in vocabularies}
+
+        # הקידוד של השורות החדשות לפי הסטטיסטיקות שלפני העדכון - בלי המחיר שלהן עצמן (כמו out-of-fold)
+        prepared = encode_chunk(clean_chunk(df, self.stats), self.stats,
+                                category_encoder=CategoryEncoder.from_means(before.category_means))
+        feature_cols = list(self.scaler.feature_names_in_)
+        features = pd.DataFrame(self.scaler.transform(prepared[feature_cols]), columns=feature_cols)
+        features['price'] = prepared['price'].to_numpy()
+
+        before_distance = before.distance_stats.set_index('neighborhood')
+        after_distance = self.stats.distance_stats.set_index('neighborhood')
+        shifted = {
+            'floor': _relative_shift(before.street_medians['floor'], self.stats.street_medians['floor'], tolerance),
+            'total_floors': _relative_shift(before.street_medians['total_floors'],
+                                            self.stats.street_medians['total_floors'], tolerance),
+            'distance_median': _relative_shift(before_distance['neigh_median'].to_dict(),
+                                               after_distance['neigh_median'].to_dict(), tolerance),
+            'distance_std': _relative_shift(before_distance['neigh_std'].to_dict(),
+                                            after_distance['neigh_std'].to_dict(), tolerance),
+        }
+        for col in TARGET_COLS:
+            shifted[col + '_mean'] = _relative_shift(before.category_means[col], self.stats.category_means[col],
+                                                     tolerance)
+        # שורות ישנות בלי כתובת הושלמו מהכתובת השכיחה של אז - אם היא התחלפה, ההשלמה שלהן מיושנת
+        old_modes = before.address_modes.to_dict()
+        shifted['address_mode'] = {n for n, a in self.stats.address_modes.items() if old_modes.get(n) != a}
+
+        old = self.prepared_keys.iloc[:prepared_before]
+        stale = (old['street'].isin(shifted['floor'] | shifted['total_floors'])
+                 | old['neighborhood'].isin(shifted['distance_median'] | shifted['distance_std']
+                                            | shifted['neighborhood_mean'] | shifted['address_mode'])
+                 | old['address'].isin(shifted['address_mean']))
+        bounds_shifted = bool(_relative_shift(dict(enumerate(before.price_bounds)),
+                                              dict(enumerate(self.stats.price_bounds)), tolerance))
+        new_types = set(rows['property_type'].dropna()) - set(self.stats.encoder.categories_[0])
+        return features, ShiftReport(shifted, np.flatnonzero(stale.to_numpy()), bounds_shifted, new_types,
+                                     len(features))
+
+    def save_artifacts(self, directory):
+        '''
+        כותבת את קבצי ההכנה המעודכנים (ה-target encoding, אינדקס הארנונה והטרנספורמר) ל-directory,
+        בדרך כלל <store>/artifacts. model_training.py --store מפרסם אותם יחד עם המודל וה-manifest
+        אחרי האימון על השורות החדשות.
+        '''
+        os.makedirs(directory, exist_ok=True)
+        save_category_means(self.stats.category_means, directory)
+        with open(os.path.join(directory, "vocabularies.json"), "w", encoding="utf-8") as f:
+            json.dump(self.stats.vocabularies, f, ensure_ascii=False)
+        self.stats.arnona_index.save(os.path.join(directory, "arnona_index.pkl"))
+        InferencePipeline.from_fitted(self.scaler.feature_names_in_, self.scaler, self.stats.encoder,
+                                      self.stats.category_means, fill_values=self.fill_values,
+                                      arnona_index=self.stats.arnona_index,
+                                      distance_table=load_distance_table()).save(
+                                          os.path.join(directory, "inference_pipeline.pkl"))
+
+    def save(self, path=STATE_FILE):
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    @classmethod
+    def load(cls, path=STATE_FILE):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def init_state(path, output="feature_store", chunksize=100_000):
+    '''
+    הכנה מלאה ב-chunked_prep (כולל כל קבצי ההכנה) ובניית PrepState מאותו מעבר 1.
+    '''
+    floors, rows, codes, vocabularies = collect_parts(path, chunksize)
+    stats = statistics_from_parts(floors, rows, codes, vocabularies)
+    store = prepare_data_chunked(path, output, chunksize, stats=stats)
+    artifacts = artifacts_directory(store.directory)
+    with open(os.path.join(artifacts, "scaler.pkl"), "rb") as f:
+        scaler = pickle.load(f)
+    with open(os.path.join(artifacts, "inference_pipeline.pkl"), "rb") as f:
+        fill_values = pickle.load(f).fill_values
+    return PrepState.from_parts(floors, rows, codes, stats, scaler, fill_values), store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Incremental training data preparation")
+    parser.add_argument("command", choices=["init", "add"])
+    parser.add_argument("path")
+    parser.add_argument("--state", default=STATE_FILE)
+    parser.add_argument("--output", default="feature_store", help="feature store directory for the prepared rows")
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    parser.add_argument("--tolerance", type=float, default=0.05, help="relative change that marks a group shifted")
+    parser.add_argument("--update-artifacts", action="store_true",
+                        help="write category_means.pkl and the inference pipeline with the updated statistics "
+                             "to <output>/artifacts, published by model_training.py --store")
+    args = parser.parse_args(argv)
+
+    if args.command == "init":
+        state, store = init_state(args.path, args.output, args.chunksize)
+        state.save(args.state)
+        print(f"{store.rows} rows -> {store.directory}, state -> {args.state}")
+        return 0
+
+    state = PrepState.load(args.state)
+    features, report = state.add(pd.read_csv(args.path), args.tolerance)
+    store = FeatureStore.write(args.output, features, meta={"source": str(args.path), "incremental": True})
+    state.save(args.state)
+    if args.update_artifacts:
+        state.save_artifacts(artifacts_directory(store.directory))
+    print(f"{store.rows} new rows -> {store.directory}")
+    print(json.dumps(report.to_dict(), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,382 @@
+import re
+import pickle
+import numpy as np
+from distance_provider import load_distance_table
+from imputation_stats import load_imputation_stats
+from category_encoder import CategoryEncoder
+from feature_registry import FeaturePlan
+from address_cleaning import clean_address
+
+# סוגי נכסים שנמחקים ב-prepare_data (ולכן אין עבורם חיזוי)
+INVALID_PROPERTY_TYPES = {
+    "מרתף/פרטר", "חניה", "סאבלט", "Квартира", "מחסן",
+    "באתר מופיע ערך שלא ברשימה הסגורה", "כללי", "החלפת דירות"
+}
+# איחוד ערכים בעמודת property_type - זהה ל-prepare_data
+PROPERTY_TYPE_REPLACEMENTS = {
+    'גג/פנטהאוז': 'פנטהאוז',
+    'גג/ פנטהאוז': 'פנטהאוז',
+    'גג/פנטהאוז להשכרה': 'פנטהאוז',
+    'דירת גן להשכרה': 'דירת גן'
+}
+ZERO_BUILDING_TAX_PATTERN = re.compile("בית פרטי|קוטג'")
+ROOM_NUM_PATTERN = re.compile(r'(\d+(\.\d+)?)\s*חדרים')
+
+
+def _is_missing(val):
+    return val is None or (isinstance(val, float) and np.isnan(val))
+
+
+def _to_float(val):
+    '''
+    המרה בטוחה למספר (כמו pd.to_numeric עם errors='coerce') לערך בודד.
+    '''
+    if _is_missing(val) or isinstance(val, str) and not val.strip():
+        return np.nan
+    try:
+        return float(val)
+    except (ValueError, TypeError):
+        return np.nan
+
+
+def _parse_floor_part(part):
+    if "קרקע" in part:
+        return 0.0
+    if part.replace('.', '', 1).isdigit():
+        try:
+            return float(int(float(part)))
+        except ValueError:
+            return np.nan
+    return np.nan
+
+
+def _split_floor(val):
+    '''
+    מפצלת ערך כמו '8 מתוך 10' ל-(8, 10), בדיוק כמו שלב 1 ב-process_floors.
+    '''
+    val = str(val)
+    if "מתוך" in val:
+        parts = val.split("מתוך")
+        return _parse_floor_part(parts[0].strip()), _parse_floor_part(parts[1].strip())
+    return _parse_floor_part(val), np.nan
+
+
+def _fix_concatenated_floor(floor, total):
+    '''
+    ערך כמו floor=810, total_floors=10 -> floor=8 (שלב 2 ב-process_floors).
+    '''
+    floor_str = str(int(floor))
+    total_str = str(int(total))
+    if floor_str.endswith(total_str):
+        try:
+            return float(int(floor_str[:len(floor_str) - len(total_str)]))
+        except ValueError:
+            return floor
+    return floor
+
+
+def _normalize_property_type(val):
+    if _is_missing(val) or val in INVALID_PROPERTY_TYPES:
+        return None
+    val = str(val)
+    if not val.strip():
+        return None
+    if val == 'דירה להשכרה':
+        val = 'דירה'
+    val = val.strip()
+    return PROPERTY_TYPE_REPLACEMENTS.get(val, val)
+
+
+def _clean_address(val):
+    # clean_address, עם None לכתובת חסרה או ריקה
+    cleaned = clean_address(val)
+    return None if _is_missing(cleaned) else cleaned
+
+
+def _extract_room_num(description):
+    if _is_missing(description):
+        return np.nan
+    match = ROOM_NUM_PATTERN.search(str(description))
+    return float(match.group(1)) if match else np.nan
+
+
+class InferencePipeline:
+    '''
+    טרנספורמר מקומפל לשלב החיזוי.
+    מחזיק את כל מה ש-prepare_data(dataset_type='test') טוען מהדיסק - מיפויי target encoding,
+    מבנה ה-One-Hot, סדר העמודות ופרמטרי הנרמול - כמערכים פשוטים,
+    והופך מילון (או רשימת מילונים) של דירה לווקטור פיצ'רים מנורמל ב-NumPy בלבד.
+    כל שורה מעובדת בדיוק כמו קריאה ל-prepare_data על DataFrame של שורה אחת,
+    ערכים חסרים מושלמים מטבלאות האימון (imputation_stats - חציון לשכונה ולשטח, לרחוב, הכתובת השכיחה),
+    ומה שנשאר חסר - מחציוני עמודות האימון (fill_values).
+    distance_table (StreetDistanceTable) לא נשמרת בתוך ה-pickle - היא נטענת מ-street_distances.npy ב-mmap,
+    וכך גם imputation_stats (ImputationStats מ-imputation_stats.npz).
+    ה-target encoding הוא CategoryEncoder; load_bundle מחליף אותו בעותק הממופה מ-category_encoder.npy.
+    '''
+
+    def __init__(self, feature_columns, scaler_mean, scaler_scale, onehot_column, onehot_categories,
+                 category_means, fill_values=None, arnona_index=None, distance_table=None, imputation_stats=None):
+        self.feature_columns = list(feature_columns)
+        self.scaler_mean = np.asarray(scaler_mean, dtype=float)
+        self.scaler_scale = np.asarray(scaler_scale, dtype=float)
+        self.onehot_column = onehot_column
+        self.onehot_categories = [str(c) for c in onehot_categories]
+        # category_means - מילונים (category_means.pkl) או CategoryEncoder מוכן
+        self.category_encoder = (category_means if isinstance(category_means, CategoryEncoder)
+                                 else CategoryEncoder.from_means(category_means))
+        self.fill_values = {k: float(v) for k, v in (fill_values or {}).items() if not _is_missing(v)}
+        self.arnona_index = arnona_index
+        self.distance_table = distance_table
+        self.imputation_stats = imputation_stats
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['distance_table'] = None
+        state['imputation_stats'] = None
+        state.pop('_feature_plan', None)
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('distance_table', None)
+        state.setdefault('imputation_stats', None)
+        if 'neighborhood_means' in state:
+            # pickle ישן עם מילונים - ממירים ל-CategoryEncoder
+            state['category_encoder'] = CategoryEncoder.from_means(
+                {'neighborhood': state.pop('neighborhood_means'), 'address': state.pop('address_means')})
+            state.pop('neighborhood_fallback', None)
+        self.__dict__.update(state)
+
+    @classmethod
+    def from_fitted(cls, feature_columns, scaler, encoder, category_means, fill_values=None, arnona_index=None,
+                    distance_table=None, imputation_stats=None):
+        '''
+        בונה את הטרנספורמר מהאובייקטים שנוצרו ב-prepare_data בזמן האימון.
+        בלי fill_values - ערכי ההשלמה הם ממוצעי האימון השמורים ב-scaler.
+        '''
+        if fill_values is None:
+            fill_values = dict(zip(feature_columns, scaler.mean_))
+        return cls(
+            feature_columns=feature_columns,
+            scaler_mean=scaler.mean_,
+            scaler_scale=scaler.scale_,
+            onehot_column=encoder.feature_names_in_[0],
+            onehot_categories=encoder.categories_[0],
+            category_means=category_means,
+            fill_values=fill_values,
+            arnona_index=arnona_index,
+            distance_table=distance_table,
+            imputation_stats=imputation_stats
+        )
+
+    @classmethod
+    def from_artifacts(cls, directory='.'):
+        '''
+        בונה את הטרנספורמר מקבצי ה-pkl הקיימים (למודל שאומן לפני שהטרנספורמר נשמר).
+        '''
+        def load(name):
+            with open(f"{directory}/{name}", "rb") as f:
+                return pickle.load(f)
+
+        try:
+            arnona_index = load("arnona_index.pkl")
+        except FileNotFoundError:
+            arnona_index = None
+        return cls.from_fitted(load("train_columns.pkl"), load("scaler.pkl"), load("onehot_encoder.pkl"),
+                               load("category_means.pkl"), arnona_index=arnona_index,
+                               distance_table=load_distance_table(f"{directory}/street_distances.npy"),
+                               imputation_stats=load_imputation_stats(f"{directory}/imputation_stats.npz"))
+
+    def save(self, path="inference_pipeline.pkl"):
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    @property
+    def feature_plan(self):
+        # הפיצ'רים הנגזרים שהמודל אומן עליהם, ומספרי העמודות שלהם ב-X
+        plan = self.__dict__.get('_feature_plan')
+        if plan is None:
+            plan = FeaturePlan.for_columns(self.feature_columns)
+            positions = [self.feature_columns.index(name) for name in plan.names]
+            self._feature_plan = plan = (plan, positions)
+        return plan
+
+    def _fill(self, col, values):
+        if col in self.fill_values:
+            values[np.isnan(values)] = self.fill_values[col]
+        return values
+
+    def transform_batch(self, records):
+        '''
+        מחזירה (X, valid): מטריצת פיצ'רים מנורמלת וסימון השורות שאפשר לחזות עבורן.
+        שורה לא תקינה (סוג נכס לא רלוונטי, שטח קטן מ-20, בלי כתובת כשאין imputation_stats) מקבלת NaN.
+        '''
+        n = len(records)
+        col = lambda key: [r.get(key) for r in records]
+        stats = self.imputation_stats
+        address = [_clean_address(v) for v in col('address')]
+
+        # --- קומות ---
+        floor = np.empty(n)
+        parsed_total = np.empty(n)
+        for i, val in enumerate(col('floor')):
+            floor[i], parsed_total[i] = _split_floor(val)
+        total = np.array([_to_float(v) for v in col('total_floors')])
+        total = np.where(np.isnan(total), parsed_total, total)
+        for i in np.flatnonzero((floor > total) & np.isfinite(total)):
+            floor[i] = _fix_concatenated_floor(floor[i], total[i])
+        total = np.where(np.isnan(total) & ~np.isnan(floor), floor, total)
+        if stats is not None:
+            # חציון הרחוב באימון (שלב 4 ב-process_floors)
+            for name, values in (('floor', floor), ('total_floors', total)):
+                missing = np.flatnonzero(np.isnan(values))
+                if len(missing):
+                    values[missing] = stats.street_medians.lookup([address[i] for i in missing], name)
+        floor = np.where(floor > total, total, floor)
+        high_floor = floor > 0
+        floor = self._fill('floor', floor)
+        total = self._fill('total_floors', total)
+
+        area = np.array([_to_float(v) for v in col('area')])
+        garden_area = np.array([_to_float(v) for v in col('garden_area')])
+        distance = np.array([_to_float(v) for v in col('distance_from_center')])
+
+        property_type = [_normalize_property_type(v) for v in col('property_type')]
+        neighborhood = ['Unknown' if _is_missing(v) else v for v in col('neighborhood')]
+        peers = {'neighborhood': np.array(neighborhood, dtype=object), 'area': area}
+
+        # --- ארנונה: חסר או 0 -> חציון השכונה והשטח באימון, ערך חריג -> אינדקס הארנונה ---
+        monthly_arnona = np.array([_to_float(v) for v in col('monthly_arnona')])
+        if stats is not None:
+            monthly_arnona = stats.tables['monthly_arnona'].fill(
+                monthly_arnona, peers, np.isnan(monthly_arnona) | (monthly_arnona == 0))
+        if self.arnona_index is not None:
+            monthly_arnona = self.arnona_index.fix_outliers(monthly_arnona, peers)
+        monthly_arnona = self._fill('monthly_arnona', monthly_arnona)
+
+        # --- מספר חדרים: 0 -> לפי התיאור, ואם עדיין חסר -> השלמה ---
+        room_num = np.array([_to_float(v) for v in col('room_num')])
+        descriptions = col('description')
+        for i in np.flatnonzero(room_num == 0):
+            room_num[i] = _extract_room_num(descriptions[i])
+        if stats is not None:
+            # כמו fix_room_num: 0 -> חציון השכונה והשטח, ומה שנשאר 0 או חסר -> החציון הכללי
+            room_table = stats.tables['room_num']
+            room_num = np.nan_to_num(room_table.fill(room_num, peers, (room_num == 0) & ~np.isnan(area)), nan=0)
+            room_num[room_num == 0] = room_table.overall
+        room_num[room_num == 0] = np.nan
+        room_num = self._fill('room_num', room_num)
+
+        # --- מרחק מהמרכז: חסר -> 0, מרחק לא ידוע -> טבלת הרחובות מהאימון, יחידות של ק"מ -> מטרים ---
+        distance[np.isnan(distance)] = 0
+        needs_lookup = distance < 100
+        if self.distance_table is not None and needs_lookup.any():
+            rows = np.flatnonzero(needs_lookup)
+            distance[rows] = self.distance_table.fill(
+                [address[i] for i in rows], [neighborhood[i] for i in rows], distance[rows])
+        distance = np.where(distance < 10, distance * 1000, distance)
+
+        # --- גינה: חסר -> 0 בקומה גבוהה, אחרת חציון השכונה והשטח; ערכים חריגים מחולקים ב-10 ---
+        if stats is not None:
+            garden_area = stats.tables['garden_area'].fill(garden_area, peers, np.isnan(garden_area) & ~high_floor)
+        garden_area[np.isnan(garden_area)] = 0
+        garden_area = np.where(garden_area > 100, garden_area / 10, garden_area)
+
+        # --- ועד בית: 0 לבתים פרטיים/קוטג' ---
+        building_tax = np.array([_to_float(v) for v in col('building_tax')])
+        for i, ptype in enumerate(property_type):
+            if ptype is not None and ZERO_BUILDING_TAX_PATTERN.search(ptype):
+                building_tax[i] = 0
+        if stats is not None:
+            # כמו process_tax_col - גם 0 נחשב חסר
+            building_tax = stats.tables['building_tax'].fill(
+                building_tax, peers, np.isnan(building_tax) | (building_tax == 0))
+        building_tax = self._fill('building_tax', building_tax)
+
+        # --- כתובת חסרה -> הכתובת השכיחה בשכונה באימון (fill_missing_address_by_neighborhood) ---
+        if stats is not None:
+            missing = [i for i, a in enumerate(address) if a is None]
+            if missing:
+                for i, modal in zip(missing, stats.modal_addresses([neighborhood[i] for i in missing])):
+                    address[i] = modal
+
+        valid = (area >= 20) & np.array([p is not None for p in property_type]) \
+            & np.array([a is not None for a in address], dtype=bool)
+
+        flag = lambda key: np.array([_to_float(r.get(key, 0)) for r in records])
+        has_parking, elevator = flag('has_parking'), flag('elevator')
+        has_safe_room, has_balcony = flag('has_safe_room'), flag('has_balcony')
+        is_renovated, is_furnished = flag('is_renovated'), flag('is_furnished')
+
+        features = {
+            'room_num': room_num,
+            'floor': floor,
+            'total_floors': total,
+            'area': area,
+            'garden_area': garden_area,
+            'monthly_arnona': monthly_arnona,
+            'building_tax': building_tax,
+            'distance_from_center': distance,
+            'has_parking': has_parking,
+            'elevator': elevator,
+            'has_safe_room': has_safe_room,
+            'has_balcony': has_balcony,
+            'is_renovated': is_renovated,
+            'is_furnished': is_furnished,
+        }
+
+        # --- Target Encoding עם fallback לשכונה ולממוצע הכללי ---
+        features['neighborhood_encoded'], features['address_encoded'] = self.category_encoder.encode(
+            neighborhood, address)
+
+        # --- One-Hot לסוג נכס ---
+        for category in self.onehot_categories:
+            features[f"{self.onehot_column}_{category}"] = np.array(
+                [p == category for p in property_type], dtype=float)
+
+        # --- הרכבת המטריצה לפי סדר עמודות האימון ונרמול ---
+        X = np.zeros((n, len(self.feature_columns)))
+        # הפיצ'רים הנגזרים נכתבים ישר לעמודות שלהם ב-X (feature_registry)
+        plan, positions = self.feature_plan
+        plan.evaluate(features, out=X, positions=positions)
+        derived = set(plan.names)
+        for j, name in enumerate(self.feature_columns):
+            if name in derived:
+                continue
+            if name in features:
+                X[:, j] = features[name]
+            elif any(name in r for r in records):
+                X[:, j] = self._fill(name, np.array([_to_float(r.get(name, 0)) for r in records]))
+        X -= self.scaler_mean
+        X /= self.scaler_scale
+        X[~valid] = np.nan
+        return X, valid
+
+    def transform(self, records):
+        '''
+        מקבלת מילון אחד או רשימת מילונים ומחזירה מטריצת פיצ'רים מנורמלת.
+        מעלה ValueError אם אחת השורות לא תקינה לחיזוי.
+        '''
+        if isinstance(records, dict):
+            records = [records]
+        X, valid = self.transform_batch(records)
+        if not valid.all():
+            raise ValueError(f"Rows {np.flatnonzero(~valid).tolist()} cannot be scored")
+        return X
+
+
+def predict_prices(model, X, check_finite=True):
+    '''
+    חיזוי על מטריצה שהוכנה ע"י InferencePipeline.
+    למודל לינארי (ElasticNetCV) מחושב ישירות X @ coef + intercept, כמו ב-model.predict,
+    בלי בדיקות שמות העמודות של sklearn.
+    check_finite - כמו הבדיקה של sklearn על הקלט: ValueError אם אחד המחירים אינו מספר סופי.
+    בלעדיה (חיזוי batch) הקורא מסמן בעצמו את השורות שאינן סופיות.
+    '''
+    if hasattr(model, 'coef_') and hasattr(model, 'intercept_'):
+        prices = X @ model.coef_ + model.intercept_
+    else:
+        prices = model.predict(X)
+    if check_finite and not np.all(np.isfinite(prices)):
+        raise ValueError(f"Rows {np.flatnonzero(~np.isfinite(prices)).tolist()} have a non-finite price")
+    return prices
+
@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import functools
+import tracemalloc
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+
+PROFILE_ENV = "PREPARE_DATA_PROFILE"
+logger = logging.getLogger("prepare_data.profile")
+
+_report = contextvars.ContextVar("stage_report", default=None)
+_recorder = contextvars.ContextVar("stage_recorder", default=None)
+
+
+def _rows(df):
+    try:
+        return len(df)
+    except TypeError:
+        return None
+
+
+class StageReport:
+    '''
+    הדוח שמחזיר profile_stages: ריצה אחת לכל קריאה לפונקציה מסומנת (למשל prepare_data),
+    ובכל ריצה רשימת שלבים עם זמן, מספר שורות לפני/אחרי ושיא זיכרון.
+    '''
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.runs = []
+
+    def to_dict(self):
+        return {"runs": self.runs}
+
+    def format(self):
+        lines = []
+        for run in self.runs:
+            lines.append(f"{run['name']}: {run['seconds']:.4f}s rows {run['rows_in']} -> {run['rows_out']}")
+            for s in run["stages"]:
+                memory = f" peak +{s['peak_memory_bytes'] / 1e6:.1f}MB" if s.get("peak_memory_bytes") is not None else ""
+                lines.append(f"  {s['name']:28} {s['seconds']:9.4f}s  rows {s['rows_in']} -> {s['rows_out']}{memory}")
+        return "\n".join(lines)
+
+
+class _Recorder:
+    '''
+    מודדת שלבים לפי "נקודות ביקורת": כל mark_stage סוגר את השלב שהתחיל בנקודה הקודמת.
+    '''
+
+    def __init__(self, name, rows, trace_memory):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.rows_in = self.last_rows = rows
+        self.started = self.last_time = time.perf_counter()
+        if trace_memory:
+            tracemalloc.reset_peak()
+            self.last_memory = tracemalloc.get_traced_memory()[0]
+
+    def mark(self, name, df=None):
+        now = time.perf_counter()
+        rows = _rows(df) if df is not None else self.last_rows
+        stage = {"name": name, "seconds": now - self.last_time, "rows_in": self.last_rows, "rows_out": rows}
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            stage["peak_memory_bytes"] = max(peak - self.last_memory, 0)
+            tracemalloc.reset_peak()
+            self.last_memory = current
+        self.stages.append(stage)
+        self.last_rows = rows
+        self.last_time = time.perf_counter()
+
+    def result(self, rows_out):
+        return {"name": self.name, "seconds": time.perf_counter() - self.started,
+                "rows_in": self.rows_in, "rows_out": rows_out, "stages": self.stages}
+
+
+def profiling_enabled():
+    return os.environ.get(PROFILE_ENV, "").lower() not in ("", "0", "false", "no")
+
+
+@contextmanager
+def profile_stages(trace_memory=True):
+    '''
+    מפעילה מדידה לכל הקריאות לפונקציות מסומנות בתוך הבלוק ומחזירה StageReport:
+
+        with profile_stages() as report:
+            prepare_data(df, 'train')
+        print(report.format())
+    '''
+    report = StageReport(trace_memory)
+    started = trace_memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    token = _report.set(report)
+    try:
+        yield report
+    finally:
+        _report.reset(token)
+        if started:
+            tracemalloc.stop()
+
+
+def instrumented(name):
+    '''
+    מסמנת פונקציה שמקבלת DataFrame כארגומנט ראשון. כשהמדידה כבויה - קריאה רגילה בלבד.
+    בתוך profile_stages הריצה נוספת לדוח; עם PREPARE_DATA_PROFILE=1 היא נכתבת ללוג כשורת JSON.
+    '''
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(df, *args, **kwargs):
+            report = _report.get()
+            if report is None and not profiling_enabled():
+                return fn(df, *args, **kwargs)
+            label = f"{name}[{args[0]}]" if args and isinstance(args[0], str) else name
+            trace_memory = report.trace_memory if report is not None else True
+            started = trace_memory and not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            recorder = _Recorder(label, _rows(df), trace_memory)
+            token = _recorder.set(recorder)
+            try:
+                result = fn(df, *args, **kwargs)
+            finally:
+                _recorder.reset(token)
+                if started:
+                    tracemalloc.stop()
+            run = recorder.result(_rows(result))
+            if report is not None:
+                report.runs.append(run)
+            else:
+                line = json.dumps(run, ensure_ascii=False)
+                if logger.hasHandlers():
+                    logger.info(line)
+                else:
+                    print(line, file=sys.stderr)
+            return result
+        return wrapper
+    return decorator
+
+
+def mark_stage(name, df=None):
+    '''
+    סוגרת את השלב הנוכחי בפונקציה המסומנת. בלי מדידה פעילה - לא עושה כלום.
+    '''
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.mark(name, df)
+
+
+class LatencyHistogram:
+    '''
+    היסטוגרמת latency לבקשות HTTP לפי endpoint, method ו-status, בפורמט של Prometheus.
+    '''
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name="http_request_duration_seconds", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, seconds)] += 1
+            self._series[key] = (counts, total + seconds)
+
+    def render(self):
+        lines = [f"# HELP {self.name} Request latency in seconds.", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        for key, counts, total in series:
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
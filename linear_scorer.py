@@ -0,0 +1,157 @@
+'''
+ייצוא של המודל הלינארי לקובץ אחד (model_export.npz) וחיזוי ממנו ב-NumPy בלבד.
+
+ה-StandardScaler מקופל לתוך המקדמים:
+    ((x - mean) / scale) @ coef + b  =  x @ (coef / scale) + (b - mean @ (coef / scale))
+כך שבחיזוי אין נרמול ואין אובייקטים של scikit-learn. הקובץ מכיל:
+    coef, intercept          - המקדמים המקופלים
+    meta                     - JSON: גרסת המודל (מה-manifest), סדר העמודות, מבנה ה-One-Hot,
+                               ערכי ההשלמה, רשימות הטופס וההגדרות של אינדקס הארנונה
+    category_encoder         - טבלת ה-target encoding (המערך של category_encoder.npy)
+    distance_table           - טבלת המרחקים (המערך של street_distances.npy)
+    arnona_<שלב>_<שם>        - אינדקס הארנונה (PeerIndex) כמערכים
+    stats_<שם>               - טבלאות ההשלמה (ImputationStats) כמערכים
+אין בקובץ pickle, והטעינה לא מייבאת pandas, scikit-learn או SciPy.
+כשיש manifest.json לצד הקובץ, הטעינה מוודאת שהגרסה בקובץ היא הגרסה שב-manifest - ייצוא שנשאר
+מאימון קודם (למשל אחרי אימון עם --export "") לא נטען בשקט.
+
+    python model_training.py --export-only          # ייצוא המודל הנוכחי בלי אימון
+    MODEL_EXPORT=model_export.npz gunicorn -c gunicorn.conf.py wsgi:app
+'''
+import os
+import json
+import numpy as np
+from inference_pipeline import InferencePipeline
+from category_encoder import CategoryEncoder
+from distance_provider import StreetDistanceTable
+from imputation import PeerIndex
+from imputation_stats import ImputationStats
+from model_registry import read_manifest
+
+EXPORT_FILE = "model_export.npz"
+
+
+class LinearModel:
+    '''
+    מודל לינארי עם coef_ ו-intercept_ - predict_prices מחשב ממנו X @ coef_ + intercept_ כמו ממודל sklearn.
+    '''
+
+    def __init__(self, coef, intercept):
+        self.coef_ = np.asarray(coef, dtype=float)
+        self.intercept_ = float(intercept)
+
+    def predict(self, X):
+        return X @ self.coef_ + self.intercept_
+
+
+class ExportedModel:
+    '''
+    גרסת מודל שנטענה מ-model_export.npz. חושפת את מה שהשרת משתמש בו מ-ArtifactBundle:
+    version, pipeline, model ו-vocabularies.
+    '''
+
+    def __init__(self, version, pipeline, model, vocabularies):
+        self.version = version
+        self.pipeline = pipeline
+        self.model = model
+        self.vocabularies = vocabularies
+
+    def predict(self, records):
+        '''
+        מחיר לכל רשומה (NaN לשורה שאי אפשר לחזות עבורה).
+        '''
+        X, valid = self.pipeline.transform_batch(records)
+        prices = np.full(len(records), np.nan)
+        if valid.any():
+            prices[valid] = X[valid] @ self.model.coef_ + self.model.intercept_
+        return prices
+
+
+def fold_scaler(coef, intercept, mean, scale):
+    coef = np.asarray(coef, dtype=float) / np.asarray(scale, dtype=float)
+    return coef, float(intercept) - float(np.asarray(mean, dtype=float) @ coef)
+
+
+def export_model(bundle, path=EXPORT_FILE):
+    '''
+    כותבת את ה-bundle (model_registry.load_bundle) כקובץ ייצוא. רק למודל לינארי (coef_ ו-intercept_).
+    '''
+    model, pipeline = bundle.model, bundle.pipeline
+    if not (hasattr(model, "coef_") and hasattr(model, "intercept_")):
+        raise ValueError(f"{type(model).__name__} is not a linear model and cannot be exported")
+    coef, intercept = fold_scaler(model.coef_, np.ravel(model.intercept_)[0], pipeline.scaler_mean,
+                                  pipeline.scaler_scale)
+
+    arrays = {"coef": coef, "intercept": np.array(intercept),
+              "category_encoder": np.asarray(pipeline.category_encoder.records)}
+    arnona = None
+    if pipeline.arnona_index is not None:
+        arnona, arnona_arrays = pipeline.arnona_index.to_arrays()
+        arrays.update({f"arnona_{name}": values for name, values in arnona_arrays.items()})
+    if bundle.distance_table is not None:
+        arrays["distance_table"] = np.asarray(bundle.distance_table.records)
+    stats = None
+    if pipeline.imputation_stats is not None:
+        stats, stats_arrays = pipeline.imputation_stats.to_arrays()
+        arrays.update({f"stats_{name}": values for name, values in stats_arrays.items()})
+
+    meta = {
+        "version": bundle.version,
+        "feature_columns": pipeline.feature_columns,
+        "onehot_column": pipeline.onehot_column,
+        "onehot_categories": pipeline.onehot_categories,
+        "fill_values": pipeline.fill_values,
+        "vocabularies": bundle.vocabularies,
+        "arnona_index": arnona,
+        "imputation_stats": stats,
+    }
+    with open(path, "wb") as f:
+        np.savez(f, meta=np.array(json.dumps(meta, ensure_ascii=False)), **arrays)
+    return meta
+
+
+def check_manifest_version(path, version):
+    try:
+        manifest = read_manifest(os.path.dirname(path) or ".")
+    except FileNotFoundError:
+        # ייצוא שהועתק לבד לשרת, בלי קבצי ה-pickle וה-manifest
+        return
+    if manifest["version"] != version:
+        raise ValueError(f"{path} is model version {version} but the manifest is at {manifest['version']}; "
+                         f"run model_training.py --export-only")
+
+
+def load_exported(path=EXPORT_FILE):
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data["meta"]))
+        arrays = {name: data[name] for name in data.files}
+    check_manifest_version(path, meta["version"])
+
+    arnona_index = None
+    if meta["arnona_index"] is not None:
+        arnona_index = PeerIndex.from_arrays(
+            meta["arnona_index"], {name[len("arnona_"):]: values for name, values in arrays.items()
+                                   if name.startswith("arnona_")})
+    distance_table = StreetDistanceTable(arrays["distance_table"]) if "distance_table" in arrays else None
+    imputation_stats = None
+    if meta.get("imputation_stats") is not None:
+        imputation_stats = ImputationStats.from_arrays(
+            meta["imputation_stats"], {name[len("stats_"):]: values for name, values in arrays.items()
+                                       if name.startswith("stats_")})
+
+    # הנרמול כבר בתוך המקדמים - הטרנספורמר מחזיר את הפיצ'רים כמו שהם (mean=0, scale=1)
+    n = len(meta["feature_columns"])
+    pipeline = InferencePipeline(
+        feature_columns=meta["feature_columns"],
+        scaler_mean=np.zeros(n),
+        scaler_scale=np.ones(n),
+        onehot_column=meta["onehot_column"],
+        onehot_categories=meta["onehot_categories"],
+        category_means=CategoryEncoder(arrays["category_encoder"]),
+        fill_values=meta["fill_values"],
+        arnona_index=arnona_index,
+        distance_table=distance_table,
+        imputation_stats=imputation_stats,
+    )
+    return ExportedModel(meta["version"], pipeline, LinearModel(arrays["coef"], arrays["intercept"]),
+                         meta["vocabularies"])
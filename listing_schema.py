@@ -0,0 +1,181 @@
+'''
+סכמת הקלט של דירה - משותפת לטופס (api.index) ול-JSON (/api/predict).
+
+כל שדה מתפרש פעם אחת, עמודה אחרי עמודה על כל הרשומות, ל-ListingColumns; הבדיקות (RULES) רצות
+על העמודות כמערכי NumPy, וכל רשומה תקינה הופכת ל-ListingRecord עם ערכים מוקלדים -
+listing_to_record משתמש בהם ישירות ולא ממיר שוב. ערך שלא ניתן להמרה לא מפיל את הבקשה:
+בשדה חובה הוא שגיאת שדה (עם ההודעה בעברית), ובשדה אופציונלי (ארנונה, ועד בית, גינה) הוא NaN.
+'''
+import math
+import numpy as np
+
+
+def parse_int(val):
+    # מספר שלם מ-JSON (3 או 3.0) או מחרוזת כמו בטופס ("3")
+    if isinstance(val, float) and val.is_integer():
+        return int(val)
+    if isinstance(val, bool) or isinstance(val, float):
+        raise ValueError(val)
+    return int(val)
+
+
+class NumberField:
+    '''
+    שדה מספרי. message - הודעת השגיאה כשאי אפשר להמיר (שדה חובה); בלעדיה הערך הופך ל-NaN.
+    default - הערך לשדה חסר או ריק (כמו `form.get(key) or 0`).
+    '''
+
+    def __init__(self, key, parse, message=None, default=None):
+        self.key = key
+        self.parse = parse
+        self.message = message
+        self.default = default
+
+    def parse_column(self, listings):
+        values = np.full(len(listings), np.nan)
+        ok = np.zeros(len(listings), dtype=bool)
+        for i, listing in enumerate(listings):
+            val = listing.get(self.key)
+            if self.default is not None:
+                val = val or self.default
+            try:
+                value = float(self.parse(val if val is not None else ""))
+            except (ValueError, TypeError, OverflowError):
+                continue
+            # "inf" / "nan" עוברים את float() - אבל אינם ערך תקין
+            if math.isfinite(value):
+                values[i] = value
+                ok[i] = True
+        return values, ok
+
+
+NUMBER_FIELDS = [
+    NumberField("room_number", float, "יש להזין מספר חדרים תקין (1-10)"),
+    NumberField("floor", parse_int, "יש להזין מספר קומה תקין"),
+    NumberField("total_floors", parse_int, "יש להזין מספר תקין"),
+    NumberField("area", float, "יש להזין שטח תקין"),
+    NumberField("monthly_arnona", float, default=0),
+    NumberField("building_tax", float, default=0),
+    NumberField("garden_area", float, default=0),
+]
+TEXT_FIELDS = ["property_type", "address", "custom_address", "neighborhood", "custom_neighborhood"]
+INT_FIELDS = {"floor", "total_floors"}
+# הגבולות של שדות הטופס (index.html) - גם ל-JSON, כדי שערך כמו floor=1e30 לא יגיע למודל
+MAX_FLOOR = 50
+MAX_TOTAL_FLOORS = 100
+MAX_AREA = 1000
+
+# בדיקות טווח ובין שדות, לפי הסדר. לכל שדה נשמרת השגיאה הראשונה (קודם שגיאת ההמרה).
+# כל בדיקה מקבלת את העמודות (values) ואת סימון ההמרה המוצלחת (ok) ומחזירה מסכה של שורות שגויות.
+RULES = [
+    ("room_number", "מספר החדרים חייב להיות בין 1 ל-10",
+     lambda v, ok: ok["room_number"] & ~((v["room_number"] >= 1) & (v["room_number"] <= 10))),
+    ("floor", "קומה מינימלית חייבת להיות 1",
+     lambda v, ok: ok["floor"] & (v["floor"] < 1)),
+    ("floor", f"קומה מקסימלית היא {MAX_FLOOR}",
+     lambda v, ok: ok["floor"] & (v["floor"] > MAX_FLOOR)),
+    ("total_floors", "סה\"כ קומות חייב להיות גדול או שווה למספר קומה",
+     lambda v, ok: ok["total_floors"] & ok["floor"] & (v["floor"] >= 1) & (v["floor"] > v["total_floors"])),
+    ("total_floors", "סה\"כ קומות חייב להיות לפחות 1",
+     lambda v, ok: ok["total_floors"] & (v["total_floors"] < 1)),
+    ("total_floors", f"סה\"כ קומות חייב להיות לכל היותר {MAX_TOTAL_FLOORS}",
+     lambda v, ok: ok["total_floors"] & (v["total_floors"] > MAX_TOTAL_FLOORS)),
+    ("area", "שטח מינימלי חייב להיות 20 מ\"ר",
+     lambda v, ok: ok["area"] & (v["area"] < 20)),
+    ("area", f"שטח מקסימלי הוא {MAX_AREA} מ\"ר",
+     lambda v, ok: ok["area"] & (v["area"] > MAX_AREA)),
+    ("address", "חובה להזין שכונה או כתובת",
+     lambda v, ok: (v["address"] == "") & (v["neighborhood"] == "")),
+    ("property_type", "יש לבחור סוג נכס",
+     lambda v, ok: v["property_type"] == ""),
+]
+
+
+def _text(val):
+    return str(val or "").strip()
+
+
+def _features(val):
+    # בטופס: מחרוזת אחת או רשימה (checkbox-ים); ב-JSON: רשימה
+    if isinstance(val, str):
+        return [val]
+    if isinstance(val, list):
+        return val
+    return []
+
+
+def form_listing(form):
+    '''
+    רשומה מטופס (MultiDict של werkzeug): features - כל הערכים שסומנו, כל שדה אחר - הערך הראשון
+    (גם כשהמפתח נשלח כמה פעמים), אחרי _text. זה גם מה שמוצג שוב בטופס אחרי שגיאה.
+    '''
+    listing = {key: _text(values[0]) for key, values in form.lists() if key != "features"}
+    listing["features"] = form.getlist("features")
+    return listing
+
+
+class ListingRecord:
+    '''
+    דירה אחת אחרי המרה ובדיקה: מספרים כ-float (קומות כ-int), טקסט אחרי strip, מאפיינים כרשימה.
+    '''
+    __slots__ = [field.key for field in NUMBER_FIELDS] + TEXT_FIELDS + ["features"]
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"ListingRecord({self.to_dict()!r})"
+
+
+class ListingColumns:
+    '''
+    כל השדות של batch של רשומות, כל אחד מתפרש פעם אחת: values (שם -> מערך) ו-ok (ההמרה הצליחה).
+    '''
+
+    def __init__(self, listings):
+        self.n = len(listings)
+        self.values, self.ok = {}, {}
+        for field in NUMBER_FIELDS:
+            self.values[field.key], self.ok[field.key] = field.parse_column(listings)
+        for key in TEXT_FIELDS:
+            self.values[key] = np.array([_text(listing.get(key)) for listing in listings], dtype=object)
+        self.features = [_features(listing.get("features", [])) for listing in listings]
+
+    def errors(self):
+        '''
+        רשימה של מילוני שגיאות (שדה -> הודעה), מילון ריק לרשומה תקינה.
+        '''
+        errors = [{} for _ in range(self.n)]
+
+        def flag(mask, field, message):
+            for i in np.flatnonzero(mask):
+                errors[i].setdefault(field, message)
+
+        for field in NUMBER_FIELDS:
+            if field.message is not None:
+                flag(~self.ok[field.key], field.key, field.message)
+        for field, message, rule in RULES:
+            flag(rule(self.values, self.ok), field, message)
+        return errors
+
+    def record(self, i):
+        values = {key: column[i] for key, column in self.values.items()}
+        for field in NUMBER_FIELDS:
+            value = float(values[field.key])
+            values[field.key] = int(value) if field.key in INT_FIELDS and self.ok[field.key][i] else value
+        return ListingRecord(features=self.features[i], **values)
+
+
+def validate_listings(listings):
+    '''
+    המרה ובדיקה של כל הרשומות יחד. מחזירה (records, errors):
+    ListingRecord לכל רשומה תקינה (None לשגויה), ומילון שגיאות לכל רשומה.
+    '''
+    columns = ListingColumns(listings)
+    errors = columns.errors()
+    records = [None if row_errors else columns.record(i) for i, row_errors in enumerate(errors)]
+    return records, errors
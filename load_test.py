@@ -0,0 +1,144 @@
+'''
+בדיקת עומס לשרת החיזוי דרך HTTP: כמה בקשות בשנייה עוברות ב-/api/predict ובאיזה latency.
+
+    PREDICTION_CACHE_SIZE=0 python api.py &                           # שרת הפיתוח (Werkzeug)
+    python load_test.py --url http://127.0.0.1:5000 --output dev.json
+
+    PREDICTION_CACHE_SIZE=0 gunicorn -c gunicorn.conf.py wsgi:app &   # preload + workers + threads
+    python load_test.py --url http://127.0.0.1:8000 --output gunicorn.json --baseline dev.json
+
+concurrency לקוחות שולחים בקשות ברצף במשך duration שניות, כל בקשה עם batch רשומות
+(מ-synthetic_data.generate_listings). PREDICTION_CACHE_SIZE=0 מכבה את מטמון החיזוי בשרת,
+כדי למדוד חיזוי אמיתי ולא פגיעות במטמון כשהרשומות חוזרות על עצמן.
+מודפסים בקשות ורשומות לשנייה, אחוזוני latency וספירה לפי סטטוס (503 = ה-executor היה מלא).
+עם --baseline התפוקה מושווית לקובץ תוצאות קודם - זה המספר שמראה כמה הרוויח מצב הפרודקשן.
+'''
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from collections import Counter
+from datetime import datetime, timezone
+from synthetic_data import generate_listings
+from benchmark import percentiles
+
+
+def _post(url, payload, timeout):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, OSError):
+        return "error"
+
+
+def wait_ready(url, timeout=60):
+    '''
+    מחכה ש-/healthz יחזיר 200 (רכיבי המודל טעונים) לפני שמתחילים למדוד.
+    '''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url + "/healthz", timeout=5) as response:
+                if response.status == 200:
+                    return json.loads(response.read())
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+def run_load(url, concurrency=8, duration=10.0, batch=1, request_timeout=60, seed=0):
+    listings = generate_listings(max(1000, concurrency * batch * 4), seed)
+    endpoint = url + "/api/predict"
+    lock = threading.Lock()
+    latencies, statuses = [], Counter()
+    deadline = time.perf_counter() + duration
+
+    def client(worker):
+        # כל לקוח עובר על חלק אחר של הרשומות, כך שבקשות מקבילות לא חוזרות על אותה דירה
+        position = worker * batch
+        while time.perf_counter() < deadline:
+            payload = [listings[(position + i) % len(listings)] for i in range(batch)]
+            position += concurrency * batch
+            start = time.perf_counter()
+            status = _post(endpoint, payload if batch > 1 else payload[0], request_timeout)
+            elapsed = time.perf_counter() - start
+            with lock:
+                statuses[str(status)] += 1
+                if status == 200:
+                    latencies.append(elapsed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    ok = statuses.get("200", 0)
+    return {
+        "concurrency": concurrency,
+        "batch": batch,
+        "seconds": elapsed,
+        "requests_per_second": ok / elapsed,
+        "listings_per_second": ok * batch / elapsed,
+        "latency": percentiles(latencies) if latencies else None,
+        "statuses": dict(statuses),
+    }
+
+
+def format_result(result):
+    lines = [f"{result['requests_per_second']:.1f} req/s, {result['listings_per_second']:.1f} listings/s "
+             f"(concurrency {result['concurrency']}, batch {result['batch']}, {result['seconds']:.1f}s)"]
+    if result["latency"]:
+        latency = result["latency"]
+        lines.append(f"latency p50 {latency['p50_ms']:.1f}ms, p90 {latency['p90_ms']:.1f}ms, "
+                     f"p99 {latency['p99_ms']:.1f}ms")
+    lines.append("statuses: " + ", ".join(f"{k}={v}" for k, v in sorted(result["statuses"].items())))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP load test for /api/predict")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="server base URL")
+    parser.add_argument("--concurrency", type=int, default=8, help="parallel clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to send requests")
+    parser.add_argument("--batch", type=int, default=1, help="listings per request")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout in seconds")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="previous results file to compare throughput against")
+    args = parser.parse_args(argv)
+
+    url = args.url.rstrip("/")
+    health = wait_ready(url)
+    print(f"model {health.get('model_version')} ready at {url}", flush=True)
+    result = run_load(url, args.concurrency, args.duration, args.batch, args.timeout)
+    print(format_result(result))
+
+    report = {"meta": {"created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"), "url": url,
+                       "model_version": health.get("model_version")},
+              "result": result}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["result"]
+        ratio = result["requests_per_second"] / baseline["requests_per_second"]
+        print(f"throughput x{ratio:.2f} vs {args.baseline} "
+              f"({baseline['requests_per_second']:.1f} -> {result['requests_per_second']:.1f} req/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,306 @@
+import io
+import os
+import json
+import pickle
+import signal
+import hashlib
+import tempfile
+import threading
+from datetime import datetime, timezone
+from inference_pipeline import InferencePipeline
+from distance_provider import StreetDistanceTable
+from category_encoder import CategoryEncoder
+from imputation_stats import ImputationStats
+
+MANIFEST_FILE = "manifest.json"
+
+# רכיבי המודל - שם לוגי -> קובץ
+COMPONENTS = {
+    "model": "trained_model.pkl",
+    "category_means": "category_means.pkl",
+    "onehot_encoder": "onehot_encoder.pkl",
+    "train_columns": "train_columns.pkl",
+    "scaler": "scaler.pkl",
+    "inference_pipeline": "inference_pipeline.pkl",
+    "arnona_index": "arnona_index.pkl",
+    "distance_table": "street_distances.npy",
+    "vocabularies": "vocabularies.json",
+    "category_encoder": "category_encoder.npy",
+    "imputation_stats": "imputation_stats.npz",
+}
+REQUIRED_COMPONENTS = ["model", "category_means", "onehot_encoder", "train_columns", "scaler"]
+
+
+# רכיבים שאינם pickle - נטענים מאותם בתים שה-sha256 שלהם נבדק
+COMPONENT_LOADERS = {
+    "vocabularies": lambda content: json.loads(content.decode("utf-8")),
+    "imputation_stats": lambda content: ImputationStats.load(io.BytesIO(content)),
+}
+# טבלאות שממופות מהקובץ (mmap) כדי שיהיו משותפות בין ה-workers - נטענות לפי הנתיב,
+# ואחרי המיפוי נבדק שזה עדיין הקובץ שנבדק (_file_identity)
+MAPPED_LOADERS = {
+    "distance_table": StreetDistanceTable.load,
+    "category_encoder": CategoryEncoder.load,
+}
+
+
+def vocabularies_from_category_means(category_means):
+    '''
+    למודל שאומן לפני ש-vocabularies.json נשמר: רשימות הטופס נגזרות ממפתחות ה-target encoding.
+    '''
+    return {
+        "addresses": sorted(str(a) for a in category_means["address"]),
+        "neighborhoods": sorted(str(n) for n in category_means["neighborhood"] if n != "Unknown"),
+    }
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _file_identity(stat):
+    # אותו inode, ולא נכתב מאז: os.replace נותן inode אחר, כתיבה במקום משנה גודל/זמן
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _manifest(components):
+    version = hashlib.sha256(
+        "".join(components[name]["sha256"] for name in sorted(components)).encode()
+    ).hexdigest()[:12]
+    return {
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "components": components,
+    }
+
+
+def build_manifest(directory="."):
+    '''
+    מתארת את כל רכיבי המודל הקיימים בתיקייה (קובץ + sha256), עם מספר גרסה שנגזר מהתוכן.
+    '''
+    components = {}
+    for name, filename in COMPONENTS.items():
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            components[name] = {"file": filename, "sha256": _sha256(path)}
+    return _manifest(components)
+
+
+def write_manifest(manifest, directory="."):
+    '''
+    כותבת manifest.json. הכתיבה אטומית (קובץ זמני + os.replace), ולכן יש לקרוא לה
+    אחרי שכל הרכיבים נשמרו - תהליך שטוען את ה-manifest רואה תמיד סט שלם.
+    '''
+    tmp_path = os.path.join(directory, MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST_FILE))
+    return manifest
+
+
+def staging_directory(directory="."):
+    '''
+    תיקייה זמנית בתוך directory (אותה מערכת קבצים, כך ש-os.replace ממנה אטומי) לרכיבי גרסה חדשה.
+    '''
+    return tempfile.mkdtemp(prefix=".staging-", dir=directory)
+
+
+def current_components(directory="."):
+    '''
+    הרכיבים של הגרסה הפעילה לפי ה-manifest, או לפי הקבצים בתיקייה כשאין manifest (כמו load_bundle).
+    '''
+    try:
+        return read_manifest(directory)["components"]
+    except FileNotFoundError:
+        return build_manifest(directory)["components"]
+
+
+def publish(staging, directory=".", carry_over=()):
+    '''
+    מעבירה את רכיבי המודל שנכתבו ל-staging לתיקייה וכותבת manifest חדש.
+    נקראת רק אחרי שהאימון הצליח: עד אז התיקייה וה-manifest נשארים של הגרסה הקודמת.
+    בזמן ההעברה עצמה טעינה יכולה לראות קובץ חדש מול ה-manifest הישן - load_bundle נכשלת
+    על ה-sha256 והרישום נשאר עם הגרסה הטעונה, עד שה-manifest החדש נכתב.
+
+    ה-manifest נבנה רק מהקבצים שב-staging. carry_over - שמות רכיבים של הגרסה הפעילה שעוברים
+    לגרסה החדשה כמו שהם, עם ה-sha256 מה-manifest שלה (למשל ה-pipeline כשרק המודל אומן מחדש).
+    קבצי רכיבים אחרים שנשארו בתיקייה נמחקים אחרי כתיבת ה-manifest, כדי שקובץ ישן לא ייחתם
+    בטעות עם גרסה שלא נוצר בשבילה.
+    '''
+    staged = build_manifest(staging)["components"]
+    components = dict(staged)
+    if carry_over:
+        current = current_components(directory)
+        for name in carry_over:
+            if name not in components and name in current:
+                components[name] = current[name]
+    missing = [name for name in REQUIRED_COMPONENTS if name not in components]
+    if missing:
+        raise ValueError(f"Cannot publish without components: {missing}")
+
+    for entry in staged.values():
+        os.replace(os.path.join(staging, entry["file"]), os.path.join(directory, entry["file"]))
+    manifest = write_manifest(_manifest(components), directory)
+    for name, filename in COMPONENTS.items():
+        if name not in components and os.path.exists(os.path.join(directory, filename)):
+            os.remove(os.path.join(directory, filename))
+    return manifest
+
+
+def read_manifest(directory="."):
+    with open(os.path.join(directory, MANIFEST_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ArtifactBundle:
+    '''
+    גרסה אחת, טעונה במלואה, של כל רכיבי המודל.
+    האובייקט לא משתנה אחרי הטעינה ולכן אפשר לשתף אותו בין כל ה-threads של השרת.
+    '''
+
+    def __init__(self, version, model, category_means, onehot_encoder, train_columns, scaler, pipeline,
+                 arnona_index=None, distance_table=None, vocabularies=None, category_encoder=None,
+                 imputation_stats=None):
+        self.version = version
+        self.model = model
+        self.category_means = category_means
+        self.onehot_encoder = onehot_encoder
+        self.train_columns = train_columns
+        self.scaler = scaler
+        self.pipeline = pipeline
+        self.arnona_index = arnona_index
+        self.distance_table = distance_table
+        self.vocabularies = vocabularies
+        self.category_encoder = category_encoder
+        self.imputation_stats = imputation_stats
+
+
+def load_bundle(directory="."):
+    '''
+    טוענת את כל הרכיבים לפי ה-manifest ומוודאת שה-sha256 של כל קובץ תואם,
+    כדי לא לטעון מודל שנמצא באמצע כתיבה. אם אין manifest (מודל ישן) - נבנה אחד בזיכרון.
+    '''
+    try:
+        manifest = read_manifest(directory)
+    except FileNotFoundError:
+        manifest = build_manifest(directory)
+
+    components = manifest["components"]
+    missing = [name for name in REQUIRED_COMPONENTS if name not in components]
+    if missing:
+        raise ValueError(f"Manifest {manifest['version']} is missing components: {missing}")
+
+    loaded = {}
+    for name, entry in components.items():
+        path = os.path.join(directory, entry["file"])
+        with open(path, "rb") as f:
+            identity = _file_identity(os.fstat(f.fileno()))
+            content = f.read()
+            if hashlib.sha256(content).hexdigest() != entry["sha256"]:
+                raise ValueError(f"{entry['file']} does not match manifest version {manifest['version']}")
+            if name in MAPPED_LOADERS:
+                loaded[name] = MAPPED_LOADERS[name](path)
+                # הקובץ הפתוח עדיין מחזיק את ה-inode שנבדק, ולכן אם הנתיב מצביע עליו גם עכשיו
+                # והוא לא השתנה - זה גם הקובץ שמופה
+                if not (_file_identity(os.fstat(f.fileno())) == identity == _file_identity(os.stat(path))):
+                    raise ValueError(f"{entry['file']} changed while loading manifest version {manifest['version']}")
+            elif name in COMPONENT_LOADERS:
+                loaded[name] = COMPONENT_LOADERS[name](content)
+            else:
+                loaded[name] = pickle.loads(content)
+
+    pipeline = loaded.get("inference_pipeline")
+    if pipeline is None:
+        pipeline = InferencePipeline.from_fitted(
+            loaded["train_columns"], loaded["scaler"], loaded["onehot_encoder"], loaded["category_means"],
+            arnona_index=loaded.get("arnona_index"))
+    # הטבלה לא נשמרת בתוך ה-pickle של הטרנספורמר - מחברים את העותק הממופה מהדיסק
+    pipeline.distance_table = loaded.get("distance_table")
+    pipeline.imputation_stats = loaded.get("imputation_stats")
+    # ה-target encoding הממופה מהדיסק - משותף בין ה-workers במקום עותק פרטי מה-pickle
+    category_encoder = loaded.get("category_encoder")
+    if category_encoder is None:
+        category_encoder = pipeline.category_encoder
+    pipeline.category_encoder = category_encoder
+
+    return ArtifactBundle(
+        version=manifest["version"],
+        model=loaded["model"],
+        category_means=loaded["category_means"],
+        onehot_encoder=loaded["onehot_encoder"],
+        train_columns=loaded["train_columns"],
+        scaler=loaded["scaler"],
+        pipeline=pipeline,
+        arnona_index=loaded.get("arnona_index"),
+        distance_table=loaded.get("distance_table"),
+        vocabularies=loaded.get("vocabularies") or vocabularies_from_category_means(loaded["category_means"]),
+        category_encoder=category_encoder,
+        imputation_stats=loaded.get("imputation_stats"),
+    )
+
+
+class ModelRegistry:
+    '''
+    מחזיקה את גרסת המודל הפעילה בזיכרון התהליך.
+    בקשה קוראת ל-current() פעם אחת ומשתמשת באותו bundle עד סופה;
+    reload() טוענת גרסה חדשה במלואה ורק אז מחליפה את ההפניה, כך שאף בקשה לא רואה מצב חלקי.
+    '''
+
+    def __init__(self, directory=".", loader=None):
+        self.directory = directory
+        # loader(directory) -> bundle; למשל קובץ הייצוא של linear_scorer במקום קבצי ה-pickle
+        self.loader = loader or load_bundle
+        self._bundle = None
+        self._lock = threading.Lock()
+
+    def reload(self):
+        with self._lock:
+            bundle = self.loader(self.directory)
+            self._bundle = bundle
+        return bundle
+
+    def current(self):
+        bundle = self._bundle
+        if bundle is None:
+            bundle = self.reload()
+        return bundle
+
+    @property
+    def ready(self):
+        return self._bundle is not None
+
+    def reload_if_changed(self):
+        '''
+        טוענת מחדש רק אם הגרסה ב-manifest שונה מהטעונה. אחרי fork של worker, כשהגרסה לא השתנתה,
+        ה-bundle שנטען בתהליך האב נשאר משותף (copy-on-write) ולא נטען שוב.
+        '''
+        try:
+            version = read_manifest(self.directory)["version"]
+        except FileNotFoundError:
+            version = None
+        bundle = self._bundle
+        if bundle is None or (version is not None and version != bundle.version):
+            bundle = self.reload()
+        return bundle
+
+    def install_signal_handler(self, signum=getattr(signal, "SIGHUP", None)):
+        '''
+        טעינה מחדש בקבלת SIGHUP (kill -HUP <pid>) אחרי שמודל חדש הועתק לתיקייה.
+        '''
+        if signum is None or threading.current_thread() is not threading.main_thread():
+            return False
+
+        def reload_logged():
+            try:
+                self.reload()
+            except Exception:
+                import traceback
+                traceback.print_exc()
+
+        # הטעינה רצה ב-thread נפרד כדי שה-handler לא ייתקע על ה-lock אם טעינה כבר באמצע
+        signal.signal(signum, lambda signum, frame: threading.Thread(target=reload_logged, daemon=True).start())
+        return True
@@ -0,0 +1,119 @@
+'''
+חיפוש היפר-פרמטרים עם cross-validation במקביל, על כל הליבות.
+
+כל זוג (מועמד, קיפול) הוא משימה נפרדת ב-ProcessPoolExecutor. מטריצת הפיצ'רים מוכנה פעם אחת
+ונשמרת כ-.npy בתיקייה זמנית; כל process טוען אותה ב-mmap, כך שהיא לא עוברת pickle לכל משימה
+ולא מוכנה מחדש לכל מועמד.
+
+עצירה מוקדמת: כל המועמדים רצים קודם על min_folds הקיפולים הראשונים. מועמד שה-MSE הממוצע שלו
+גבוה מ-prune_ratio כפול הטוב ביותר בשלב הזה לא ממשיך לשאר הקיפולים.
+'''
+import os
+import shutil
+import tempfile
+import warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sklearn.model_selection import KFold
+from sklearn.linear_model import ElasticNet, Ridge
+from sklearn.ensemble import HistGradientBoostingRegressor
+
+REGRESSORS = {
+    "elasticnet": lambda p: ElasticNet(alpha=p["alpha"], l1_ratio=p["l1_ratio"], max_iter=10000, random_state=42),
+    "ridge": lambda p: Ridge(alpha=p["alpha"]),
+    "hist_gradient_boosting": lambda p: HistGradientBoostingRegressor(
+        learning_rate=p.get("learning_rate", 0.1), max_leaf_nodes=p.get("max_leaf_nodes", 31), random_state=42),
+}
+
+_shared = {}
+
+
+def build_regressor(name, params):
+    return REGRESSORS[name](params)
+
+
+def candidate_grid(regressors=("elasticnet",), alphas=(0.01, 0.1, 1, 10), l1_ratios=(0.1,),
+                   learning_rates=(0.05, 0.1), max_leaf_nodes=(15, 31)):
+    '''
+    רשימת מועמדים (שם, פרמטרים) לכל רגרסור שנבחר.
+    '''
+    candidates = []
+    for name in regressors:
+        if name == "elasticnet":
+            candidates += [(name, {"alpha": a, "l1_ratio": r}) for r in l1_ratios for a in alphas]
+        elif name == "ridge":
+            candidates += [(name, {"alpha": a}) for a in alphas]
+        elif name == "hist_gradient_boosting":
+            candidates += [(name, {"learning_rate": lr, "max_leaf_nodes": n})
+                           for lr in learning_rates for n in max_leaf_nodes]
+        else:
+            raise ValueError(f"Unknown regressor {name!r}, expected one of {sorted(REGRESSORS)}")
+    return candidates
+
+
+def label(candidate):
+    name, params = candidate
+    return f"{name}(" + ", ".join(f"{k}={v}" for k, v in params.items()) + ")"
+
+
+def _init_worker(x_path, y_path):
+    # process אחד לכל ליבה - בלי threads נוספים של BLAS/OpenMP בתוך כל אחד
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(1)
+    warnings.filterwarnings("ignore")
+    _shared["X"] = np.load(x_path, mmap_mode="r")
+    _shared["y"] = np.load(y_path, mmap_mode="r")
+
+
+def _score_fold(candidate, fold, folds):
+    X, y = _shared["X"], _shared["y"]
+    # KFold בלי ערבוב - אותם קיפולים כמו ב-ElasticNetCV(cv=10)
+    train, test = next(split for i, split in enumerate(KFold(folds).split(X)) if i == fold)
+    model = build_regressor(*candidate).fit(X[train], y[train])
+    return float(np.mean((y[test] - model.predict(X[test])) ** 2))
+
+
+def cross_validate(X, y, candidates, folds=10, jobs=None, min_folds=3, prune_ratio=1.25):
+    '''
+    מחזירה רשימה (לפי סדר המועמדים) של מילונים: candidate, label, fold_mse, rmse, pruned.
+    prune_ratio=None מבטל את העצירה המוקדמת.
+    '''
+    directory = tempfile.mkdtemp(prefix="model_search_")
+    x_path, y_path = os.path.join(directory, "X.npy"), os.path.join(directory, "y.npy")
+    np.save(x_path, np.ascontiguousarray(X, dtype=float))
+    np.save(y_path, np.asarray(y, dtype=float))
+    scores = [{} for _ in candidates]
+    min_folds = min(min_folds, folds)
+    try:
+        with ProcessPoolExecutor(jobs or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(x_path, y_path)) as pool:
+            def run(tasks):
+                futures = {pool.submit(_score_fold, candidates[i], fold, folds): (i, fold) for i, fold in tasks}
+                for future in as_completed(futures):
+                    i, fold = futures[future]
+                    scores[i][fold] = future.result()
+
+            run([(i, fold) for i in range(len(candidates)) for fold in range(min_folds)])
+            means = [np.mean(list(s.values())) for s in scores]
+            best = min(means)
+            alive = [i for i, m in enumerate(means) if not prune_ratio or m <= best * prune_ratio]
+            run([(i, fold) for i in alive for fold in range(min_folds, folds)])
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return [{"candidate": c, "label": label(c), "fold_mse": [s[k] for k in sorted(s)],
+             "rmse": float(np.sqrt(np.mean(list(s.values())))), "pruned": len(s) < folds}
+            for c, s in zip(candidates, scores)]
+
+
+def best_result(results):
+    complete = [r for r in results if not r["pruned"]]
+    return min(complete, key=lambda r: r["rmse"])
+
+
+def format_results(results):
+    lines = [f"{'candidate':60} {'CV RMSE':>10}  folds"]
+    for r in sorted(results, key=lambda r: (r["pruned"], r["rmse"])):
+        note = "  (pruned)" if r["pruned"] else ""
+        lines.append(f"{r['label']:60} {r['rmse']:10.1f}  {len(r['fold_mse'])}{note}")
+    return "\n".join(lines)
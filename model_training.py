@@ -1,32 +1,391 @@
-import pandas as pd
+'''
+אימון המודל.
+
+    python model_training.py                                              # ElasticNetCV על train.csv
+    python model_training.py --incremental --store feature_store          # SGD ב-mini-batches מהדיסק
+    python model_training.py --incremental --store feature_store --warm-start
+    python model_training.py --incremental --new-listings new.csv         # רק דירות חדשות, ממשיך מהמודל הקיים
+    python model_training.py --search --l1-ratios 0.1,0.5,0.9 --regressors elasticnet,ridge --jobs 32
+    python model_training.py --disable-features log_area,central_location      # ניסוי בלי פיצ'רים נגזרים
+    python model_training.py --export-only                                # ייצוא המודל הנוכחי בלבד
+
+האימון המלא טוען את כל הדאטה לזיכרון ומריץ cross-validation.
+האימון המצטבר (--incremental) הוא SGDRegressor עם אותו עונש elastic-net, שמתעדכן ב-partial_fit
+על batch אחרי batch: מ-FeatureStore שנבנה ב-chunked_prep.py, או מקובץ של דירות חדשות בלבד
+שעובר את ה-InferencePipeline של הגרסה הנוכחית (אותו מרחב פיצ'רים כמו trained_model.pkl).
+בכל מצב מודפסים RMSE ו-R² - באימון המלא מה-cross-validation, באימון המצטבר על כל שורה עשירית
+שלא נכנסת לאימון (holdout), ובחיפוש (--search) טבלת ה-CV RMSE של כל המועמדים (model_search.py).
+כשהאימון המצטבר ממשיך מודל קיים, גם המודל הקיים נמדד על אותו holdout - ואם ה-RMSE עלה,
+המודל החדש לא מתפרסם (exit 1).
+בסוף, למודל לינארי, נכתב גם model_export.npz - המודל עם הנרמול מקופל למקדמים (linear_scorer.py).
+'''
+import os
+import sys
 import pickle
-from sklearn.linear_model import ElasticNetCV
-from assets_data_prep import prepare_data
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import ElasticNetCV, SGDRegressor
+from model_registry import COMPONENTS, load_bundle, staging_directory, publish
+
+MODEL_FILE = "trained_model.pkl"
+HOLDOUT_EVERY = 10
+PRICE_RANGE = (1000, 25000)
+# קצב הלמידה כשממשיכים ממודל קיים; מוקטן עוד לפי השורה הגדולה ביותר (stable_step)
+WARM_ETA0 = 1e-4
+
+
+class RegressionScore:
+    '''
+    RMSE ו-R² שמצטברים batch אחרי batch, בלי להחזיק את כל החיזויים בזיכרון.
+    '''
+
+    def __init__(self):
+        self.n = 0
+        self.sse = 0.0
+        self.sum_y = 0.0
+        self.sum_y2 = 0.0
+
+    def update(self, y, predicted):
+        y = np.asarray(y, dtype=float)
+        self.n += len(y)
+        self.sse += float(np.sum((y - predicted) ** 2))
+        self.sum_y += float(y.sum())
+        self.sum_y2 += float(np.sum(y ** 2))
+
+    @property
+    def rmse(self):
+        return float(np.sqrt(self.sse / self.n)) if self.n else float("nan")
+
+    @property
+    def r2(self):
+        if not self.n:
+            return float("nan")
+        total = self.sum_y2 - self.sum_y ** 2 / self.n
+        return 1 - self.sse / total if total > 0 else float("nan")
+
+    def format(self):
+        return f"RMSE {self.rmse:.1f}, R² {self.r2:.4f} ({self.n} שורות)"
+
+
+def load_training_data(path="train.csv", cache_dir=None, features=None, output_dir="."):
+    '''
+    output_dir - לאן prepare_data כותב את קבצי ההכנה (ב-main: תיקיית ה-staging של הגרסה החדשה).
+    '''
+    from assets_data_prep import prepare_data
+
+    # שלב 1: טען את הנתונים
+    df = pd.read_csv(path)  # שנה ל-train.xlsx אם צריך
+
+    # שלב 2: עיבוד מוקדם
+    df_prepared = prepare_data(df, dataset_type='train', cache_dir=cache_dir, features=features,
+                               output_dir=output_dir)
+
+    # שלב 3: פיצול ל-X ו-y
+    X = df_prepared.drop(columns='price')
+    y = df_prepared['price']
+    return X, y
+
+
+def stage_store_artifacts(directory, staging):
+    '''
+    מעתיקה ל-staging את קבצי ההכנה שנשמרו עם ה-FeatureStore (chunked_prep / incremental_prep),
+    כדי שיתפרסמו יחד עם המודל שאומן על ה-store. ה-store עצמו נשאר שלם לאימון נוסף.
+    '''
+    from feature_store import artifacts_directory
+    source = artifacts_directory(directory)
+    if os.path.isdir(source):
+        for name in os.listdir(source):
+            shutil.copy2(os.path.join(source, name), os.path.join(staging, name))
+
+
+def load_store_data(directory):
+    '''
+    X ו-y מ-FeatureStore של chunked_prep.py (כבר מנורמלים), בלי שורות עם ערך חסר.
+    '''
+    from feature_store import FeatureStore
+    store = FeatureStore.open(directory)
+    data = store.matrix([c for c in store.columns if c != "price"] + ["price"])
+    data = data[~np.isnan(data).any(axis=1)]
+    return data[:, :-1], data[:, -1]
+
+
+def train_full(path="train.csv", cache_dir=None, features=None, output_dir="."):
+    X, y = load_training_data(path, cache_dir, features, output_dir)
+
+    # שלב 4: הגדרת המודל עם cross-validation
+    model = ElasticNetCV(
+        l1_ratio=0.1,                     # כמה L1 לעומת L2
+        alphas=[0.01, 0.1, 1, 10],        # אלפא candidates
+        cv=10,                            # 10 קיפולים
+        max_iter=10000,
+        random_state=42
+    )
+
+    # שלב 5: אימון המודל
+    model.fit(X, y)
+
+    # הערכה: RMSE של ה-alpha שנבחר, ממוצע על 10 הקיפולים
+    cv_mse = model.mse_path_[list(model.alphas_).index(model.alpha_)].mean()
+    print(f"alpha={model.alpha_}: CV RMSE {np.sqrt(cv_mse):.1f}, R² על האימון {model.score(X, y):.4f}")
+    return model
+
+
+def incremental_model(alpha=0.01, l1_ratio=0.1, warm_from=None, eta0=WARM_ETA0):
+    '''
+    SGDRegressor עם עונש elastic-net. הקנס של SGD זהה לזה של ElasticNet
+    (alpha * (l1_ratio * |w| + (1 - l1_ratio) / 2 * |w|²)), ולכן אפשר להתחיל מהמקדמים של מודל קיים.
+    בהתחלה מהמקדמים של מודל קיים קצב הלמידה קבוע וקטן (eta0): ה-invscaling של ברירת המחדל מתחיל
+    מחדש מ-t=1 עם צעד 0.01, שעל מחירים בסקאלה המקורית מעיף את המקדמים מהפתרון הקיים.
+    SGDRegressor קיים ממשיך כמו שהוא, עם ה-t_ שלו.
+    '''
+    if isinstance(warm_from, SGDRegressor):
+        return warm_from
+    if warm_from is None:
+        return SGDRegressor(penalty="elasticnet", alpha=alpha, l1_ratio=l1_ratio, random_state=42)
+    alpha = float(getattr(warm_from, "alpha_", alpha))
+    l1_ratio = float(getattr(warm_from, "l1_ratio_", l1_ratio))
+    model = SGDRegressor(penalty="elasticnet", alpha=alpha, l1_ratio=l1_ratio, learning_rate="constant",
+                         eta0=eta0, random_state=42)
+    # partial_fit ממשיך מ-coef_/intercept_ קיימים במקום לאתחל אותם לאפס
+    model.coef_ = np.asarray(warm_from.coef_, dtype=float).copy()
+    model.intercept_ = np.atleast_1d(float(warm_from.intercept_))
+    return model
+
+
+def train_search(X, y, candidates, folds=10, jobs=None, min_folds=3, prune_ratio=1.25):
+    '''
+    cross-validation במקביל על כל המועמדים, ואימון של הטוב ביותר על כל הדאטה.
+    '''
+    from model_search import cross_validate, best_result, format_results, build_regressor
+
+    results = cross_validate(np.asarray(X, dtype=float), np.asarray(y, dtype=float), candidates,
+                             folds, jobs, min_folds, prune_ratio)
+    print(format_results(results))
+    best = best_result(results)
+    print(f"הטוב ביותר: {best['label']}, CV RMSE {best['rmse']:.1f}")
+    # מערך ולא DataFrame - כמו המטריצה שה-InferencePipeline מעביר למודל בזמן החיזוי
+    return build_regressor(*best["candidate"]).fit(np.asarray(X, dtype=float), np.asarray(y, dtype=float))
+
+
+def _floats(text):
+    return [float(v) for v in text.split(",")]
+
+
+def load_model(path=MODEL_FILE):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _holdout(start, n):
+    return np.arange(start, start + n) % HOLDOUT_EVERY == 0
+
+
+def _fit_batch(model, X, y, rng):
+    if len(y):
+        order = rng.permutation(len(y))
+        model.partial_fit(X[order], y[order])
+
+
+def store_batches(store, batch_size):
+    '''
+    (X, y, holdout) לכל batch ב-FeatureStore. שורות עם ערך חסר לא נכנסות לאימון.
+    '''
+    features = [c for c in store.columns if c != "price"]
+    start = 0
+    for batch in store.iter_batches(batch_size, features + ["price"]):
+        holdout = _holdout(start, len(batch))
+        start += len(batch)
+        keep = ~np.isnan(batch).any(axis=1)
+        yield batch[keep, :-1], batch[keep, -1], holdout[keep]
+
+
+def listing_batches(path, pipeline, batch_size):
+    '''
+    (X, y, holdout) לכל chunk בקובץ דירות חדשות, אחרי ה-InferencePipeline של הגרסה הנוכחית.
+    נכנסות רק שורות שאפשר לחזות עבורן ושהמחיר שלהן בטווח של prepare_data.
+    '''
+    start = 0
+    for chunk in pd.read_csv(path, chunksize=batch_size):
+        holdout = _holdout(start, len(chunk))
+        start += len(chunk)
+        X, valid = pipeline.transform_batch(chunk.to_dict("records"))
+        y = pd.to_numeric(chunk["price"], errors="coerce").to_numpy(dtype=float)
+        keep = valid & (y >= PRICE_RANGE[0]) & (y <= PRICE_RANGE[1]) & ~np.isnan(X).any(axis=1)
+        yield X[keep], y[keep], holdout[keep]
+
+
+def holdout_score(model, batches):
+    '''
+    RegressionScore של שורות ה-holdout - לכל מודל לינארי או מודל עם predict (predict_prices).
+    '''
+    from inference_pipeline import predict_prices
+    score = RegressionScore()
+    for X, y, holdout in batches():
+        if holdout.any():
+            score.update(y[holdout], predict_prices(model, X[holdout], check_finite=False))
+    return score
+
+
+def stable_step(batches, eta0=WARM_ETA0):
+    '''
+    קצב למידה קבוע שלא עובר את 1/|x|² של אף שורת אימון. צעד של SGD על שגיאה ריבועית
+    מתבדר כש-eta * |x|² > 2, ושורות עם קטגוריה נדירה (one-hot אחרי נרמול) הן ארוכות במיוחד.
+    '''
+    largest = 0.0
+    for X, y, holdout in batches():
+        if (~holdout).any():
+            largest = max(largest, float(np.max(np.einsum("ij,ij->i", X[~holdout], X[~holdout]))))
+    return min(eta0, 1.0 / largest) if largest > 0 else eta0
+
+
+def train_incremental(model, batches, epochs=5, seed=42):
+    '''
+    partial_fit על כל ה-batches, epochs פעמים. batches היא פונקציה שמחזירה iterator חדש בכל epoch
+    (store_batches / listing_batches) - הדאטה נקרא מהדיסק מחדש ולא נשמר בזיכרון.
+    מחזירה את ה-RegressionScore של שורות ה-holdout.
+    '''
+    rng = np.random.default_rng(seed)
+    for _ in range(epochs):
+        for X, y, holdout in batches():
+            _fit_batch(model, X[~holdout], y[~holdout], rng)
+    return holdout_score(model, batches)
+
+
+def train_warm(warm_from, batches, epochs=5):
+    '''
+    ממשיכה את warm_from על batches. מחזירה (model, score) - או (None, score) אם ה-RMSE על ה-holdout
+    יצא גרוע מזה של warm_from על אותן שורות, כדי שלא יפורסם מודל שהאימון המצטבר קלקל.
+    '''
+    before = holdout_score(warm_from, batches)
+    model = incremental_model(warm_from=warm_from, eta0=stable_step(batches))
+    score = train_incremental(model, batches, epochs)
+    print(f"holdout: לפני {before.format()}, אחרי {score.format()}")
+    # not <= ולא > - גם RMSE שאינו מספר (מקדמים שהתבדרו) נחשב גרוע יותר
+    if before.n and not score.rmse <= before.rmse:
+        print(f"❌ ה-RMSE על ה-holdout עלה ({before.rmse:.1f} -> {score.rmse:.1f}) - המודל לא פורסם")
+        return None, score
+    return model, score
+
+
+def export_current(path):
+    '''
+    מייצאת את גרסת המודל שב-manifest ל-linear_scorer, ומוודאת שהחיזוי מהקובץ זהה לחיזוי מה-pickle.
+    '''
+    from linear_scorer import export_model, load_exported
+    from inference_pipeline import predict_prices
+    bundle = load_bundle()
+    try:
+        export_model(bundle, path)
+    except ValueError as e:
+        print(f"ייצוא דולג: {e}")
+        return None
+    exported = load_exported(path)
+    # בדיקה על וקטורי האימון עצמם (הממוצע ועוד/פחות סטיית תקן לכל עמודה)
+    pipeline = bundle.pipeline
+    X = pipeline.scaler_mean + np.outer([-1.0, 0.0, 1.0], pipeline.scaler_scale)
+    expected = predict_prices(bundle.model, (X - pipeline.scaler_mean) / pipeline.scaler_scale)
+    error = float(np.max(np.abs(predict_prices(exported.model, X) - expected)))
+    print(f"ייצוא: {path} (גרסה {exported.version}, הפרש מקסימלי בחיזוי {error:.2e})")
+    return exported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the rent price model")
+    parser.add_argument("--train", default="train.csv", help="training data for the full ElasticNetCV fit")
+    parser.add_argument("--prep-cache", help="reuse prepare_data output for unchanged train.csv (prep_cache.py)")
+    parser.add_argument("--disable-features", default="",
+                        help="comma separated derived features to leave out (feature_registry.py)")
+    parser.add_argument("--export", default="model_export.npz",
+                        help="NumPy-only export of the linear model (linear_scorer.py); empty to skip")
+    parser.add_argument("--export-only", action="store_true", help="export the current model without training")
+    parser.add_argument("--incremental", action="store_true", help="SGD elastic-net trained in mini-batches")
+    parser.add_argument("--store", help="feature store directory written by chunked_prep.py")
+    parser.add_argument("--new-listings", help="CSV of new listings to add to the current model")
+    parser.add_argument("--warm-start", action="store_true", help=f"start from the coefficients in {MODEL_FILE}")
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--alpha", type=float, default=0.01, help="elastic-net alpha when not warm-starting")
+    parser.add_argument("--search", action="store_true", help="parallel cross-validated grid search")
+    parser.add_argument("--regressors", default="elasticnet",
+                        help="comma separated: elasticnet,ridge,hist_gradient_boosting")
+    parser.add_argument("--alphas", type=_floats, default=[0.01, 0.1, 1, 10])
+    parser.add_argument("--l1-ratios", type=_floats, default=[0.1])
+    parser.add_argument("--folds", type=int, default=10)
+    parser.add_argument("--jobs", type=int, help="worker processes (default: all cores)")
+    parser.add_argument("--min-folds", type=int, default=3, help="folds every candidate runs before pruning")
+    parser.add_argument("--prune-ratio", type=float, default=1.25,
+                        help="drop candidates whose early MSE is this many times the best (0 disables)")
+    args = parser.parse_args(argv)
+
+    if args.export_only:
+        return 0 if export_current(args.export) is not None else 1
+
+    features = None
+    if args.disable_features:
+        from feature_registry import FeaturePlan
+        features = FeaturePlan.without(args.disable_features.split(",")).names
 
-# שלב 1: טען את הנתונים
-df = pd.read_csv("train.csv")  # שנה ל-train.xlsx אם צריך
+    # קבצי ההכנה והמודל נכתבים ל-staging ומתפרסמים יחד עם ה-manifest רק אחרי שהאימון הצליח -
+    # אימון שנכשל באמצע לא משאיר בתיקייה רכיבים שלא תואמים ל-manifest של הגרסה הפעילה
+    staging = staging_directory()
+    # רכיבי הגרסה הפעילה שממשיכים כמו שהם לגרסה החדשה; כל השאר חייבים להיכתב ל-staging
+    carry_over = ()
+    try:
+        if args.search:
+            from model_search import candidate_grid
+            if args.store:
+                stage_store_artifacts(args.store, staging)
+                X, y = load_store_data(args.store)
+            else:
+                X, y = load_training_data(args.train, args.prep_cache, features, staging)
+            candidates = candidate_grid(args.regressors.split(","), args.alphas, args.l1_ratios)
+            model = train_search(X, y, candidates, args.folds, args.jobs, args.min_folds, args.prune_ratio)
+        elif not args.incremental:
+            model = train_full(args.train, args.prep_cache, features, staging)
+        elif args.new_listings:
+            # המודל והטרנספורמר מאותה גרסה ב-manifest, כך שהדירות החדשות נכנסות לאותו מרחב פיצ'רים
+            bundle = load_bundle()
+            carry_over = [name for name in COMPONENTS if name != "model"]
+            model, _ = train_warm(bundle.model, lambda: listing_batches(args.new_listings, bundle.pipeline,
+                                                                         args.batch_size), args.epochs)
+            if model is None:
+                return 1
+        elif args.store:
+            from feature_store import FeatureStore
+            store = FeatureStore.open(args.store)
+            stage_store_artifacts(args.store, staging)
+            batches = lambda: store_batches(store, args.batch_size)
+            if args.warm_start:
+                model, _ = train_warm(load_model(), batches, args.epochs)
+                if model is None:
+                    return 1
+            else:
+                model = incremental_model(args.alpha)
+                score = train_incremental(model, batches, args.epochs)
+                print(f"holdout: {score.format()}")
+        else:
+            parser.error("--incremental needs --store or --new-listings")
 
-# שלב 2: עיבוד מוקדם
-df_prepared = prepare_data(df, dataset_type='train')
+        # שלב 6: שמירה
+        with open(os.path.join(staging, MODEL_FILE), "wb") as f:
+            pickle.dump(model, f)
 
-# שלב 3: פיצול ל-X ו-y
-X = df_prepared.drop(columns='price')
-y = df_prepared['price']
+        # שלב 7: העברת הרכיבים למקומם ו-manifest עם גרסה ו-sha256 לכל אחד - נכתב אחרון,
+        # כדי שהשרת יטען רק סט שלם
+        manifest = publish(staging, carry_over=carry_over)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    print(f"גרסת מודל: {manifest['version']}")
 
-# שלב 4: הגדרת המודל עם cross-validation
-model = ElasticNetCV(
-    l1_ratio=0.1,                     # כמה L1 לעומת L2
-    alphas=[0.01, 0.1, 1, 10],        # אלפא candidates
-    cv=10,                            # 10 קיפולים
-    max_iter=10000,
-    random_state=42
-)
+    # שלב 8: ייצוא לחיזוי ב-NumPy בלבד - אחרי ה-manifest, כדי שהקובץ יישא את אותה גרסה
+    if args.export:
+        export_current(args.export)
 
-# שלב 5: אימון המודל
-model.fit(X, y)
+    print("✅ המודל אומן ונשמר בהצלחה.")
+    return 0
 
-# שלב 6: שמירה
-with open("trained_model.pkl", "wb") as f:
-    pickle.dump(model, f)
 
-print("✅ המודל אומן ונשמר בהצלחה.")
+if __name__ == "__main__":
+    sys.exit(main())
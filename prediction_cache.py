@@ -0,0 +1,95 @@
+import math
+import time
+import threading
+from collections import OrderedDict
+
+
+def record_key(record):
+    '''
+    מפתח קנוני לרשומה של listing_to_record: הכתובת כבר עברה clean_address,
+    המאפיינים פרוסים לדגלים (כלומר סט ממוין), ומספרים מנורמלים ל-float ו-NaN ל-None,
+    כך ש-"3" ו-3.0 מהטופס או מ-JSON נותנים את אותו מפתח.
+    '''
+    def canonical(val):
+        if isinstance(val, (bool, int, float)) or hasattr(val, "dtype"):
+            val = float(val)
+            return None if val != val else val
+        return val
+
+    return tuple((key, canonical(record[key])) for key in sorted(record))
+
+
+class PredictionCache:
+    '''
+    מטמון LRU עם TTL לתוצאות חיזוי, לפי record_key.
+    שייך לגרסת מודל אחת: כשהגרסה הפעילה משתנה (reload) המטמון מתרוקן.
+    maxsize=0 מבטל את המטמון.
+    '''
+
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _use_version(self, version):
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.version = version
+
+    def get(self, key, version):
+        '''
+        מחזירה את המחיר השמור, או None אם אין (או שפג תוקפו).
+        '''
+        if self.maxsize <= 0:
+            return None
+        with self._lock:
+            self._use_version(version)
+            entry = self._entries.get(key)
+            # מחיר שאינו מספר סופי לא אמור להישמר - אם נשמר בכל זאת, הוא נחשב כאילו אינו במטמון
+            if entry is not None and not math.isfinite(entry[0]):
+                entry = None
+                del self._entries[key]
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[1] < self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, version, value):
+        # רק מחיר סופי נשמר - NaN שנשמר היה חוזר מ-/api/predict כ-JSON לא תקין
+        if self.maxsize <= 0 or value is None or not math.isfinite(value):
+            return
+        with self._lock:
+            self._use_version(version)
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "invalidations": self.invalidations,
+                "model_version": self.version,
+            }
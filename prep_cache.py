@@ -0,0 +1,103 @@
+'''
+מטמון לפלט של prepare_data(dataset_type='train') על הדיסק.
+
+המפתח הוא sha256 של תוכן השורות (שמות העמודות, הסוגים והערכים, לפי הסדר) יחד עם גרסת הקוד
+של ההכנה - hash של קבצי המקור שמשפיעים על הפלט - וההגדרות שאינן בקוד: ספק המרחקים
+(ROUTES_API_KEY / DISTANCE_COORDS_FILE), הפיצ'רים וה-target encoding. כל שינוי באחד מהם נותן מפתח חדש.
+
+כל רשומה היא תיקייה prep_cache/<key>/:
+    features/   - ה-DataFrame המנורמל כ-FeatureStore (עמודה לקובץ .npy)
+    artifacts/  - הקבצים ש-prepare_data כותב ל-output_dir (encoder, scaler, pipeline וכו')
+בפגיעה הקבצים מועתקים חזרה ל-output_dir, כאילו prepare_data רץ, וה-DataFrame נבנה מהעמודות
+(FeatureStore.to_frame - עותק בזיכרון, לא תצוגה על הקבצים).
+'''
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import pandas as pd
+from feature_store import FeatureStore
+from model_registry import COMPONENTS
+from target_encoding import target_settings, TARGET_FOLDS, TARGET_SMOOTHING
+from distance_provider import get_default_provider
+
+# הקבצים ש-prepare_data(train) כותב - כל רכיבי המודל חוץ מהמודל עצמו
+PREP_ARTIFACTS = [f for name, f in COMPONENTS.items() if name != "model"]
+PIPELINE_SOURCES = ["assets_data_prep.py", "imputation.py", "inference_pipeline.py", "distance_provider.py",
+                    "category_encoder.py", "target_encoding.py", "feature_registry.py", "imputation_stats.py"]
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def pipeline_version():
+    digest = hashlib.sha256()
+    for name in PIPELINE_SOURCES:
+        with open(os.path.join(ROOT, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def content_hash(df):
+    digest = hashlib.sha256()
+    digest.update("\x1f".join(f"{c}:{t}" for c, t in df.dtypes.astype(str).items()).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def cache_key(df, features=None):
+    # רשימת פיצ'רים שאינה ברירת המחדל (ניסוי) היא חלק מהמפתח
+    key = f"{content_hash(df)[:24]}-{pipeline_version()}"
+    # המרחקים החסרים מושלמים מספק המרחקים - ספק אחר (או קובץ קואורדינטות אחר) נותן פלט אחר
+    provider = get_default_provider()
+    if provider is not None:
+        config = json.dumps(provider.config(), sort_keys=True, ensure_ascii=False)
+        key += "-" + hashlib.sha256(config.encode("utf-8")).hexdigest()[:8]
+    if features is not None:
+        key += "-" + hashlib.sha256(",".join(sorted(features)).encode("utf-8")).hexdigest()[:8]
+    # כך גם הגדרות target encoding מהסביבה (TARGET_FOLDS / TARGET_SMOOTHING) שאינן ברירת המחדל
+    folds, smoothing = target_settings()
+    if (folds, smoothing) != (TARGET_FOLDS, TARGET_SMOOTHING):
+        key += f"-te{folds}-{smoothing:g}"
+    return key
+
+
+class PrepCache:
+
+    def __init__(self, directory="prep_cache"):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def load(self, key, restore_to="."):
+        '''
+        מחזירה את ה-DataFrame השמור ומשחזרת את קבצי ההכנה ל-restore_to, או None אם אין רשומה.
+        '''
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return None
+        artifacts = os.path.join(path, "artifacts")
+        for name in os.listdir(artifacts):
+            shutil.copy2(os.path.join(artifacts, name), os.path.join(restore_to, name))
+        return FeatureStore.open(os.path.join(path, "features")).to_frame()
+
+    def save(self, key, df, artifacts_from="."):
+        '''
+        כותבת לתיקייה זמנית ומעבירה אותה למקומה בסוף, כך שרשומה חלקית לא נטענת לעולם.
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=self.directory)
+        try:
+            FeatureStore.write(os.path.join(staging, "features"), df, meta={"key": key})
+            os.makedirs(os.path.join(staging, "artifacts"))
+            for name in PREP_ARTIFACTS:
+                source = os.path.join(artifacts_from, name)
+                if os.path.exists(source):
+                    shutil.copy2(source, os.path.join(staging, "artifacts", name))
+            os.replace(staging, self.path(key))
+        except OSError:
+            # רשומה עם אותו מפתח נכתבה במקביל - היא זהה, אפשר לוותר על שלנו
+            if not os.path.isdir(self.path(key)):
+                raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
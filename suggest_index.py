@@ -0,0 +1,87 @@
+'''
+השלמה אוטומטית לכתובות ולשכונות בטופס (/api/suggest), מתוך רשימות הטופס של גרסת המודל (vocabularies).
+
+כל ערך נשמר במפתח מנורמל (normalize_hebrew) במערך ממוין, וחיפוש קידומת הוא bisect_left על המערך
+וסריקה קדימה עד k תוצאות - O(log n + k), לא תלוי בגודל הרשימה.
+קודם מוחזרים ערכים שמתחילים בטקסט ("אבן" -> "אבן גבירול"), ואחריהם ערכים שאחת המילים הפנימיות
+שלהם מתחילה בו ("גביר" -> "אבן גבירול").
+'''
+import re
+import unicodedata
+from bisect import bisect_left
+
+FIELDS = {"address": "addresses", "neighborhood": "neighborhoods"}
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+# ניקוד וטעמים, בלי המקף העברי (U+05BE) שבאמצע הטווח - הוא מפריד מילים (_SEPARATORS)
+_NIQQUD = re.compile("[\u0591-\u05BD\u05BF-\u05C7]")
+# אותיות סופיות -> רגילות, כדי ש"בן" יתאים גם ל"בנימין" בזמן ההקלדה
+_FINALS = str.maketrans("ךםןףץ", "כמנפצ")
+# גרש/גרשיים בכל הצורות שלהם -> ' ו-"
+_QUOTES = str.maketrans({"׳": "'", "`": "'", "´": "'", "’": "'", "‘": "'", "״": '"', "“": '"', "”": '"'})
+_SEPARATORS = re.compile(r"[\s\-־_/.,]+")
+
+
+def normalize_hebrew(text):
+    '''
+    מפתח להשוואה: בלי ניקוד, סופיות כרגילות, גרשיים אחידים, אותיות לטיניות קטנות,
+    ומקף/נקודה/רווחים כפולים כרווח אחד.
+    '''
+    text = unicodedata.normalize("NFKC", str(text))
+    text = _NIQQUD.sub("", text).translate(_FINALS).translate(_QUOTES).lower()
+    return _SEPARATORS.sub(" ", text).strip()
+
+
+class PrefixIndex:
+
+    def __init__(self, values):
+        values = sorted({str(v) for v in values if str(v).strip()})
+        starts, words = [], []
+        for value in values:
+            key = normalize_hebrew(value)
+            starts.append((key, value))
+            # כל מילה פנימית כמפתח נוסף
+            for match in re.finditer(" ", key):
+                words.append((key[match.end():], value))
+        starts.sort()
+        words.sort()
+        self._start_keys = [key for key, _ in starts]
+        self._start_values = [value for _, value in starts]
+        self._word_keys = [key for key, _ in words]
+        self._word_values = [value for _, value in words]
+
+    def __len__(self):
+        return len(self._start_keys)
+
+    @staticmethod
+    def _scan(keys, values, prefix, limit, found):
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and len(found) < limit and keys[i].startswith(prefix):
+            if values[i] not in found:
+                found[values[i]] = None
+            i += 1
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        '''
+        עד limit ערכים מקוריים (לא מנורמלים) שמתאימים לקידומת. טקסט ריק - הערכים הראשונים לפי הסדר.
+        '''
+        prefix = normalize_hebrew(query or "")
+        found = {}
+        self._scan(self._start_keys, self._start_values, prefix, limit, found)
+        if prefix:
+            self._scan(self._word_keys, self._word_values, prefix, limit, found)
+        return list(found)
+
+
+class SuggestIndex:
+    '''
+    PrefixIndex לכל שדה, לגרסת מודל אחת.
+    '''
+
+    def __init__(self, vocabularies, version=None):
+        self.version = version
+        self.fields = {field: PrefixIndex(vocabularies.get(key, [])) for field, key in FIELDS.items()}
+
+    def search(self, field, query, limit=DEFAULT_LIMIT):
+        return self.fields[field].search(query, limit)
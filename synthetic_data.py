@@ -0,0 +1,138 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+# דאטה סינתטי במבנה של train.csv - לבנצ'מרקים ולבדיקות ביצועים, לא לאימון אמיתי
+PROPERTY_TYPES = ['דירה', 'דירה', 'דירה', 'דירה להשכרה', 'דירת גן', 'דירת גן להשכרה', 'גג/פנטהאוז',
+                  'סטודיו/לופט', 'יחידת דיור', 'דופלקס', 'דו משפחתי', "פרטי/קוטג'", 'מחסן', 'חניה', None]
+FORM_FEATURES = ['מיזוג', 'משופצת', 'מרפסת', 'חניה', 'מעלית', 'סורגים',
+                 'ריהוט', 'ממ"ד', 'חיות מחמד', 'מחסן', 'גישה לנכים']
+
+
+def load_names(directory=os.path.dirname(os.path.abspath(__file__))):
+    '''
+    שמות שכונות ורחובות אמיתיים מתוך category_means.pkl, ואם אין - שמות גנריים.
+    '''
+    try:
+        with open(os.path.join(directory, "category_means.pkl"), "rb") as f:
+            category_means = pickle.load(f)
+        return list(category_means['neighborhood']), list(category_means['address'])
+    except FileNotFoundError:
+        return [f"שכונה {i}" for i in range(60)], [f"רחוב {i}" for i in range(400)]
+
+
+def generate(n, seed=0):
+    '''
+    n שורות במבנה של train.csv: קומות כמו "3 מתוך 5" / "קרקע" / "810", ערכים חסרים,
+    ארנונה חריגה, מרחקים בק"מ ומחירים לא הגיוניים - כל מה ש-prepare_data מנקה.
+    '''
+    rng = np.random.default_rng(seed)
+    neighs, streets = load_names()
+    neigh = rng.choice(np.array(neighs + [None], dtype=object), n)
+    street = rng.choice(np.array(streets, dtype=object), n)
+    num = rng.integers(1, 200, n)
+    addr = [f"{s} {k}" if r < 0.7 else (s if r < 0.85 else (None if r < 0.93 else str(k)))
+            for s, k, r in zip(street, num, rng.random(n))]
+
+    total = rng.integers(1, 30, n)
+    fl = rng.integers(0, 30, n) % (total + 1)
+    floor = []
+    for f, t, r in zip(fl, total, rng.random(n)):
+        if r < 0.4:
+            floor.append(f"{'קרקע' if f == 0 else f} מתוך {t}")
+        elif r < 0.55:
+            floor.append('קרקע' if f == 0 else str(f))
+        elif r < 0.6:
+            floor.append(f"{f}{t}")
+        elif r < 0.65:
+            floor.append(None)
+        elif r < 0.7:
+            floor.append(f"{f}.0")
+        else:
+            floor.append(str(f))
+    total_col = np.where(rng.random(n) < 0.5, total.astype(float), np.nan)
+
+    area = np.round(rng.gamma(6, 14, n))
+    rooms = np.round(np.clip(area / 25 + rng.normal(0, 0.7, n), 1, 8) * 2) / 2
+    rooms[rng.random(n) < 0.08] = 0
+    desc = np.where(rng.random(n) < 0.5, [f"דירה יפה {r} חדרים" for r in rooms], "דירה מעולה")
+
+    def num_col(p_nan, p_zero, scale):
+        v = np.round(rng.gamma(3, scale / 3, n))
+        v[rng.random(n) < p_zero] = 0
+        v[rng.random(n) < p_nan] = np.nan
+        return v
+
+    arnona = num_col(0.1, 0.1, 600)
+    arnona[rng.random(n) < 0.03] = 5000
+    dist = np.round(rng.gamma(2, 1500, n))
+    dist[rng.random(n) < 0.1] = np.nan
+    dist[rng.random(n) < 0.05] = np.round(rng.random() * 8, 1)
+    price = np.round(3000 + area * 60 + rooms * 500 + rng.normal(0, 1500, n), -1)
+    price[rng.random(n) < 0.01] = 500
+    price[rng.random(n) < 0.01] = 2_000_000
+    flag = lambda: rng.integers(0, 2, n)
+
+    return pd.DataFrame({
+        'property_type': rng.choice(np.array(PROPERTY_TYPES, dtype=object), n),
+        'neighborhood': neigh,
+        'address': addr,
+        'room_num': rooms,
+        'floor': floor,
+        'area': area,
+        'garden_area': num_col(0.6, 0.2, 40),
+        'days_to_enter': rng.integers(0, 60, n),
+        'num_of_payments': rng.integers(1, 12, n),
+        'monthly_arnona': arnona,
+        'building_tax': num_col(0.2, 0.2, 300),
+        'total_floors': total_col,
+        'description': desc,
+        'has_parking': flag(),
+        'has_storage': flag(),
+        'elevator': flag(),
+        'ac': flag(),
+        'handicap': flag(),
+        'has_bars': flag(),
+        'has_safe_room': flag(),
+        'has_balcony': flag(),
+        'is_furnished': flag(),
+        'is_renovated': flag(),
+        'price': price,
+        'num_of_images': rng.integers(0, 20, n),
+        'distance_from_center': dist,
+    })
+
+
+def generate_listings(n, seed=0):
+    '''
+    n רשומות במבנה של הטופס / של /api/predict (ערכים כמחרוזות, כמו שהדפדפן שולח).
+    '''
+    rng = np.random.default_rng(seed)
+    neighs, streets = load_names()
+    listings = []
+    for _ in range(n):
+        total = int(rng.integers(1, 30))
+        listing = {
+            'property_type': str(rng.choice(['דירה', 'דירת גן', 'גג/פנטהאוז', 'סטודיו/לופט', 'דופלקס'])),
+            'room_number': str(float(rng.choice([1, 1.5, 2, 2.5, 3, 3.5, 4, 5]))),
+            'floor': str(int(rng.integers(1, total + 1))),
+            'total_floors': str(total),
+            'area': str(int(rng.integers(20, 200))),
+            'monthly_arnona': str(int(rng.integers(0, 1500))),
+            'building_tax': str(int(rng.integers(0, 500))),
+            'garden_area': '',
+            'features': [f for f in FORM_FEATURES if rng.random() < 0.4],
+        }
+        if rng.random() < 0.7:
+            listing['address'] = str(rng.choice(streets))
+        else:
+            listing['neighborhood'] = str(rng.choice(neighs))
+        listings.append(listing)
+    return listings
+
+
+if __name__ == '__main__':
+    import sys
+    generate(int(sys.argv[1]) if len(sys.argv) > 1 else 2000).to_csv(
+        sys.argv[2] if len(sys.argv) > 2 else 'synthetic_train.csv', index=False)
@@ -0,0 +1,134 @@
+'''
+Target encoding לשכונה ולכתובת: ממוצע מחיר מוחלק לפי מספר הדירות, ובאימון - out-of-fold.
+
+ממוצע מוחלק של קבוצה עם n דירות וסכום מחירים s, לכיוון prior:
+    (s + m * prior) / (n + m)
+לשכונה ה-prior הוא הממוצע הכללי, לכתובת - הממוצע המוחלק של השכונה. כך רחוב עם דירה אחת
+מקבל בעיקר את ממוצע השכונה, ורחוב עם מאות דירות - את הממוצע שלו.
+
+באימון כל שורה מקודדת מהדירות שלא באותו fold שלה (K folds אקראיים), כדי שהמחיר של הדירה עצמה
+לא ייכנס לפיצ'ר שלה. הסכומים לכל (קבוצה, fold) מחושבים ב-bincount אחד, וה-out-of-fold הוא
+הסה"כ פחות ה-fold - בלי לולאות על שורות או על folds.
+
+הקידוד שנשמר לחיזוי (category_means.pkl / category_encoder.npy) הוא אותה נוסחה על כל הדאטה.
+ה-prior של כתובת שנשמרת הוא ממוצע השכונות של הדירות בה, כי בחיזוי לכתובת יש ערך אחד.
+folds=0 ו-smoothing=0 מחזירים את ממוצעי הקבוצות הרגילים (הקידוד הקודם).
+בלי ערכים מפורשים הם נקראים מהסביבה בכל קריאה, כך שאפשר לנסות אותם בכל מסלולי ההכנה:
+    TARGET_FOLDS=0 TARGET_SMOOTHING=0 python model_training.py
+ה-prior הכללי נשמר ב-category_means['prior'] - הערך של שכונה שלא הופיעה באימון (CategoryEncoder).
+'''
+import os
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+TARGET_FOLDS = 5
+TARGET_SMOOTHING = 10.0
+TARGET_SEED = 42
+FOLDS_ENV = "TARGET_FOLDS"
+SMOOTHING_ENV = "TARGET_SMOOTHING"
+
+
+def target_settings():
+    '''
+    (folds, smoothing) מ-TARGET_FOLDS ו-TARGET_SMOOTHING בסביבה, או ברירות המחדל.
+    '''
+    return (int(os.environ.get(FOLDS_ENV) or TARGET_FOLDS),
+            float(os.environ.get(SMOOTHING_ENV) or TARGET_SMOOTHING))
+
+
+def _smooth(sums, counts, prior, smoothing):
+    # קבוצה בלי דירות (למשל כולן באותו fold, בלי החלקה) מקבלת את ה-prior
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts + smoothing > 0, (sums + smoothing * prior) / (counts + smoothing), prior)
+
+
+def smoothed_category_means(neighborhood_sums, neighborhood_counts, address_sums, address_counts,
+                            address_neighborhoods, smoothing=None):
+    '''
+    הקידוד לחיזוי מסכומים ומספרים לכל מפתח (מילונים), במבנה של category_means.pkl.
+    address_neighborhoods - כתובת -> Counter של השכונות של הדירות בה.
+    '''
+    if smoothing is None:
+        smoothing = target_settings()[1]
+    global_mean = sum(neighborhood_sums.values()) / sum(neighborhood_counts.values())
+    neighborhoods = {k: float(_smooth(s, neighborhood_counts[k], global_mean, smoothing))
+                     for k, s in neighborhood_sums.items()}
+    addresses = {}
+    for key, total in address_sums.items():
+        counts = address_neighborhoods.get(key)
+        prior = (sum(neighborhoods[n] * c for n, c in counts.items()) / sum(counts.values())
+                 if counts else global_mean)
+        addresses[key] = float(_smooth(total, address_counts[key], prior, smoothing))
+    return {'neighborhood': neighborhoods, 'address': addresses, 'prior': float(global_mean)}
+
+
+def fold_ids(n, folds=TARGET_FOLDS, seed=TARGET_SEED):
+    return np.random.default_rng(seed).permutation(n) % folds
+
+
+def _group_sums(codes, n_keys, fold, folds, weights):
+    # מטריצה (מפתח x fold) של סכומים - bincount אחד על codes * folds + fold
+    flat = np.bincount(codes * folds + fold, weights=weights, minlength=n_keys * folds)
+    return flat.reshape(n_keys, folds)
+
+
+def target_encode(neighborhoods, addresses, y, folds=None, smoothing=None, seed=TARGET_SEED):
+    '''
+    מחזירה (neighborhood_encoded, address_encoded, category_means):
+    שני מערכים באורך השורות (out-of-fold באימון) והמילונים לחיזוי.
+    שורה בלי שכונה/כתובת מקבלת NaN, כמו ב-Series.map.
+    folds / smoothing - None: לפי target_settings().
+    '''
+    default_folds, default_smoothing = target_settings()
+    folds = default_folds if folds is None else folds
+    smoothing = default_smoothing if smoothing is None else smoothing
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    neighborhood_codes, neighborhood_keys = pd.factorize(pd.Series(neighborhoods, dtype=object))
+    address_codes, address_keys = pd.factorize(pd.Series(addresses, dtype=object))
+    nb_valid, ad_valid = neighborhood_codes >= 0, address_codes >= 0
+    valid = nb_valid & ad_valid
+    neighborhood_sums = np.bincount(neighborhood_codes[nb_valid], y[nb_valid], len(neighborhood_keys))
+    neighborhood_counts = np.bincount(neighborhood_codes[nb_valid], minlength=len(neighborhood_keys))
+    address_sums = np.bincount(address_codes[ad_valid], y[ad_valid], len(address_keys))
+    address_counts = np.bincount(address_codes[ad_valid], minlength=len(address_keys))
+    pairs = pd.Series(neighborhood_codes[valid]).groupby(address_codes[valid]).value_counts()
+    address_neighborhoods = {}
+    for (address, neighborhood), count in pairs.items():
+        address_neighborhoods.setdefault(address_keys[address], Counter())[neighborhood_keys[neighborhood]] = count
+    category_means = smoothed_category_means(
+        dict(zip(neighborhood_keys, neighborhood_sums)), dict(zip(neighborhood_keys, neighborhood_counts)),
+        dict(zip(address_keys, address_sums)), dict(zip(address_keys, address_counts)),
+        address_neighborhoods, smoothing)
+
+    neighborhood_encoded = np.full(n, np.nan)
+    address_encoded = np.full(n, np.nan)
+    if folds and folds > 1:
+        fold = fold_ids(n, folds, seed)
+        nb_codes, ad_codes = neighborhood_codes[nb_valid], address_codes[ad_valid]
+        nb_sums = _group_sums(nb_codes, len(neighborhood_keys), fold[nb_valid], folds, y[nb_valid])
+        nb_counts = _group_sums(nb_codes, len(neighborhood_keys), fold[nb_valid], folds, None)
+        ad_sums = _group_sums(ad_codes, len(address_keys), fold[ad_valid], folds, y[ad_valid])
+        ad_counts = _group_sums(ad_codes, len(address_keys), fold[ad_valid], folds, None)
+        fold_sums = np.bincount(fold, y, folds)
+        fold_counts = np.bincount(fold, minlength=folds)
+
+        # מה שמחוץ ל-fold של השורה = הסה"כ פחות ה-fold שלה
+        global_out = (fold_sums.sum() - fold_sums[fold]) / (fold_counts.sum() - fold_counts[fold])
+        rows = np.flatnonzero(nb_valid)
+        neighborhood_encoded[rows] = _smooth(
+            neighborhood_sums[nb_codes] - nb_sums[nb_codes, fold[rows]],
+            neighborhood_counts[nb_codes] - nb_counts[nb_codes, fold[rows]], global_out[rows], smoothing)
+        rows = np.flatnonzero(ad_valid)
+        # prior של כתובת בשורה = הקידוד (out-of-fold) של השכונה של אותה שורה
+        prior = np.where(nb_valid[rows], neighborhood_encoded[rows], global_out[rows])
+        address_encoded[rows] = _smooth(
+            address_sums[ad_codes] - ad_sums[ad_codes, fold[rows]],
+            address_counts[ad_codes] - ad_counts[ad_codes, fold[rows]], prior, smoothing)
+    else:
+        neighborhood_encoded[nb_valid] = np.array(
+            [category_means['neighborhood'][k] for k in neighborhood_keys])[neighborhood_codes[nb_valid]]
+        address_encoded[ad_valid] = np.array(
+            [category_means['address'][k] for k in address_keys])[address_codes[ad_valid]]
+    return neighborhood_encoded, address_encoded, category_means
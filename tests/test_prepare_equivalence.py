@@ -0,0 +1,159 @@
+'''
+process_floors הווקטורי מול המימוש המקורי (לולאות לכל שורה וסינון הטבלה לכל קומה חסרה).
+
+ההשוואה רצה על train.csv מתיקיית הפרויקט כשהוא קיים, ותמיד על טבלה קבועה עם מקרי הקצה
+('קרקע', עשרוניים, '810' עם 10 קומות, 'X מתוך' בלי סה"כ, כתובות בלי רחוב) ועל דאטה סינתטי
+עם seed קבוע (synthetic_data.py) בגודל ובפיזור של train.csv.
+test_prepare_data_train משווה את כל prepare_data(train) עם שני המימושים.
+
+    python -m pytest -q tests
+'''
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import assets_data_prep  # noqa: E402
+import synthetic_data  # noqa: E402
+
+TRAIN_CSV = os.path.join(ROOT, "train.csv")
+
+
+def _reference_extract_street(address):
+    if pd.isnull(address):
+        return None
+    match = re.match(r'^(.+?)(?:\s+\d+.*)?$', str(address).strip())
+    return match.group(1).strip() if match else address
+
+
+def reference_process_floors(df):
+    '''
+    process_floors כפי שהיה לפני הגרסה הווקטורית.
+    '''
+    floors = []
+    totals = []
+    for val in df['floor'].astype(str):
+        if "מתוך" in val:
+            parts = val.split("מתוך")
+            floor_part = parts[0].strip()
+            total_part = parts[1].strip()
+            floor_val = 0 if "קרקע" in floor_part else int(float(floor_part)) if floor_part.replace('.', '', 1).isdigit() else np.nan
+            total_val = 0 if "קרקע" in total_part else int(float(total_part)) if total_part.replace('.', '', 1).isdigit() else np.nan
+        else:
+            floor_val = 0 if "קרקע" in val else int(float(val)) if val.replace('.', '', 1).isdigit() else np.nan
+            total_val = np.nan
+        floors.append(floor_val)
+        totals.append(total_val)
+    df['floor'] = floors
+    if 'total_floors' in df.columns:
+        missing_mask = df['total_floors'].isnull() | (df['total_floors'] == '')
+        df.loc[missing_mask, 'total_floors'] = pd.Series(totals)[missing_mask].values
+    else:
+        df['total_floors'] = totals
+
+    mask = (
+        df["floor"].notna() &
+        df["total_floors"].notna() &
+        (df["floor"] > df["total_floors"])
+    )
+    for idx in df[mask].index:
+        floor_str = str(int(df.at[idx, "floor"]))
+        total_str = str(int(df.at[idx, "total_floors"]))
+        if floor_str.endswith(total_str):
+            try:
+                df.at[idx, "floor"] = int(floor_str[:len(floor_str) - len(total_str)])
+            except ValueError:
+                pass
+
+    mask_missing_total = df['total_floors'].isnull() & df['floor'].notnull()
+    df.loc[mask_missing_total, 'total_floors'] = df.loc[mask_missing_total, 'floor']
+
+    df['street_only'] = df['address'].apply(_reference_extract_street)
+    for col in ['floor', 'total_floors']:
+        mask_na = df[col].isnull() & df['street_only'].notnull()
+        for idx in df[mask_na].index:
+            street = df.at[idx, 'street_only']
+            relevant = df[(df['street_only'] == street) & df[col].notnull()]
+            if not relevant.empty:
+                df.at[idx, col] = relevant[col].median()
+    df = df.drop(columns=['street_only'])
+
+    problem_rows = df['floor'] > df['total_floors']
+    df.loc[problem_rows, 'floor'] = df.loc[problem_rows, 'total_floors']
+    return df
+
+
+def edge_case_frame(n=400, seed=0):
+    '''
+    טבלה בצורה של train.csv, עם כל צורות הקומה שמופיעות בדאטה.
+    '''
+    rng = np.random.default_rng(seed)
+    streets = ['דיזנגוף', 'אבן גבירול', 'בן יהודה', 'לאונרדו דה וינצי', 'פינסקר', 'אלנבי']
+    neighborhoods = ['הצפון הישן', 'לב תל אביב', 'פלורנטין', None]
+    floor_forms = ['{f} מתוך {t}', 'קרקע מתוך {t}', '{f}', '{f}.0', 'קרקע', '{f}{t}', '{f} מתוך', '', 'abc', None]
+    rows = []
+    for i in range(n):
+        total = int(rng.integers(1, 25))
+        floor = int(rng.integers(0, total + 1))
+        form = floor_forms[i % len(floor_forms)]
+        street = streets[int(rng.integers(len(streets)))]
+        address = [f"{street} {int(rng.integers(1, 150))}", street, None, str(int(rng.integers(1, 99)))][i % 4]
+        rows.append({
+            'property_type': ['דירה', 'דירה להשכרה', 'דירת גן', 'גג/פנטהאוז', "פרטי/קוטג'"][i % 5],
+            'neighborhood': neighborhoods[i % len(neighborhoods)],
+            'address': address,
+            'room_num': [0, 2.0, 3.0, 4.5][i % 4],
+            'floor': form.format(f=floor, t=total) if form is not None else None,
+            'area': float(rng.integers(15, 160)),
+            'garden_area': [np.nan, 0.0, 30.0][i % 3],
+            'monthly_arnona': [0.0, 50.0, 450.0, np.nan, 2500.0][i % 5],
+            'building_tax': [np.nan, 0.0, 150.0, 300.0][i % 4],
+            'total_floors': [np.nan, float(total)][i % 2 if i % 7 else 0],
+            'description': ['דירה יפה 3 חדרים', '', None][i % 3],
+            'has_parking': i % 2, 'has_storage': 0, 'elevator': (i // 2) % 2, 'ac': 1, 'handicap': 0,
+            'has_bars': 0, 'has_safe_room': (i // 3) % 2, 'has_balcony': (i // 5) % 2,
+            'is_furnished': (i // 7) % 2, 'is_renovated': (i // 11) % 2,
+            'price': float(rng.integers(2500, 20000)),
+            'num_of_images': 5, 'days_to_enter': 0, 'num_of_payments': 12,
+            'distance_from_center': [0.0, 1.7, 2500.0][i % 3],
+        })
+    return pd.DataFrame(rows)
+
+
+def _frames():
+    frames = [pytest.param(edge_case_frame, id="edge_cases"),
+              pytest.param(lambda: synthetic_data.generate(2000, seed=0), id="synthetic")]
+    frames.append(pytest.param(lambda: pd.read_csv(TRAIN_CSV), id="train_csv", marks=pytest.mark.skipif(
+        not os.path.exists(TRAIN_CSV), reason="train.csv is not in the project directory")))
+    return frames
+
+
+@pytest.mark.parametrize("make_frame", _frames())
+def test_process_floors(make_frame):
+    df = make_frame()
+    expected = reference_process_floors(df.copy())
+    result = assets_data_prep.process_floors(df.copy())
+    pd.testing.assert_frame_equal(result[['floor', 'total_floors']].astype(float),
+                                  expected[['floor', 'total_floors']].astype(float))
+    pd.testing.assert_frame_equal(result.drop(columns=['floor', 'total_floors']),
+                                  expected.drop(columns=['floor', 'total_floors']))
+
+
+@pytest.mark.parametrize("make_frame", _frames())
+def test_prepare_data_train(make_frame, tmp_path, monkeypatch):
+    # prepare_data(train) כותב את רכיבי המודל לתיקייה הנוכחית
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("ROUTES_API_KEY", raising=False)
+    monkeypatch.delenv("DISTANCE_COORDS_FILE", raising=False)
+    df = make_frame()
+    result = assets_data_prep.prepare_data(df.copy(), 'train')
+    monkeypatch.setattr(assets_data_prep, "process_floors",
+                        lambda frame, street_medians=None: reference_process_floors(frame))
+    expected = assets_data_prep.prepare_data(df.copy(), 'train')
+    pd.testing.assert_frame_equal(result, expected)
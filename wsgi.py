@@ -0,0 +1,10 @@
+'''
+נקודת הכניסה של שרת WSGI בפרודקשן:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+רכיבי המודל נטענים כאן, בייבוא - עם preload_app זה קורה פעם אחת בתהליך האב לפני ה-fork.
+'''
+from api import create_app
+
+app = create_app()